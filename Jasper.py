@@ -8,6 +8,7 @@ import logging
 
 import yaml
 import argparse
+from concurrent import futures
 
 from client import tts
 from client import stt
@@ -104,10 +105,22 @@ class Jasper(object):
                            "to '%s'", tts_engine_slug)
         tts_engine_class = tts.get_engine_by_slug(tts_engine_slug)
 
+        # Compile both vocabularies concurrently. The passive vocabulary is
+        # submitted first and it's the only one we wait for, so that Jasper
+        # can listen for his keyword while the active vocabulary is still
+        # being compiled in the background.
+        executor = futures.ProcessPoolExecutor(max_workers=2)
+        passive_stt_engine = \
+            stt_passive_engine_class.get_passive_instance_async(executor)
+        active_stt_engine = \
+            stt_engine_class.get_active_instance_async(executor)
+        executor.shutdown(wait=False)
+
         # Initialize Mic
         self.mic = Mic(tts_engine_class.get_instance(),
-                       stt_passive_engine_class.get_passive_instance(),
-                       stt_engine_class.get_active_instance())
+                       passive_stt_engine.result(),
+                       stt.DeferredSTTEngine(active_stt_engine),
+                       barge_in=bool(self.config.get('barge_in', False)))
 
     def run(self):
         salutation = "How can I be of service?"
@@ -1,9 +1,33 @@
 # -*- coding: utf-8-*-
+import os
+import json
+import time
+import errno
+import hashlib
+import logging
+import tempfile
+import threading
+import contextlib
+import cPickle as pickle
+import socket
+import sys
+import Queue
 import smtplib
 from email.MIMEText import MIMEText
+import urllib
 import urllib2
 import re
+import requests
+from collections import OrderedDict
+from concurrent import futures
 from pytz import timezone
+import jasperpath
+
+# Seconds to wait for TinyURL
+TINYURL_TIMEOUT = 10
+
+# Maximum number of URLs that are compressed at the same time
+TINYURL_WORKERS = 5
 
 
 def sendEmail(SUBJECT, BODY, TO, FROM, SENDER, PASSWORD, SMTP_SERVER):
@@ -20,12 +44,121 @@ def sendEmail(SUBJECT, BODY, TO, FROM, SENDER, PASSWORD, SMTP_SERVER):
     msg['To'] = TO
     msg['Subject'] = SUBJECT
 
-    SMTP_PORT = 587
-    session = smtplib.SMTP(SMTP_SERVER, SMTP_PORT)
-    session.starttls()
-    session.login(FROM, PASSWORD)
-    session.sendmail(SENDER, TO, msg.as_string())
-    session.quit()
+    getMailer(SMTP_SERVER, FROM, PASSWORD).send(
+        SENDER, TO, msg.as_string()).result()
+
+
+class Mailer(object):
+    """
+    Sends emails through an SMTP server, one after another from a queue.
+    The connection is kept open between emails, so sending several of them
+    in a row only logs in once. It's closed after IDLE_TIMEOUT seconds
+    without emails.
+    """
+
+    PORT = 587
+
+    # Seconds an unused connection is kept open
+    IDLE_TIMEOUT = 60
+
+    def __init__(self, server, user, password):
+        self._logger = logging.getLogger(__name__)
+        self.server = server
+        self.user = user
+        self.password = password
+        self._queue = Queue.Queue()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._session = None
+
+    def send(self, sender, to, msg):
+        """
+        Queues an email to be sent.
+
+        Arguments:
+            sender -- the From address
+            to -- the recipient address
+            msg -- the email as a string
+
+        Returns:
+            A future that is done when the email has been sent
+        """
+        future = futures.Future()
+        with self._lock:
+            self._queue.put((future, sender, to, msg))
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run,
+                                                name='Mailer')
+                self._thread.daemon = True
+                self._thread.start()
+        return future
+
+    def _connect(self):
+        self._logger.debug("Connecting to %s", self.server)
+        session = smtplib.SMTP(self.server, self.PORT)
+        session.starttls()
+        session.login(self.user, self.password)
+        self._session = session
+
+    def _close(self):
+        if self._session is None:
+            return
+        try:
+            self._session.quit()
+        except (smtplib.SMTPException, socket.error):
+            pass
+        self._session = None
+
+    def _sendmail(self, sender, to, msg):
+        if self._session is not None:
+            try:
+                self._session.sendmail(sender, to, msg)
+                return
+            except (smtplib.SMTPServerDisconnected, socket.error):
+                # The server may have closed the connection in the meantime
+                self._logger.debug("Lost connection to %s, reconnecting",
+                                   self.server)
+                self._session = None
+        self._connect()
+        self._session.sendmail(sender, to, msg)
+
+    def _run(self):
+        while True:
+            try:
+                future, sender, to, msg = self._queue.get(
+                    timeout=self.IDLE_TIMEOUT)
+            except Queue.Empty:
+                with self._lock:
+                    if self._queue.empty():
+                        self._thread = None
+                        self._close()
+                        return
+                continue
+
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                self._sendmail(sender, to, msg)
+            except BaseException:
+                self._close()
+                future.set_exception_info(*sys.exc_info()[1:])
+            else:
+                future.set_result(True)
+
+
+_mailers = {}
+_mailersLock = threading.Lock()
+
+
+def getMailer(server, user, password):
+    """
+    Returns the shared Mailer for an SMTP account.
+    """
+    key = (server, user, password)
+    with _mailersLock:
+        if key not in _mailers:
+            _mailers[key] = Mailer(server, user, password)
+        return _mailers[key]
 
 
 def emailUser(profile, SUBJECT="", BODY=""):
@@ -95,18 +228,129 @@ def getTimezone(profile):
         return None
 
 
-def generateTinyURL(URL):
+def fetchTinyURL(URL):
     """
-    Generates a compressed URL.
+    Asks TinyURL for a compressed URL.
 
     Arguments:
         URL -- the original URL to-be compressed
     """
-    target = "http://tinyurl.com/api-create.php?url=" + URL
-    response = urllib2.urlopen(target)
+    if isinstance(URL, unicode):
+        URL = URL.encode('utf-8')
+    target = ("http://tinyurl.com/api-create.php?url=" +
+              urllib.quote(URL, safe=''))
+    response = urllib2.urlopen(target, timeout=TINYURL_TIMEOUT)
     return response.read()
 
 
+class TinyURLCache(object):
+    """
+    Remembers compressed URLs, which never change, in a single file. Only
+    the MAX_SIZE most recently used URLs are kept.
+    """
+
+    MAX_SIZE = 1000
+
+    def __init__(self, fname=None):
+        """
+        Arguments:
+            fname -- the file to keep the URLs in, memory only if None
+        """
+        self._logger = logging.getLogger(__name__)
+        self.fname = fname
+        self._urls = None
+        self._lock = threading.Lock()
+
+    def _load(self):
+        # Called with the lock held; the file is only read when needed
+        if self._urls is not None:
+            return
+        self._urls = OrderedDict()
+        if self.fname is None or not os.path.exists(self.fname):
+            return
+        try:
+            with open(self.fname, 'r') as f:
+                pairs = json.load(f)
+            self._urls.update((URL, tinyURL) for URL, tinyURL in pairs)
+        except (IOError, ValueError, TypeError):
+            self._logger.warning("Ignoring broken TinyURL cache '%s'",
+                                 self.fname, exc_info=True)
+
+    def get(self, URL):
+        """
+        Returns the compressed URL, or None if URL isn't in the cache.
+        """
+        with self._lock:
+            self._load()
+            tinyURL = self._urls.pop(URL, None)
+            if tinyURL is not None:
+                self._urls[URL] = tinyURL
+            return tinyURL
+
+    def update(self, tinyURLs):
+        """
+        Adds compressed URLs and writes the cache file.
+
+        Arguments:
+            tinyURLs -- a dict of the original URLs and their compressed
+                        URLs
+        """
+        with self._lock:
+            self._load()
+            for URL, tinyURL in tinyURLs.items():
+                self._urls.pop(URL, None)
+                self._urls[URL] = tinyURL
+            while len(self._urls) > self.MAX_SIZE:
+                self._urls.popitem(last=False)
+            if self.fname is None:
+                return
+            try:
+                writeJSON(self.fname, self._urls.items())
+            except (IOError, OSError):
+                self._logger.warning("Couldn't write TinyURL cache '%s'",
+                                     self.fname, exc_info=True)
+
+
+_tinyURLCache = TinyURLCache(jasperpath.config('tinyurls.json'))
+
+
+def generateTinyURL(URL):
+    """
+    Generates a compressed URL. URLs that have been compressed before are
+    taken from the cache.
+
+    Arguments:
+        URL -- the original URL to-be compressed
+    """
+    return generateTinyURLs([URL])[0]
+
+
+def generateTinyURLs(URLs):
+    """
+    Generates compressed URLs for several URLs at the same time. URLs that
+    have been compressed before are taken from the cache.
+
+    Arguments:
+        URLs -- a list of the original URLs
+
+    Returns:
+        A list of the compressed URLs, in the same order
+    """
+    tinyURLs = {}
+    for URL in URLs:
+        tinyURL = _tinyURLCache.get(URL)
+        if tinyURL is not None:
+            tinyURLs[URL] = tinyURL
+    missing = sorted(set(URL for URL in URLs if URL not in tinyURLs))
+    if missing:
+        workers = min(len(missing), TINYURL_WORKERS)
+        with futures.ThreadPoolExecutor(max_workers=workers) as executor:
+            new = dict(zip(missing, executor.map(fetchTinyURL, missing)))
+        _tinyURLCache.update(new)
+        tinyURLs.update(new)
+    return [tinyURLs[URL] for URL in URLs]
+
+
 def isNegative(phrase):
     """
     Returns True if the input phrase has a negative sentiment.
@@ -126,3 +370,303 @@ def isPositive(phrase):
         phrase -- the input phrase to-be evaluated
     """
     return bool(re.search(r'\b(sure|yes|yeah|go)\b', phrase, re.IGNORECASE))
+
+
+@contextlib.contextmanager
+def atomicWrite(fname, mode='w'):
+    """
+    Opens a temporary file next to fname for writing and renames it to
+    fname once the block is done, so that a crash never leaves a half
+    written file behind.
+
+    Raises:
+        IOError or OSError if the file couldn't be written
+    """
+    fd, tmp_fname = tempfile.mkstemp(dir=os.path.dirname(fname),
+                                     prefix='.tmp-')
+    try:
+        with os.fdopen(fd, mode) as f:
+            yield f
+        os.rename(tmp_fname, fname)
+    except:
+        os.remove(tmp_fname)
+        raise
+
+
+def writeJSON(fname, data):
+    """
+    Writes data to fname as JSON, atomically.
+
+    Raises:
+        IOError or OSError if the file couldn't be written
+    """
+    with atomicWrite(fname) as f:
+        json.dump(data, f)
+
+
+class PickleStore(object):
+    """
+    Keeps pickled entries on disk, one file per key. An entry is a tuple
+    whose first item is its key.
+    """
+
+    def __init__(self, path):
+        """
+        Arguments:
+            path -- the directory to keep entries in
+        """
+        self._logger = logging.getLogger(__name__)
+        self.path = path
+
+    def _get_fname(self, key):
+        if isinstance(key, unicode):
+            key = key.encode('utf-8')
+        return os.path.join(self.path,
+                            hashlib.sha1(key).hexdigest() + '.pickle')
+
+    def load(self, key):
+        """
+        Returns the entry for key, or None if there is none.
+        """
+        try:
+            with open(self._get_fname(key), 'rb') as f:
+                entry = pickle.load(f)
+        except IOError:
+            return None
+        except Exception:
+            self._logger.warning("Ignoring broken cache entry for '%s'", key,
+                                 exc_info=True)
+            return None
+        # The file name is only a hash, so make sure it's the right entry
+        return entry if entry[0] == key else None
+
+    def store(self, key, entry):
+        """
+        Writes the entry for key atomically.
+
+        Raises:
+            IOError or OSError if the entry couldn't be written
+        """
+        try:
+            os.makedirs(self.path)
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+        with atomicWrite(self._get_fname(key), 'wb') as f:
+            pickle.dump(entry, f, pickle.HIGHEST_PROTOCOL)
+
+
+class ResponseCache(object):
+    """
+    Caches data fetched from the network. Values younger than their TTL are
+    returned as they are. Stale values are returned as well (as long as
+    they are not older than max_stale on top of that), but a fresh one is
+    fetched in the background for the next time. Values are also kept on
+    disk, so that they survive restarts; they need to be picklable, so
+    plain data (lists, dicts, strings, ...) is best. None is never cached,
+    so fetch functions can return it if they failed.
+    """
+
+    def __init__(self, path=None):
+        """
+        Arguments:
+            path -- the directory to keep values in, memory only if None
+        """
+        self._logger = logging.getLogger(__name__)
+        self.path = path
+        self._store = PickleStore(path) if path is not None else None
+        self._entries = {}
+        self._refreshing = set()
+        self._lock = threading.Lock()
+
+    def _load(self, key):
+        if self._store is None:
+            return None
+        return self._store.load(key)
+
+    def _fetch(self, key, fetch):
+        value = fetch()
+        if value is None:
+            # Nothing could be fetched, which is not worth keeping
+            return value
+        entry = (key, time.time(), value)
+        with self._lock:
+            self._entries[key] = entry
+        if self._store is None:
+            return value
+        try:
+            self._store.store(key, entry)
+        except (IOError, OSError):
+            self._logger.warning("Couldn't write cache entry for '%s'", key,
+                                 exc_info=True)
+        return value
+
+    def _refresh(self, key, fetch):
+        try:
+            self._fetch(key, fetch)
+        except Exception:
+            self._logger.warning("Couldn't refresh '%s', keeping the " +
+                                 "stale value", key, exc_info=True)
+        finally:
+            with self._lock:
+                self._refreshing.discard(key)
+
+    def get(self, key, fetch, ttl, max_stale=24 * 60 * 60, refresh=False):
+        """
+        Returns a cached value or, if there is none, fetches it.
+
+        Arguments:
+            key -- a string that identifies the value
+            fetch -- a callable that returns the value
+            ttl -- the number of seconds a value is fresh
+            max_stale -- the number of seconds after ttl that a stale value
+                         is still returned
+            refresh -- if True, the value is fetched even if there is a
+                       fresh one
+        """
+        if refresh:
+            return self._fetch(key, fetch)
+
+        with self._lock:
+            entry = self._entries.get(key)
+        if entry is None:
+            entry = self._load(key)
+            if entry is not None:
+                with self._lock:
+                    self._entries.setdefault(key, entry)
+
+        if entry is not None:
+            age = time.time() - entry[1]
+            if age < ttl:
+                return entry[2]
+            if age < ttl + max_stale:
+                with self._lock:
+                    if key in self._refreshing:
+                        return entry[2]
+                    self._refreshing.add(key)
+                thread = threading.Thread(target=self._refresh,
+                                          args=(key, fetch))
+                thread.daemon = True
+                thread.start()
+                return entry[2]
+
+        return self._fetch(key, fetch)
+
+
+_responseCache = ResponseCache(jasperpath.config('cache'))
+
+
+def getCached(key, fetch, ttl, max_stale=24 * 60 * 60, refresh=False):
+    """
+    Returns data from the shared ResponseCache, fetching it if necessary.
+
+    Arguments:
+        key -- a string that identifies the data
+        fetch -- a callable that returns the data, which needs to be
+                 picklable
+        ttl -- the number of seconds the data is fresh
+        max_stale -- the number of seconds after ttl that stale data is
+                     still returned (while it's refreshed in the background)
+        refresh -- if True, the data is fetched even if it's still fresh
+    """
+    return _responseCache.get(key, fetch, ttl, max_stale, refresh)
+
+
+class ConditionalFetcher(object):
+    """
+    Fetches URLs with conditional GET requests. The validators of a
+    response (its ETag and Last-Modified headers) are kept along with the
+    parsed content, so if the server answers 304 Not Modified later on,
+    nothing needs to be downloaded or parsed again. Responses are requested
+    gzip-compressed.
+    """
+
+    # Seconds to wait for the server
+    TIMEOUT = 10
+
+    def __init__(self, path=None):
+        """
+        Arguments:
+            path -- the directory to keep parsed responses in, memory only
+                    if None
+        """
+        self._logger = logging.getLogger(__name__)
+        self._store = PickleStore(path) if path is not None else None
+        self._entries = {}
+        self._lock = threading.Lock()
+        self._session = requests.Session()
+        self._session.headers['Accept-Encoding'] = 'gzip'
+
+    def _get_entry(self, url):
+        with self._lock:
+            entry = self._entries.get(url)
+        if entry is None and self._store is not None:
+            entry = self._store.load(url)
+            if entry is not None:
+                with self._lock:
+                    self._entries.setdefault(url, entry)
+        return entry
+
+    def fetch(self, url, parse, headers=None):
+        """
+        Returns the parsed content of a URL.
+
+        Arguments:
+            url -- the URL to fetch
+            parse -- a callable that takes the content of the response and
+                     returns what it's parsed into, which needs to be
+                     picklable
+            headers -- additional request headers
+
+        Raises:
+            requests.RequestException if the URL couldn't be fetched
+        """
+        headers = dict(headers or {})
+        entry = self._get_entry(url)
+        if entry is not None:
+            etag, last_modified = entry[1], entry[2]
+            if etag:
+                headers['If-None-Match'] = etag
+            if last_modified:
+                headers['If-Modified-Since'] = last_modified
+
+        r = self._session.get(url, headers=headers, timeout=self.TIMEOUT)
+        if r.status_code == 304 and entry is not None:
+            self._logger.debug("'%s' has not been modified", url)
+            return entry[3]
+        r.raise_for_status()
+
+        value = parse(r.content)
+        etag = r.headers.get('ETag')
+        last_modified = r.headers.get('Last-Modified')
+        if not etag and not last_modified:
+            # Without validators, there's no point in keeping the response
+            return value
+
+        entry = (url, etag, last_modified, value)
+        with self._lock:
+            self._entries[url] = entry
+        if self._store is not None:
+            try:
+                self._store.store(url, entry)
+            except (IOError, OSError):
+                self._logger.warning("Couldn't write cache entry for '%s'",
+                                     url, exc_info=True)
+        return value
+
+
+_conditionalFetcher = ConditionalFetcher(jasperpath.config('cache', 'http'))
+
+
+def fetchURL(url, parse, headers=None):
+    """
+    Returns the parsed content of a URL, using a conditional GET request
+    if it has been fetched before.
+
+    Arguments:
+        url -- the URL to fetch
+        parse -- a callable that takes the content of the response and
+                 returns what it's parsed into, which needs to be picklable
+        headers -- additional request headers
+    """
+    return _conditionalFetcher.fetch(url, parse, headers)
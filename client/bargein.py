@@ -0,0 +1,87 @@
+# -*- coding: utf-8-*-
+"""
+Tells from the loudness of the microphone input whether the user talks
+while Jasper is speaking.
+"""
+
+
+class BargeInDetector(object):
+    """
+    The microphone picks up Jasper's own voice, too. To keep Jasper from
+    interrupting himself, the detector learns how loud that echo is and a
+    chunk only counts as the user's voice if it's MULTIPLIER times louder.
+    GATE_CHUNKS consecutive chunks of that count as barge-in.
+
+    The echo level is learned from the first CALIBRATION_CHUNKS chunks of
+    Jasper's voice, i.e. only once the player is running (and louder than
+    the room was while the speech was being synthesized). From then on, it
+    follows the loudest chunks and decays slowly in pauses.
+    """
+
+    MULTIPLIER = 2.5
+    GATE_CHUNKS = 4
+    CALIBRATION_CHUNKS = 10
+
+    # Factor the echo level decays by with every quieter chunk
+    DECAY = 0.98
+
+    # Number of chunks the room noise is averaged over
+    NOISE_CHUNKS = 10
+
+    def __init__(self):
+        self.echo_level = None
+        self._noise = []
+        self._calibration = []
+        self._loud = []
+
+    def get_noise_level(self):
+        """
+        Returns:
+            The average loudness of the room before the player started, or
+            None if it started right away
+        """
+        if not self._noise:
+            return None
+        return sum(self._noise) / float(len(self._noise))
+
+    def feed(self, score, playing):
+        """
+        Arguments:
+        score -- the loudness of a chunk
+        playing -- True if the player has been running while the chunk was
+                   recorded
+
+        Returns:
+            True if the user has started talking
+        """
+        if self.echo_level is None:
+            self._calibrate(score, playing)
+            return False
+
+        if score > self.echo_level * self.MULTIPLIER:
+            self._loud.append(score)
+            return len(self._loud) >= self.GATE_CHUNKS
+
+        if self._loud:
+            # That was Jasper after all, so his voice can be that loud
+            self.echo_level = max(self._loud)
+            self._loud = []
+        self.echo_level = max(score, self.echo_level * self.DECAY)
+        return False
+
+    def _calibrate(self, score, playing):
+        if not playing:
+            # Speech is still being synthesized, this is the room
+            self._noise.append(score)
+            del self._noise[:-self.NOISE_CHUNKS]
+            return
+
+        noise = self.get_noise_level()
+        if (not self._calibration and noise is not None and
+                score <= noise * self.MULTIPLIER):
+            # Leading silence of the speech
+            return
+
+        self._calibration.append(score)
+        if len(self._calibration) >= self.CALIBRATION_CHUNKS:
+            self.echo_level = max(self._calibration)
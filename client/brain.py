@@ -1,12 +1,157 @@
 # -*- coding: utf-8-*-
+import sys
+import time
 import logging
 import pkgutil
+import threading
+import contextlib
+from concurrent import futures
 import jasperpath
 
 
+class HandlerTimeout(Exception):
+    pass
+
+
+class MicHandoff(object):
+    """
+    Passes the microphone between the listener, which listens for the
+    keyword whenever nobody else needs the microphone, and the modules,
+    which borrow it to listen to the user themselves.
+    """
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._held = False
+        self._borrowed = False
+        self._waiting = 0
+        # Set while a module is waiting for the microphone, the listener
+        # gives it up as soon as it can
+        self.wanted = threading.Event()
+
+    @contextlib.contextmanager
+    def hold(self):
+        """
+        Keeps the microphone for the listener, waiting until no module is
+        using or waiting for it.
+        """
+        with self._cond:
+            while self._borrowed or self._waiting:
+                self._cond.wait()
+            self._held = True
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._held = False
+                self._cond.notify_all()
+
+    @contextlib.contextmanager
+    def borrow(self):
+        """
+        Lends the microphone to a module, waiting until the listener has
+        given it up.
+        """
+        with self._cond:
+            self._waiting += 1
+            self.wanted.set()
+            try:
+                while self._held or self._borrowed:
+                    self._cond.wait()
+            finally:
+                self._waiting -= 1
+                if not self._waiting:
+                    self.wanted.clear()
+            self._borrowed = True
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._borrowed = False
+                self._cond.notify_all()
+
+
+class HandlerMic(object):
+    """
+    The mic as handed to a module: keeps track of how long the module has
+    been waiting for the user and, once the module has been abandoned,
+    stops passing its output on.
+    """
+
+    # Methods that wait for the user (or for speech output to finish)
+    LISTENING_METHODS = ('activeListen', 'activeListenToAllOptions',
+                         'passiveListen', 'wait')
+
+    # Methods that record, and so need the microphone to themselves
+    RECORDING_METHODS = ('activeListen', 'activeListenToAllOptions',
+                         'passiveListen')
+
+    def __init__(self, mic, handoff=None):
+        """
+        Arguments:
+        mic -- the mic to pass calls on to
+        handoff -- if provided, a MicHandoff to borrow the microphone from
+                   before recording
+        """
+        self._mic = mic
+        self._handoff = handoff
+        self._lock = threading.Lock()
+        self._listening_time = 0.0
+        self._listening_since = None
+        self.cancelled = False
+
+    def __getattr__(self, name):
+        attr = getattr(self._mic, name)
+        if name in self.LISTENING_METHODS:
+            return lambda *args, **kwargs: self._listen(name, attr, *args,
+                                                        **kwargs)
+        return attr
+
+    def cancel(self):
+        self.cancelled = True
+
+    def say(self, *args, **kwargs):
+        if not self.cancelled:
+            return self._mic.say(*args, **kwargs)
+        # Mic.say returns a future, so modules may wait for it
+        future = futures.Future()
+        future.set_result(None)
+        return future
+
+    def _listen(self, name, method, *args, **kwargs):
+        if self.cancelled:
+            return None
+        with self._lock:
+            self._listening_since = time.time()
+        try:
+            if self._handoff is None or name not in self.RECORDING_METHODS:
+                return method(*args, **kwargs)
+            with self._handoff.borrow():
+                return method(*args, **kwargs)
+        finally:
+            with self._lock:
+                self._listening_time += time.time() - self._listening_since
+                self._listening_since = None
+
+    def get_listening_time(self):
+        """
+        Returns:
+            The number of seconds that have been spent waiting for the user
+        """
+        with self._lock:
+            if self._listening_since is None:
+                return self._listening_time
+            return (self._listening_time +
+                    time.time() - self._listening_since)
+
+
 class Brain(object):
 
-    def __init__(self, mic, profile):
+    # Seconds a module may take to handle input, not counting the time it
+    # waits for the user, unless it sets TIMEOUT itself
+    DEFAULT_TIMEOUT = 30
+
+    def __init__(self, mic, profile, handoff=None):
         """
         Instantiates a new Brain object, which cross-references user
         input with a list of modules. Note that the order of brain.modules
@@ -17,10 +162,13 @@ class Brain(object):
         mic -- used to interact with the user (for both input and output)
         profile -- contains information related to the user (e.g., phone
                    number)
+        handoff -- if provided, a MicHandoff that modules borrow the
+                   microphone from
         """
 
         self.mic = mic
         self.profile = profile
+        self.handoff = handoff
         self.modules = self.get_modules()
         self._logger = logging.getLogger(__name__)
 
@@ -70,7 +218,14 @@ class Brain(object):
                     self._logger.debug("'%s' is a valid phrase for module " +
                                        "'%s'", text, module.__name__)
                     try:
-                        module.handle(text, self.mic, self.profile)
+                        self.handle(module, text)
+                    except HandlerTimeout:
+                        self._logger.warning("Module '%s' didn't handle " +
+                                             "phrase '%s' in time, " +
+                                             "abandoning it", module.__name__,
+                                             text)
+                        self.mic.say("I'm sorry. That took too long. " +
+                                     "Please try again later.")
                     except Exception:
                         self._logger.error('Failed to execute module',
                                            exc_info=True)
@@ -84,3 +239,61 @@ class Brain(object):
                         return
         self._logger.debug("No module was able to handle any of these " +
                            "phrases: %r", texts)
+
+    def get_timeout(self, module):
+        """
+        Returns the number of seconds a module may take to handle input (not
+        counting the time it waits for the user), or None if there is no
+        limit. The limit can be set by the module's TIMEOUT constant and be
+        overridden in the profile, e.g.:
+
+            module_timeouts:
+              HN: 60
+        """
+        timeouts = self.profile.get('module_timeouts') or {}
+        if module.__name__ in timeouts:
+            return timeouts[module.__name__]
+        return getattr(module, 'TIMEOUT', self.DEFAULT_TIMEOUT)
+
+    def handle(self, module, text):
+        """
+        Lets a module handle text on a thread of its own and waits until
+        it's done or its time is up.
+
+        Raises:
+            HandlerTimeout if the module took too long. It's left running,
+            but anything it says from then on is dropped.
+        """
+        mic = HandlerMic(self.mic, self.handoff)
+        future = futures.Future()
+
+        def run():
+            if not future.set_running_or_notify_cancel():
+                return
+            try:
+                future.set_result(module.handle(text, mic, self.profile))
+            except BaseException:
+                future.set_exception_info(*sys.exc_info()[1:])
+
+        # A thread of its own (instead of a pool's) since there is no way
+        # to get a thread back from a module that hangs
+        thread = threading.Thread(target=run,
+                                  name="Module '%s'" % module.__name__)
+        thread.daemon = True
+        thread.start()
+
+        timeout = self.get_timeout(module)
+        start = time.time()
+        while True:
+            if timeout is None:
+                return future.result()
+            busy_time = time.time() - start - mic.get_listening_time()
+            if busy_time >= timeout:
+                mic.cancel()
+                raise HandlerTimeout()
+            try:
+                return future.result(timeout=timeout - busy_time)
+            except futures.TimeoutError:
+                # The module may have been waiting for the user meanwhile,
+                # which doesn't count
+                pass
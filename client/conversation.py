@@ -1,7 +1,12 @@
 # -*- coding: utf-8-*-
+import sys
+import Queue
 import logging
+import threading
+from concurrent import futures
 from notifier import Notifier
-from brain import Brain
+from brain import Brain, MicHandoff
+from prefetch import Prefetcher
 
 
 class Conversation(object):
@@ -11,8 +16,20 @@ class Conversation(object):
         self.persona = persona
         self.mic = mic
         self.profile = profile
-        self.brain = Brain(mic, profile)
+        # The listener keeps the microphone unless a module needs it
+        self.handoff = MicHandoff()
+        self.brain = Brain(mic, profile, self.handoff)
         self.notifier = Notifier(profile)
+        self.prefetcher = Prefetcher(self.brain.modules, mic, profile,
+                                     self.notifier.scheduler)
+
+        # What the listener heard, as ('input', texts) or, if listening
+        # failed, ('error', exc_info) events
+        self._events = Queue.Queue()
+
+        # Modules are run one at a time, but not on the thread that
+        # announces notifications
+        self._executor = futures.ThreadPoolExecutor(max_workers=1)
 
     def handleForever(self):
         """
@@ -20,30 +37,106 @@ class Conversation(object):
         """
         self._logger.info("Starting to handle conversation with keyword '%s'.",
                           self.persona)
+        self.prefetcher.start()
+
+        listener = threading.Thread(target=self.listenForever,
+                                    name='Listener')
+        listener.daemon = True
+        listener.start()
+
         while True:
-            # Print notifications until empty
-            notifications = self.notifier.getAllNotifications()
-            for notif in notifications:
-                self._logger.info("Received notification: '%s'", str(notif))
+            event, value = self._events.get()
+            if event == 'error':
+                # Let the module that is running finish first
+                self._executor.shutdown(wait=True)
+                raise value[0], value[1], value[2]
+            self.handleInput(value)
+
+    def listenForever(self):
+        """
+        Listens for the keyword and what's said after it, and passes it on
+        to handleForever(). Runs on a thread of its own.
+
+        Keeps listening while modules handle input. When a module wants to
+        listen to the user, it borrows the microphone through the handoff,
+        which cuts the keyword listening short.
+
+        Notifications are announced between listen cycles (passiveListen()
+        times out after a few seconds), so that Jasper never talks while the
+        microphone is recording for the keyword.
+        """
+        while True:
+            try:
+                with self.handoff.hold():
+                    input = self.listen()
+            except Exception:
+                self._events.put(('error', sys.exc_info()))
+                return
+
+            if input is not None:
+                self._events.put(('input', input))
 
+    def listen(self):
+        """
+        Runs one listen cycle. Must only be called while holding the
+        microphone.
+
+        Returns:
+            What has been said after the keyword, or None if the keyword
+            hasn't been said
+        """
+        self.announceNotifications()
+        # Let Jasper finish speaking before checking for barge-in
+        self.mic.wait()
+        threshold = None
+        if self.mic.interrupted:
+            # The user talked over Jasper, so we skip waiting for the
+            # keyword and hand over to active listening right away
+            self._logger.info("Speech output has been interrupted.")
+        else:
+            if self.handoff.wanted.is_set():
+                return None
             self._logger.debug("Started listening for keyword '%s'",
                                self.persona)
-            threshold, transcribed = self.mic.passiveListen(self.persona)
+            threshold, transcribed = self.mic.passiveListen(
+                self.persona, stop=self.handoff.wanted)
             self._logger.debug("Stopped listening for keyword '%s'",
                                self.persona)
 
             if not transcribed or not threshold:
                 self._logger.info("Nothing has been said or transcribed.")
-                continue
+                return None
             self._logger.info("Keyword '%s' has been said!", self.persona)
 
-            self._logger.debug("Started to listen actively with threshold: %r",
-                               threshold)
-            input = self.mic.activeListenToAllOptions(threshold)
-            self._logger.debug("Stopped to listen actively with threshold: %r",
-                               threshold)
+        self._logger.debug("Started to listen actively with threshold: %r",
+                           threshold)
+        input = self.mic.activeListenToAllOptions(threshold)
+        self._logger.debug("Stopped to listen actively with threshold: %r",
+                           threshold)
+        return input
+
+    def handleInput(self, input):
+        """
+        Hands input over to the brain, without waiting for it to be handled.
+        Input that is heard while a module is still running is handled
+        after it.
+        """
+        if not input:
+            self.mic.say("Pardon?")
+            return
+
+        def done(future):
+            exc, tb = future.exception_info()
+            if exc is not None:
+                self._logger.error("Failed to handle input %r", input,
+                                   exc_info=(type(exc), exc, tb))
+
+        self._executor.submit(self.brain.query, input).add_done_callback(done)
 
-            if input:
-                self.brain.query(input)
-            else:
-                self.mic.say("Pardon?")
+    def announceNotifications(self):
+        """
+        Announces all pending notifications.
+        """
+        for notif in self.notifier.getAllNotifications():
+            self._logger.info("Received notification: '%s'", str(notif))
+            self.mic.say(str(notif))
@@ -0,0 +1,210 @@
+# -*- coding: utf-8-*-
+"""
+An index for finding strings similar to a query (e.g. song titles that
+sound like what has been transcribed) without comparing the query to
+every single string.
+"""
+import re
+import difflib
+from collections import defaultdict, Counter
+
+# Soundex digits of the consonants; vowels and H, W, Y don't have one
+_SOUNDEX_CODES = {}
+for letters, digit in (('BFPV', '1'), ('CGJKQSXZ', '2'), ('DT', '3'),
+                       ('L', '4'), ('MN', '5'), ('R', '6')):
+    for letter in letters:
+        _SOUNDEX_CODES[letter] = digit
+
+
+def normalize(text):
+    """
+    Returns:
+        text in upper case with everything but letters and digits replaced
+        by single spaces
+    """
+    if isinstance(text, str):
+        text = text.decode('utf-8', 'ignore')
+    return ' '.join(re.split(r'[\W_]+', text.upper(), flags=re.UNICODE)
+                    ).strip()
+
+
+def soundex(word):
+    """
+    Returns:
+        The Soundex code of word, i.e. its first letter followed by three
+        digits that describe how the rest of it sounds. Words without
+        letters are returned unchanged.
+    """
+    letters = [c for c in word.upper() if 'A' <= c <= 'Z']
+    if not letters:
+        return word
+    code = letters[0]
+    last = _SOUNDEX_CODES.get(letters[0])
+    for letter in letters[1:]:
+        digit = _SOUNDEX_CODES.get(letter)
+        if digit is not None and digit != last:
+            code += digit
+            if len(code) == 4:
+                break
+        if letter not in 'HW':
+            last = digit
+    return code.ljust(4, '0')
+
+
+def trigrams(text):
+    """
+    Returns:
+        The set of character trigrams of a normalized string, padded so
+        that the beginnings of words count more
+    """
+    padded = '  %s ' % text.replace(' ', '  ')
+    return set(padded[i:i + 3] for i in range(len(padded) - 2))
+
+
+def phonetic_keys(text):
+    """
+    Returns:
+        The list of Soundex codes of the words of a normalized string
+    """
+    return [soundex(word) for word in text.split()]
+
+
+def _dice(a, b, shared):
+    return 2.0 * shared / (a + b) if a + b else 0.0
+
+
+class FuzzyIndex(object):
+    """
+    Finds the strings most similar to a query. Strings are found by shared
+    character trigrams (which tolerates misspellings) and by shared
+    phonetic keys of their words (which tolerates words that sound alike,
+    as speech recognition tends to confuse them), using inverted postings
+    so that only strings that have something in common with the query are
+    looked at. The best candidates are then ranked like
+    difflib.get_close_matches would do.
+
+    Strings can be added and removed at any time.
+    """
+
+    # Number of candidates that are ranked with difflib
+    MAX_CANDIDATES = 50
+
+    # Candidates need to share at least this fraction of trigrams or
+    # phonetic keys with the query
+    MIN_PRESCORE = 0.2
+
+    def __init__(self, strings=()):
+        self._refcounts = Counter()
+        self._normalized = {}
+        self._trigrams = {}
+        self._keys = {}
+        self._trigram_postings = defaultdict(set)
+        self._key_postings = defaultdict(set)
+        for string in strings:
+            self.add(string)
+
+    def __len__(self):
+        return len(self._refcounts)
+
+    def __contains__(self, string):
+        return string in self._refcounts
+
+    def add(self, string):
+        """
+        Adds a string to the index. Strings may be added more than once, in
+        which case they need to be removed as often to be gone.
+        """
+        self._refcounts[string] += 1
+        if self._refcounts[string] > 1:
+            return
+        normalized = normalize(string)
+        self._normalized[string] = normalized
+        self._trigrams[string] = trigrams(normalized)
+        self._keys[string] = phonetic_keys(normalized)
+        for trigram in self._trigrams[string]:
+            self._trigram_postings[trigram].add(string)
+        for key in set(self._keys[string]):
+            self._key_postings[key].add(string)
+
+    def remove(self, string):
+        """
+        Removes a string that has been added before.
+        """
+        if self._refcounts[string] > 1:
+            self._refcounts[string] -= 1
+            return
+        del self._refcounts[string]
+        for trigram in self._trigrams.pop(string):
+            self._discard(self._trigram_postings, trigram, string)
+        for key in set(self._keys.pop(string)):
+            self._discard(self._key_postings, key, string)
+        del self._normalized[string]
+
+    @staticmethod
+    def _discard(postings, token, string):
+        postings[token].discard(string)
+        if not postings[token]:
+            del postings[token]
+
+    def update(self, strings):
+        """
+        Changes the index to contain exactly the given strings, only adding
+        and removing what has changed.
+        """
+        new_counts = Counter(strings)
+        for string, count in (self._refcounts - new_counts).items():
+            for i in range(count):
+                self.remove(string)
+        for string, count in (new_counts - self._refcounts).items():
+            for i in range(count):
+                self.add(string)
+
+    def _phonetic_score(self, query_keys, string):
+        keys = self._keys[string]
+        shared = sum((Counter(query_keys) & Counter(keys)).values())
+        return _dice(len(query_keys), len(keys), shared)
+
+    def search(self, query, n=3, cutoff=0.6):
+        """
+        Arguments:
+        query -- the string to look for
+        n -- the maximum number of matches to return
+        cutoff -- the minimum similarity (between 0 and 1) of a match
+
+        Returns:
+            A list of at most n indexed strings, best match first
+        """
+        normalized = normalize(query)
+        if not normalized:
+            return []
+        query_trigrams = trigrams(normalized)
+        query_keys = phonetic_keys(normalized)
+
+        shared = Counter()
+        for trigram in query_trigrams:
+            shared.update(self._trigram_postings.get(trigram, ()))
+        prescores = {}
+        for string, count in shared.items():
+            prescores[string] = _dice(len(query_trigrams),
+                                      len(self._trigrams[string]), count)
+        for key in set(query_keys):
+            for string in self._key_postings.get(key, ()):
+                if string not in prescores or prescores[string] < 1.0:
+                    prescores[string] = max(
+                        prescores.get(string, 0.0),
+                        self._phonetic_score(query_keys, string))
+
+        candidates = sorted((string for string, score in prescores.items()
+                             if score >= self.MIN_PRESCORE),
+                            key=prescores.get, reverse=True)
+        matcher = difflib.SequenceMatcher()
+        matcher.set_seq2(normalized)
+        results = []
+        for string in candidates[:self.MAX_CANDIDATES]:
+            matcher.set_seq1(self._normalized[string])
+            score = max(matcher.ratio(),
+                        self._phonetic_score(query_keys, string))
+            if score >= cutoff:
+                results.append((score, string))
+        results.sort(key=lambda result: result[0], reverse=True)
+        return [string for score, string in results[:n]]
@@ -1,9 +1,13 @@
 # -*- coding: utf-8-*-
 import os
+import fcntl
 import re
+import hashlib
 import subprocess
 import tempfile
 import logging
+import multiprocessing
+from concurrent import futures
 
 import yaml
 
@@ -15,6 +19,10 @@ class PhonetisaurusG2P(object):
     PATTERN = re.compile(r'^(?P<word>.+)\t(?P<precision>\d+\.\d+)\t<s> ' +
                          r'(?P<pronounciation>.*) </s>', re.MULTILINE)
 
+    # Word lists shorter than this are not worth the overhead of loading
+    # the FST model in more than one process
+    MIN_SHARD_SIZE = 100
+
     @classmethod
     def execute(cls, fst_model, input, is_file=False, nbest=None):
         logger = logging.getLogger(__name__)
@@ -81,6 +89,9 @@ class PhonetisaurusG2P(object):
                             profile['pocketsphinx']['fst_model']
                     if 'nbest' in profile['pocketsphinx']:
                         conf['nbest'] = int(profile['pocketsphinx']['nbest'])
+                    if 'g2p_workers' in profile['pocketsphinx']:
+                        conf['workers'] = \
+                            int(profile['pocketsphinx']['g2p_workers'])
         return conf
 
     def __new__(cls, fst_model=None, *args, **kwargs):
@@ -94,7 +105,7 @@ class PhonetisaurusG2P(object):
         inst = object.__new__(cls, fst_model, *args, **kwargs)
         return inst
 
-    def __init__(self, fst_model=None, nbest=None):
+    def __init__(self, fst_model=None, nbest=None, workers=None):
         self._logger = logging.getLogger(__name__)
 
         self.fst_model = os.path.abspath(fst_model)
@@ -104,6 +115,14 @@ class PhonetisaurusG2P(object):
         if self.nbest is not None:
             self._logger.debug("Will use the %d best results.", self.nbest)
 
+        if workers is None:
+            try:
+                workers = multiprocessing.cpu_count()
+            except NotImplementedError:
+                workers = 1
+        self.workers = max(1, workers)
+        self._logger.debug("Will use up to %d G2P processes.", self.workers)
+
     def _translate_word(self, word):
         return self.execute(self.fst_model, word, nbest=self.nbest)
 
@@ -120,6 +139,40 @@ class PhonetisaurusG2P(object):
         os.remove(tmp_fname)
         return output
 
+    def _get_shards(self, words):
+        num_shards = min(self.workers, len(words) // self.MIN_SHARD_SIZE)
+        if num_shards < 2:
+            return [words]
+        return [words[i::num_shards] for i in range(num_shards)]
+
+    def iter_translations(self, words):
+        """
+        Converts a list of words to phonemes by splitting it into shards
+        that are processed by concurrent Phonetisaurus processes.
+
+        Arguments:
+            words -- a list of words
+
+        Returns:
+            An iterator that yields a dict of words and their phonemes for
+            every shard as soon as it has been processed.
+        """
+        words = list(words)
+        shards = self._get_shards(words)
+        if len(shards) == 1:
+            yield self._translate_words(words)
+            return
+
+        self._logger.debug('Converting %d words in %d shards', len(words),
+                           len(shards))
+        # The actual work is done by the phonetisaurus processes, so threads
+        # are sufficient to keep all of them busy
+        with futures.ThreadPoolExecutor(max_workers=len(shards)) as executor:
+            jobs = [executor.submit(self._translate_words, shard)
+                    for shard in shards]
+            for job in futures.as_completed(jobs):
+                yield job.result()
+
     def translate(self, words):
         if type(words) is str or len(words) == 1:
             self._logger.debug('Converting single word to phonemes')
@@ -127,11 +180,153 @@ class PhonetisaurusG2P(object):
                                           else words[0])
         else:
             self._logger.debug('Converting %d words to phonemes', len(words))
-            output = self._translate_words(words)
+            output = {}
+            for shard_output in self.iter_translations(words):
+                output.update(shard_output)
         self._logger.debug('G2P conversion returned phonemes for %d words',
                            len(output))
         return output
 
+
+class PronunciationCache(object):
+    """
+    Persistent store of the phonemes that PhonetisaurusG2P returned for
+    words. Different FST models or nbest settings yield different results,
+    so every combination of them gets a cache file of its own.
+    """
+
+    _model_hashes = {}
+
+    @classmethod
+    def get_model_hash(cls, fst_model):
+        """
+        Calculates the SHA1 hash of an FST model file. Results are memorized
+        as long as the file's size and modification time stay the same.
+        """
+        st = os.stat(fst_model)
+        key = (fst_model, st.st_size, st.st_mtime)
+        if key not in cls._model_hashes:
+            sha1 = hashlib.sha1()
+            with open(fst_model, 'rb') as f:
+                for chunk in iter(lambda: f.read(65536), b''):
+                    sha1.update(chunk)
+            cls._model_hashes[key] = sha1.hexdigest()
+        return cls._model_hashes[key]
+
+    @classmethod
+    def get_instance(cls, g2pconverter, path):
+        """
+        Returns the cache for a G2P converter.
+
+        Arguments:
+            g2pconverter -- the PhonetisaurusG2P instance
+            path -- the directory in which the cache files are stored
+        """
+        fname = '%s-%s.g2p' % (cls.get_model_hash(g2pconverter.fst_model),
+                               ('nbest%d' % g2pconverter.nbest
+                                if g2pconverter.nbest is not None
+                                else 'all'))
+        return cls(os.path.join(path, fname))
+
+    def __init__(self, fname):
+        self._logger = logging.getLogger(__name__)
+        self.fname = fname
+        self._dict = {}
+        if os.path.exists(self.fname):
+            with open(self.fname, 'r') as f:
+                self._dict = self._read(f)
+        self._logger.debug("Loaded phonemes for %d words from cache '%s'",
+                           len(self._dict), self.fname)
+
+    @staticmethod
+    def _read(f):
+        """
+        Reads words and their phonemes from a cache file. If a word has
+        been added more than once, only the first entry is used.
+
+        Returns:
+            A dict of words and their phonemes
+        """
+        words = {}
+        word = skip = None
+        for line in f:
+            next_word, sep, phonemes = line.rstrip('\n').partition('\t')
+            if not sep:
+                continue
+            if next_word != word:
+                # All phonemes of a word are written at once, so if it
+                # shows up again, another process has added it, too
+                word = next_word
+                skip = word in words
+            if not skip:
+                words.setdefault(word, []).append(phonemes)
+        return words
+
+    def __contains__(self, word):
+        return word in self._dict
+
+    def __len__(self):
+        return len(self._dict)
+
+    def get(self, word):
+        return self._dict.get(word, [])
+
+    def update(self, phonemes):
+        """
+        Adds words and their phonemes to the cache and appends them to the
+        cache file.
+
+        Arguments:
+            phonemes -- a dict of words and their phonemes
+        """
+        if all(word in self._dict for word in phonemes):
+            return
+        dirname = os.path.dirname(self.fname)
+        if not os.path.exists(dirname):
+            os.makedirs(dirname)
+        # The passive and active vocabularies may be compiled in different
+        # processes at the same time, so lock the file to keep their lines
+        # from interleaving, and skip the words the other process has
+        # added in the meantime
+        with open(self.fname, 'a+') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                f.seek(0)
+                self._dict.update(self._read(f))
+                lines = []
+                for word in sorted(phonemes):
+                    if word in self._dict:
+                        continue
+                    self._dict[word] = list(phonemes[word])
+                    for pronounciation in phonemes[word]:
+                        lines.append("%s\t%s\n" % (word, pronounciation))
+                f.write(''.join(lines))
+                f.flush()
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def translate(self, g2pconverter, words):
+        """
+        Converts words to phonemes, but only passes words to the G2P
+        converter that are not in the cache yet.
+
+        Arguments:
+            g2pconverter -- the PhonetisaurusG2P instance
+            words -- a list of words
+
+        Returns:
+            A dict of words and their phonemes
+        """
+        missing_words = sorted(set(word for word in words
+                                   if word not in self._dict))
+        self._logger.debug("%d of %d words not found in cache",
+                           len(missing_words), len(words))
+        if missing_words:
+            self.update(g2pconverter.translate(missing_words))
+        return dict((word, self._dict[word]) for word in words
+                    if word in self._dict)
+
+
 if __name__ == "__main__":
     import pprint
     import argparse
@@ -0,0 +1,129 @@
+# -*- coding: utf-8-*-
+"""
+Push notifications of new emails using the IMAP IDLE command (RFC 2177),
+which imaplib doesn't support by itself.
+"""
+import ssl
+import socket
+import logging
+import imaplib
+import threading
+
+
+class IMAPIdleWatcher(threading.Thread):
+    """
+    Keeps one authenticated IMAP connection open, waits for the server to
+    announce new messages in a mailbox and calls a callback whenever it
+    does. The callback is also called after every (re)connect, since
+    messages may have arrived in the meantime. It gets the connection, so
+    it can fetch the new messages without logging in again.
+    """
+
+    # Servers may drop clients that have been idling for 30 minutes, so
+    # IDLE is restarted well before that
+    IDLE_TIMEOUT = 10 * 60
+
+    # Seconds to wait before reconnecting after an error; doubled after
+    # every failed attempt up to the maximum
+    MIN_RECONNECT_DELAY = 5
+    MAX_RECONNECT_DELAY = 5 * 60
+
+    def __init__(self, host, user, password, callback, mailbox='INBOX'):
+        super(IMAPIdleWatcher, self).__init__()
+        self.daemon = True
+        self._logger = logging.getLogger(__name__)
+        self.host = host
+        self.user = user
+        self.password = password
+        self.callback = callback
+        self.mailbox = mailbox
+        self._stopped = threading.Event()
+
+    def stop(self):
+        self._stopped.set()
+
+    def connect(self):
+        """
+        Returns:
+            An authenticated IMAP4_SSL connection with the mailbox selected
+        """
+        conn = imaplib.IMAP4_SSL(self.host)
+        conn.login(self.user, self.password)
+        conn.select(self.mailbox, readonly=True)
+        return conn
+
+    def run(self):
+        delay = self.MIN_RECONNECT_DELAY
+        while not self._stopped.is_set():
+            conn = None
+            try:
+                conn = self.connect()
+                delay = self.MIN_RECONNECT_DELAY
+                self.callback(conn)
+                while not self._stopped.is_set():
+                    if self.idle(conn) and not self._stopped.is_set():
+                        self.callback(conn)
+            except (imaplib.IMAP4.error, socket.error):
+                self._logger.warning("Lost connection to IMAP server, " +
+                                     "reconnecting in %d seconds", delay,
+                                     exc_info=True)
+            except Exception:
+                self._logger.error("Error while handling new emails, " +
+                                   "reconnecting in %d seconds", delay,
+                                   exc_info=True)
+            finally:
+                if conn is not None:
+                    try:
+                        conn.logout()
+                    except (imaplib.IMAP4.error, socket.error):
+                        pass
+            self._stopped.wait(delay)
+            delay = min(2 * delay, self.MAX_RECONNECT_DELAY)
+
+    def idle(self, conn):
+        """
+        Waits for new messages until the server announces some or
+        IDLE_TIMEOUT is over.
+
+        Arguments:
+        conn -- an authenticated IMAP4 connection with a mailbox selected
+
+        Returns:
+            True if there are new messages
+        """
+        tag = conn._new_tag()
+        conn.send('%s IDLE\r\n' % tag)
+        response = conn.readline()
+        if not response.startswith('+'):
+            raise imaplib.IMAP4.error("IDLE failed: %s" % response.strip())
+
+        new_messages = False
+        conn.socket().settimeout(self.IDLE_TIMEOUT)
+        try:
+            while not new_messages:
+                line = self._readline(conn)
+                # e.g. "* 23 EXISTS"
+                new_messages = (line.startswith('*') and
+                                line.split()[-1].upper() == 'EXISTS')
+        except socket.timeout:
+            pass
+        except ssl.SSLError as e:
+            # SSL sockets raise SSLError instead of socket.timeout
+            if 'timed out' not in str(e):
+                raise
+        finally:
+            conn.socket().settimeout(None)
+
+        conn.send('DONE\r\n')
+        line = self._readline(conn)
+        while not line.startswith(tag):
+            line = self._readline(conn)
+        if line.split()[1].upper() != 'OK':
+            raise imaplib.IMAP4.error("IDLE failed: %s" % line.strip())
+        return new_messages
+
+    def _readline(self, conn):
+        line = conn.readline()
+        if not line:
+            raise imaplib.IMAP4.abort("Connection closed by server")
+        return line
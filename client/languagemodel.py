@@ -0,0 +1,246 @@
+# -*- coding: utf-8-*-
+"""
+In-process n-gram counting and ARPA languagemodel generation for the small
+command grammars Jasper uses.
+"""
+import math
+import logging
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+class NGramCounts(object):
+    """
+    Counts the n-grams of a list of phrases. Every phrase is treated as a
+    sentence of its own, i.e. it is wrapped in <s> and </s>.
+
+    Counts can be updated incrementally by adding or removing phrases, so
+    that a languagemodel can be regenerated without recounting everything.
+    """
+
+    SENTENCE_START = '<s>'
+    SENTENCE_END = '</s>'
+
+    def __init__(self, order=3):
+        self._logger = logging.getLogger(__name__)
+        self.order = order
+        self._counts = [{} for i in range(order)]
+
+    def _ngrams(self, phrase):
+        tokens = ([self.SENTENCE_START] + phrase.split() +
+                  [self.SENTENCE_END])
+        for n in range(1, self.order + 1):
+            for i in range(len(tokens) - n + 1):
+                yield tokens[i:i + n]
+
+    def _update(self, phrases, delta):
+        for phrase in phrases:
+            for ngram in self._ngrams(phrase):
+                counts = self._counts[len(ngram) - 1]
+                key = tuple(ngram)
+                count = counts.get(key, 0) + delta
+                if count > 0:
+                    counts[key] = count
+                elif key in counts:
+                    del counts[key]
+
+    def add_phrases(self, phrases):
+        """
+        Adds the n-grams of phrases to the counts.
+        """
+        self._update(phrases, 1)
+
+    def remove_phrases(self, phrases):
+        """
+        Removes the n-grams of phrases (which have been added before) from
+        the counts.
+        """
+        self._update(phrases, -1)
+
+    def get_counts(self, n):
+        """
+        Returns:
+            A dict that maps n-gram tuples of length n to their counts
+        """
+        return self._counts[n - 1]
+
+    @property
+    def words(self):
+        """
+        Returns:
+            A sorted list of all words, excluding sentence markers
+        """
+        return sorted(ngram[0] for ngram in self._counts[0]
+                      if ngram[0] not in (self.SENTENCE_START,
+                                          self.SENTENCE_END))
+
+    def save(self, fname):
+        """
+        Writes the counts to a file.
+        """
+        with open(fname, 'w') as f:
+            f.write("%d\n" % self.order)
+            for counts in self._counts:
+                for ngram, count in sorted(counts.items()):
+                    f.write("%d\t%s\n" % (count, ' '.join(ngram)))
+
+    @classmethod
+    def load(cls, fname):
+        """
+        Reads counts from a file that has been written by save().
+        """
+        with open(fname, 'r') as f:
+            inst = cls(order=int(f.readline().strip()))
+            for line in f:
+                count, sep, ngram = line.rstrip('\n').partition('\t')
+                if sep:
+                    ngram = tuple(ngram.split(' '))
+                    inst._counts[len(ngram) - 1][ngram] = int(count)
+        return inst
+
+
+class ARPAWriter(object):
+    """
+    Writes a backoff languagemodel in the ARPA format from n-gram counts.
+    Probabilities of the higher order n-grams are discounted by a fixed
+    amount and the freed probability mass is distributed by backoff weights
+    (absolute discounting).
+    """
+
+    # log10 probability that represents "impossible", by convention used
+    # for the sentence start marker
+    LOG_ZERO = -99.0
+
+    # If the lower order n-grams seen in a context leave less probability
+    # mass than this, there is nothing left to back off to
+    MIN_FREE_MASS = 1e-10
+
+    def __init__(self, counts, discount=0.5):
+        self._logger = logging.getLogger(__name__)
+        self.counts = counts
+        self.discount = discount
+        self._probs = [{} for i in range(counts.order)]
+        self._backoffs = [{} for i in range(counts.order)]
+        self._estimate()
+
+    def _estimate(self):
+        # Unigrams are not discounted
+        unigrams = self.counts.get_counts(1)
+        total = sum(count for ngram, count in unigrams.items()
+                    if ngram[0] != NGramCounts.SENTENCE_START)
+        for ngram, count in unigrams.items():
+            if ngram[0] == NGramCounts.SENTENCE_START:
+                self._probs[0][ngram] = 0.0
+            else:
+                self._probs[0][ngram] = float(count) / total
+
+        for n in range(2, self.counts.order + 1):
+            ngrams = self.counts.get_counts(n).items()
+            if not ngrams:
+                continue
+            # Number every distinct context (i.e. the n-gram without its
+            # last word), so that per-context sums can be calculated
+            context_ids = {}
+            ids = [context_ids.setdefault(ngram[:-1], len(context_ids))
+                   for ngram, count in ngrams]
+            contexts = sorted(context_ids, key=context_ids.get)
+            if numpy is not None:
+                probs, backoffs = self._estimate_numpy(ngrams, ids,
+                                                       len(contexts))
+            else:
+                probs, backoffs = self._estimate_python(ngrams, ids,
+                                                        len(contexts))
+            self._probs[n - 1] = dict(zip([ngram for ngram, count in ngrams],
+                                          probs))
+            self._backoffs[n - 2] = dict(zip(contexts, backoffs))
+
+    def _estimate_python(self, ngrams, ids, num_contexts):
+        context_counts = [0] * num_contexts
+        context_types = [0] * num_contexts
+        for (ngram, count), i in zip(ngrams, ids):
+            context_counts[i] += count
+            context_types[i] += 1
+        probs = [(count - self.discount) / float(context_counts[i])
+                 for (ngram, count), i in zip(ngrams, ids)]
+
+        # The probability mass that has been discounted from the n-grams of
+        # a context is distributed over the n-grams of lower order that have
+        # not been seen in that context
+        seen_lower_mass = [0.0] * num_contexts
+        for (ngram, count), i in zip(ngrams, ids):
+            seen_lower_mass[i] += self.prob(ngram[1:])
+        backoffs = []
+        for i in range(num_contexts):
+            left = (self.discount * context_types[i] /
+                    float(context_counts[i]))
+            mass = seen_lower_mass[i]
+            backoffs.append(left / (1.0 - mass)
+                            if 1.0 - mass > self.MIN_FREE_MASS else 0.0)
+        return (probs, backoffs)
+
+    def _estimate_numpy(self, ngrams, ids, num_contexts):
+        # Same as _estimate_python(), but with the per-context sums done by
+        # numpy.bincount
+        ids = numpy.array(ids)
+        counts = numpy.array([count for ngram, count in ngrams], dtype=float)
+        context_counts = numpy.bincount(ids, weights=counts,
+                                        minlength=num_contexts)
+        context_types = numpy.bincount(ids, minlength=num_contexts)
+        probs = (counts - self.discount) / context_counts[ids]
+
+        lower_probs = numpy.array([self.prob(ngram[1:])
+                                   for ngram, count in ngrams])
+        seen_lower_mass = numpy.bincount(ids, weights=lower_probs,
+                                         minlength=num_contexts)
+        left = self.discount * context_types / context_counts
+        free_mass = 1.0 - seen_lower_mass
+        has_free_mass = free_mass > self.MIN_FREE_MASS
+        backoffs = numpy.where(has_free_mass,
+                               left / numpy.where(has_free_mass, free_mass,
+                                                  1.0),
+                               0.0)
+        return (probs.tolist(), backoffs.tolist())
+
+    def prob(self, ngram):
+        """
+        Returns:
+            The (backed off) probability of the last word of ngram given
+            the preceding words
+        """
+        ngram = tuple(ngram)
+        n = len(ngram)
+        if ngram in self._probs[n - 1]:
+            return self._probs[n - 1][ngram]
+        if n == 1:
+            return 0.0
+        return (self._backoffs[n - 2].get(ngram[:-1], 1.0) *
+                self.prob(ngram[1:]))
+
+    @classmethod
+    def _log10(cls, value):
+        return math.log10(value) if value > 0 else cls.LOG_ZERO
+
+    def write(self, fname):
+        """
+        Writes the languagemodel to a file.
+        """
+        order = self.counts.order
+        with open(fname, 'w') as f:
+            f.write("\\data\\\n")
+            for n in range(1, order + 1):
+                f.write("ngram %d=%d\n" % (n, len(self._probs[n - 1])))
+            for n in range(1, order + 1):
+                f.write("\n\\%d-grams:\n" % n)
+                for ngram, prob in sorted(self._probs[n - 1].items()):
+                    line = "%.4f %s" % (self._log10(prob), ' '.join(ngram))
+                    if n < order and ngram in self._backoffs[n - 1]:
+                        line += " %.4f" % self._log10(
+                            self._backoffs[n - 1][ngram])
+                    f.write(line + "\n")
+            f.write("\n\\end\\\n")
+        self._logger.debug("Wrote languagemodel with %s n-grams to '%s'",
+                           '/'.join(str(len(probs)) for probs in self._probs),
+                           fname)
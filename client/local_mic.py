@@ -8,11 +8,13 @@ implementation, Jasper is always active listening with local_mic.
 
 class Mic:
     prev = None
+    interrupted = False
 
-    def __init__(self, speaker, passive_stt_engine, active_stt_engine):
+    def __init__(self, speaker, passive_stt_engine, active_stt_engine,
+                 barge_in=False):
         return
 
-    def passiveListen(self, PERSONA):
+    def passiveListen(self, PERSONA, stop=None):
         return True, "JASPER"
 
     def activeListenToAllOptions(self, THRESHOLD=None, LISTEN=True,
@@ -30,3 +32,9 @@ class Mic:
 
     def say(self, phrase, OPTIONS=None):
         print("JASPER: %s" % phrase)
+
+    def presynthesize(self, phrase):
+        return
+
+    def wait(self):
+        return
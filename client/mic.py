@@ -4,10 +4,13 @@
 """
 import logging
 import tempfile
+import threading
 import wave
 import audioop
+from concurrent import futures
 import pyaudio
 import alteration
+from bargein import BargeInDetector
 import jasperpath
 
 
@@ -16,7 +19,8 @@ class Mic:
     speechRec = None
     speechRec_persona = None
 
-    def __init__(self, speaker, passive_stt_engine, active_stt_engine):
+    def __init__(self, speaker, passive_stt_engine, active_stt_engine,
+                 barge_in=False):
         """
         Initiates the pocketsphinx instance.
 
@@ -25,11 +29,19 @@ class Mic:
         passive_stt_engine -- performs STT while Jasper is in passive listen
                               mode
         acive_stt_engine -- performs STT while Jasper is in active listen mode
+        barge_in -- if True, the user can interrupt speech output by
+                    talking while Jasper is speaking
         """
         self._logger = logging.getLogger(__name__)
         self.speaker = speaker
         self.passive_stt_engine = passive_stt_engine
         self.active_stt_engine = active_stt_engine
+        self.barge_in = barge_in
+        # Set when the user interrupted speech output, cleared as soon as
+        # Jasper listens actively again
+        self.interrupted = False
+        # Phrases are spoken one after another by a single playback thread
+        self._playback = futures.ThreadPoolExecutor(max_workers=1)
         self._logger.info("Initializing PyAudio. ALSA/Jack error messages " +
                           "that pop up during this process are normal and " +
                           "can usually be safely ignored.")
@@ -37,6 +49,7 @@ class Mic:
         self._logger.info("Initialization of PyAudio completed.")
 
     def __del__(self):
+        self._playback.shutdown(wait=False)
         self._audio.terminate()
 
     def getScore(self, data):
@@ -46,6 +59,9 @@ class Mic:
 
     def fetchThreshold(self):
 
+        # don't record our own voice
+        self.wait()
+
         # TODO: Consolidate variables from the next three functions
         THRESHOLD_MULTIPLIER = 1.8
         RATE = 16000
@@ -86,10 +102,14 @@ class Mic:
 
         return THRESHOLD
 
-    def passiveListen(self, PERSONA):
+    def passiveListen(self, PERSONA, stop=None):
         """
         Listens for PERSONA in everyday sound. Times out after LISTEN_TIME, so
         needs to be restarted.
+
+        Arguments:
+        stop -- if provided, an event; once it's set, listening stops as if
+                nothing had been said
         """
 
         THRESHOLD_MULTIPLIER = 1.8
@@ -102,6 +122,9 @@ class Mic:
         # number of seconds to listen before forcing restart
         LISTEN_TIME = 10
 
+        # don't record our own voice
+        self.wait()
+
         # prepare recording stream
         stream = self._audio.open(format=pyaudio.paInt16,
                                   channels=1,
@@ -138,6 +161,9 @@ class Mic:
         # start passively listening for disturbance above threshold
         for i in range(0, RATE / CHUNK * LISTEN_TIME):
 
+            if stop is not None and stop.is_set():
+                break
+
             data = stream.read(CHUNK)
             frames.append(data)
             score = self.getScore(data)
@@ -206,6 +232,10 @@ class Mic:
         CHUNK = 1024
         LISTEN_TIME = 12
 
+        # don't record our own voice
+        self.wait()
+        self.interrupted = False
+
         # check if no threshold provided
         if THRESHOLD is None:
             THRESHOLD = self.fetchThreshold()
@@ -255,8 +285,97 @@ class Mic:
             f.seek(0)
             return self.active_stt_engine.transcribe(f)
 
+    def listenForBargeIn(self, playback):
+        """
+        Watches the microphone while Jasper is speaking and stops the
+        speaker as soon as the user starts talking.
+
+        Arguments:
+        playback -- the thread that is running the speech output
+
+        Returns True if the speech output has been interrupted.
+        """
+
+        RATE = 16000
+        CHUNK = 1024
+
+        stream = self._audio.open(format=pyaudio.paInt16,
+                                  channels=1,
+                                  rate=RATE,
+                                  input=True,
+                                  frames_per_buffer=CHUNK)
+
+        detector = BargeInDetector()
+        interrupted = False
+
+        while playback.is_alive():
+            was_playing = self.speaker.is_playing()
+            score = self.getScore(stream.read(CHUNK))
+            playing = was_playing and self.speaker.is_playing()
+
+            if detector.feed(score, playing):
+                self._logger.info("User started speaking, interrupting " +
+                                  "speech output")
+                self.speaker.stop()
+                interrupted = True
+                break
+
+        stream.stop_stream()
+        stream.close()
+        playback.join()
+        # The phrase is over, so the next one may be played again
+        self.speaker.reset()
+
+        return interrupted
+
     def say(self, phrase,
             OPTIONS=" -vdefault+m3 -p 40 -s 160 --stdout > say.wav"):
+        """
+        Queues 'phrase' for speech output and returns immediately, so that
+        the caller can go on working while Jasper is speaking. Phrases are
+        spoken in the order they have been queued. Use wait() if you need
+        the output to be finished.
+
+        Returns a future that is done as soon as the phrase has been spoken.
+        """
         # alter phrase before speaking
         phrase = alteration.clean(phrase)
-        self.speaker.say(phrase)
+        return self._playback.submit(self._speak, phrase)
+
+    def wait(self):
+        """
+        Blocks until all queued phrases have been spoken.
+        """
+        # The playback thread processes phrases in order, so once this
+        # no-op is done, everything that has been queued before is done too
+        self._playback.submit(lambda: None).result()
+
+    def presynthesize(self, phrase):
+        """
+        Synthesizes 'phrase' ahead of time, so that saying it later on
+        doesn't have to wait for the synthesizer. Blocks until it's done.
+        """
+        self.speaker.presynthesize(alteration.clean(phrase))
+
+    def _play(self, phrase):
+        if not self.speaker.say_presynthesized(phrase):
+            self.speaker.say(phrase)
+
+    def _speak(self, phrase):
+        if self.interrupted:
+            # The user barged in, so everything the module still wants to
+            # say until the next listen cycle is obsolete
+            self._logger.debug("Dropping phrase '%s' after barge-in", phrase)
+            return
+
+        try:
+            if not self.barge_in:
+                self._play(phrase)
+                return
+
+            playback = threading.Thread(target=self._play, args=(phrase,))
+            playback.daemon = True
+            playback.start()
+            self.interrupted = self.listenForBargeIn(playback)
+        except Exception:
+            self._logger.error("Failed to say '%s'", phrase, exc_info=True)
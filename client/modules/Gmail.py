@@ -1,11 +1,21 @@
 # -*- coding: utf-8-*-
+import os
 import imaplib
 import email
 import re
+import json
+import logging
 from dateutil import parser
+from client import app_utils
 
 WORDS = ["EMAIL", "INBOX"]
 
+# The headers needed to announce an email; PEEK keeps it unread
+HEADER_FIELDS = 'BODY.PEEK[HEADER.FIELDS (FROM DATE)]'
+
+# Maximum number of emails fetched with a single command
+FETCH_BATCH_SIZE = 500
+
 
 def getSender(email):
     """
@@ -45,15 +55,112 @@ def getMostRecentDate(emails):
     return None
 
 
-def fetchUnreadEmails(profile, since=None, markRead=False, limit=None):
+class HighWaterMark(object):
+    """
+        Remembers the highest UID of the emails that have been fetched from
+        a mailbox, so that only newer emails are fetched the next time. UIDs
+        are only valid as long as the mailbox's UIDVALIDITY doesn't change.
+    """
+
+    def __init__(self, fname=None):
+        """
+            Arguments:
+            fname -- if provided, the mark is persisted in this file
+        """
+        self.fname = fname
+        self.uidvalidity = None
+        self.uid = None
+        if fname and os.path.isfile(fname):
+            try:
+                with open(fname, 'r') as f:
+                    data = json.load(f)
+                self.uidvalidity = data['uidvalidity']
+                self.uid = data['uid']
+            except (ValueError, KeyError):
+                logging.getLogger(__name__).warning(
+                    "Ignoring broken UID file '%s'", fname)
+
+    def get(self, uidvalidity):
+        """
+            Returns the highest UID that has been fetched, or None if
+            nothing has been fetched with this UIDVALIDITY yet.
+        """
+        return self.uid if uidvalidity == self.uidvalidity else None
+
+    def update(self, uidvalidity, uid):
+        self.uidvalidity = uidvalidity
+        self.uid = uid
+        if self.fname:
+            # Written atomically, a broken file would reset the mark and
+            # old emails would be announced again
+            app_utils.writeJSON(self.fname,
+                                {'uidvalidity': uidvalidity, 'uid': uid})
+
+
+def getUIDValidity(conn, mailbox='INBOX'):
+    """
+        Returns the UIDVALIDITY of the selected mailbox.
+
+        Arguments:
+        conn -- an IMAP connection with the mailbox selected
+        mailbox -- the name of the selected mailbox
+    """
+    typ, data = conn.response('UIDVALIDITY')
+    if data and data[0]:
+        return int(data[0])
+    # imaplib only keeps the response to SELECT until it has been read once,
+    # so connections that are reused have to ask for it again
+    typ, data = conn.status(mailbox, '(UIDVALIDITY)')
+    if typ == 'OK' and data and data[0]:
+        m = re.search(r'\bUIDVALIDITY (\d+)', data[0])
+        if m:
+            return int(m.group(1))
+    return None
+
+
+def fetchHeaders(conn, uids):
+    """
+        Fetches the headers needed to announce emails (but not their bodies,
+        and without marking them as read) in as few commands as possible.
+
+        Arguments:
+        conn -- an IMAP connection with a mailbox selected
+        uids -- the UIDs of the emails
+
+        Returns:
+        A list of email objects (that only have headers), sorted by UID.
+    """
+    msgs = []
+    for i in range(0, len(uids), FETCH_BATCH_SIZE):
+        batch = ','.join(str(uid) for uid in uids[i:i + FETCH_BATCH_SIZE])
+        retcode, data = conn.uid('FETCH', batch, '(UID %s)' % HEADER_FIELDS)
+        if retcode != 'OK':
+            continue
+        for item in data:
+            # Responses are tuples of a description like '1 (UID 23 BODY[...]
+            # {57}' and the headers, separated by closing parentheses
+            if isinstance(item, tuple):
+                m = re.search(r'\bUID (\d+)', item[0])
+                if m:
+                    msgs.append((int(m.group(1)),
+                                 email.message_from_string(item[1])))
+    msgs.sort(key=lambda msg: msg[0])
+    return [msg for uid, msg in msgs]
+
+
+def fetchUnreadEmails(profile, mark=None, markRead=False, limit=None):
     """
         Fetches a list of unread email objects from a user's Gmail inbox.
+        Only the headers needed to announce them are fetched.
 
         Arguments:
         profile -- contains information related to the user (e.g., Gmail
                    address)
-        since -- if provided, no emails before this date will be returned
+        mark -- if provided, a HighWaterMark; only emails newer than it are
+                returned and it is updated to the newest email
         markRead -- if True, marks all returned emails as read in target inbox
+        limit -- if there are more unread emails than this, only their
+                 number is returned
 
         Returns:
         A list of unread email objects.
@@ -63,23 +170,56 @@ def fetchUnreadEmails(profile, since=None, markRead=False, limit=None):
     conn.login(profile['gmail_address'], profile['gmail_password'])
     conn.select(readonly=(not markRead))
 
+    try:
+        return fetchUnreadEmailsFrom(conn, mark=mark, markRead=markRead,
+                                     limit=limit)
+    finally:
+        conn.close()
+        conn.logout()
+
+
+def fetchUnreadEmailsFrom(conn, mark=None, markRead=False, limit=None,
+                          mailbox='INBOX'):
+    """
+        Like fetchUnreadEmails, but uses a connection that is already
+        logged in, e.g. the one that waits for new emails. The connection
+        is left open.
+
+        Arguments:
+        conn -- an authenticated IMAP connection with the mailbox selected
+                (read-write if markRead is True)
+        mark -- if provided, a HighWaterMark; only emails newer than it are
+                returned and it is updated to the newest email
+        markRead -- if True, marks all returned emails as read in target inbox
+        limit -- if there are more unread emails than this, only their
+                 number is returned
+        mailbox -- the name of the selected mailbox
+
+        Returns:
+        A list of unread email objects.
+    """
     msgs = []
-    (retcode, messages) = conn.search(None, '(UNSEEN)')
-
-    if retcode == 'OK' and messages != ['']:
-        numUnread = len(messages[0].split(' '))
-        if limit and numUnread > limit:
-            return numUnread
-
-        for num in messages[0].split(' '):
-            # parse email RFC822 format
-            ret, data = conn.fetch(num, '(RFC822)')
-            msg = email.message_from_string(data[0][1])
-
-            if not since or getDate(msg) > since:
-                msgs.append(msg)
-    conn.close()
-    conn.logout()
+    uidvalidity = getUIDValidity(conn, mailbox)
+    lastUID = mark.get(uidvalidity) if mark else None
+    if lastUID is not None:
+        criteria = '(UNSEEN UID %d:*)' % (lastUID + 1)
+    else:
+        criteria = '(UNSEEN)'
+    (retcode, messages) = conn.uid('SEARCH', None, criteria)
+
+    if retcode == 'OK' and messages and messages[0]:
+        # 'n:*' always includes the newest email, even if its UID is lower
+        uids = [uid for uid in (int(x) for x in messages[0].split())
+                if lastUID is None or uid > lastUID]
+        if limit and len(uids) > limit:
+            return len(uids)
+
+        msgs = fetchHeaders(conn, uids)
+        if uids and markRead:
+            conn.uid('STORE', ','.join(str(uid) for uid in uids),
+                     '+FLAGS', '(\\Seen)')
+        if uids and mark:
+            mark.update(uidvalidity, max(uids))
 
     return msgs
 
@@ -1,5 +1,4 @@
 # -*- coding: utf-8-*-
-import urllib2
 import re
 import random
 from bs4 import BeautifulSoup
@@ -12,6 +11,12 @@ PRIORITY = 4
 
 URL = 'http://news.ycombinator.com'
 
+# Seconds before the front page is fetched again
+CACHE_TTL = 5 * 60
+
+# Seconds between refreshes of the front page in the background
+PREFETCH_INTERVAL = 4 * 60
+
 
 class HNStory:
 
@@ -20,28 +25,80 @@ class HNStory:
         self.URL = URL
 
 
-def getTopStories(maxResults=None):
+def parseTopStories(page):
+    """
+        Returns a list of (title, URL) tuples of the stories on the front
+        page.
+    """
+    soup = BeautifulSoup(page)
+    matches = soup.findAll('td', class_="title")
+    matches = [m.a for m in matches if m.a and m.text != u'More']
+    return [(m.text, m['href']) for m in matches]
+
+
+def fetchTopStories():
+    """
+        Fetches the top headlines from Hacker News.
+
+        Returns:
+        A list of (title, URL) tuples.
+    """
+    hdr = {'User-Agent': 'Mozilla/5.0'}
+    return app_utils.fetchURL(URL, parseTopStories, headers=hdr)
+
+
+def getTopStories(maxResults=None, refresh=False):
     """
         Returns the top headlines from Hacker News.
 
         Arguments:
         maxResults -- if provided, returns a random sample of size maxResults
+        refresh -- if True, the front page is fetched even if the cached
+                   one is still fresh
     """
-    hdr = {'User-Agent': 'Mozilla/5.0'}
-    req = urllib2.Request(URL, headers=hdr)
-    page = urllib2.urlopen(req).read()
-    soup = BeautifulSoup(page)
-    matches = soup.findAll('td', class_="title")
-    matches = [m.a for m in matches if m.a and m.text != u'More']
-    matches = [HNStory(m.text, m['href']) for m in matches]
+    matches = [HNStory(title, url) for title, url in
+               app_utils.getCached('hn-top-stories', fetchTopStories,
+                                   CACHE_TTL, refresh=refresh)]
 
     if maxResults:
         num_stories = min(maxResults, len(matches))
-        return random.sample(matches, num_stories)
+        # The sample only changes along with the front page, so what's
+        # said about it can be synthesized ahead of time
+        rand = random.Random(u' '.join(story.title for story in matches))
+        return rand.sample(matches, num_stories)
 
     return matches
 
 
+def wantsArticles(profile):
+    """
+        Returns True if the user is asked whether to send the stories.
+    """
+    return bool(not profile['prefers_email'] and profile['phone_number'])
+
+
+def getAnnouncement(stories, profile):
+    """
+        Returns what Jasper says about the stories.
+    """
+    all_titles = '... '.join(str(idx + 1) + ") " +
+                             story.title for idx, story in enumerate(stories))
+    if wantsArticles(profile):
+        return ("Here are some front-page articles. " +
+                all_titles + ". Would you like me to send you these? " +
+                "If so, which?")
+    return "Here are some front-page articles. " + all_titles
+
+
+def prefetch(profile):
+    """
+        Refreshes the front page and returns what handle() would say about
+        it.
+    """
+    stories = getTopStories(maxResults=3, refresh=True)
+    return ["Pulling up some stories.", getAnnouncement(stories, profile)]
+
+
 def handle(text, mic, profile):
     """
         Responds to user-input, typically speech text, with a sample of
@@ -56,8 +113,6 @@ def handle(text, mic, profile):
     """
     mic.say("Pulling up some stories.")
     stories = getTopStories(maxResults=3)
-    all_titles = '... '.join(str(idx + 1) + ") " +
-                             story.title for idx, story in enumerate(stories))
 
     def handleResponse(text):
 
@@ -78,29 +133,32 @@ def handle(text, mic, profile):
             if profile['prefers_email']:
                 body = "<ul>"
 
-            def formatArticle(article):
-                tiny_url = app_utils.generateTinyURL(article.URL)
-
+            def formatArticle(article, tiny_url):
                 if profile['prefers_email']:
                     return "<li><a href=\'%s\'>%s</a></li>" % (tiny_url,
                                                                article.title)
                 else:
                     return article.title + " -- " + tiny_url
 
-            for idx, article in enumerate(stories):
-                if send_all or (idx + 1) in chosen_articles:
-                    article_link = formatArticle(article)
-
-                    if profile['prefers_email']:
-                        body += article_link
-                    else:
-                        if not app_utils.emailUser(profile, SUBJECT="",
-                                                   BODY=article_link):
-                            mic.say("I'm having trouble sending you these " +
-                                    "articles. Please make sure that your " +
-                                    "phone number and carrier are correct " +
-                                    "on the dashboard.")
-                            return
+            chosen = [article for idx, article in enumerate(stories)
+                      if send_all or (idx + 1) in chosen_articles]
+            # Compress all URLs at the same time rather than one by one
+            tiny_urls = app_utils.generateTinyURLs([article.URL
+                                                    for article in chosen])
+
+            for article, tiny_url in zip(chosen, tiny_urls):
+                article_link = formatArticle(article, tiny_url)
+
+                if profile['prefers_email']:
+                    body += article_link
+                else:
+                    if not app_utils.emailUser(profile, SUBJECT="",
+                                               BODY=article_link):
+                        mic.say("I'm having trouble sending you these " +
+                                "articles. Please make sure that your " +
+                                "phone number and carrier are correct " +
+                                "on the dashboard.")
+                        return
 
             # if prefers email, we send once, at the end
             if profile['prefers_email']:
@@ -119,15 +177,10 @@ def handle(text, mic, profile):
         else:
             mic.say("OK I will not send any articles")
 
-    if not profile['prefers_email'] and profile['phone_number']:
-        mic.say("Here are some front-page articles. " +
-                all_titles + ". Would you like me to send you these? " +
-                "If so, which?")
+    mic.say(getAnnouncement(stories, profile))
+    if wantsArticles(profile):
         handleResponse(mic.activeListen())
 
-    else:
-        mic.say("Here are some front-page articles. " + all_titles)
-
 
 def isValid(text):
     """
@@ -1,13 +1,22 @@
 # -*- coding: utf-8-*-
 import re
+import socket
 import logging
-import difflib
+import functools
+import threading
+from concurrent import futures
 import mpd
 from client.mic import Mic
+from client import jasperpath
+from client.fuzzyindex import FuzzyIndex
+from client.mpdlibrary import LibraryLoader
 
 # Standard module stuff
 WORDS = ["MUSIC", "SPOTIFY"]
 
+# Music mode keeps running until the user closes it
+TIMEOUT = None
+
 
 def handle(text, mic, profile):
     """
@@ -44,7 +53,13 @@ def handle(text, mic, profile):
 
     logger.debug("Starting music mode")
     music_mode = MusicMode(persona, mic, mpdwrapper)
-    music_mode.handleForever()
+    # The music mode comes with its own Mic, so make sure that we're done
+    # talking through the old one before we start using it
+    mic.wait()
+    try:
+        music_mode.handleForever()
+    finally:
+        mpdwrapper.close()
     logger.debug("Exiting music mode")
 
     return
@@ -63,6 +78,9 @@ def isValid(text):
 # The interesting part
 class MusicMode(object):
 
+    COMMANDS = ["STOP", "CLOSE", "PLAY", "PAUSE", "NEXT", "PREVIOUS",
+                "LOUDER", "SOFTER", "LOWER", "HIGHER", "VOLUME", "PLAYLIST"]
+
     def __init__(self, PERSONA, mic, mpdwrapper):
         self._logger = logging.getLogger(__name__)
         self.persona = PERSONA
@@ -70,17 +88,82 @@ class MusicMode(object):
         self.music = mpdwrapper
 
         # index spotify playlists into new dictionary and language models
-        phrases = ["STOP", "CLOSE", "PLAY", "PAUSE", "NEXT", "PREVIOUS",
-                   "LOUDER", "SOFTER", "LOWER", "HIGHER", "VOLUME",
-                   "PLAYLIST"]
-        phrases.extend(self.music.get_soup_playlist())
-
-        music_stt_engine = mic.active_stt_engine.get_instance('music', phrases)
+        self._stt_engine = mic.active_stt_engine
+        music_stt_engine = self._stt_engine.get_instance(
+            'music', self.get_phrases(library=False))
 
         self.mic = Mic(mic.speaker,
                        mic.passive_stt_engine,
                        music_stt_engine)
 
+        # Song and artist names make the vocabulary big and slow to compile,
+        # so it's compiled in the background and used as soon as it's ready.
+        # It's recompiled whenever the MPD database changes.
+        self.library_ready = False
+        self._library_revision = 0
+        self._library_lock = threading.Lock()
+        # A thread rather than a process: forking this heavily threaded
+        # process could deadlock the child (e.g. on the logging lock)
+        self._executor = futures.ThreadPoolExecutor(max_workers=1)
+        self.update_library_vocabulary()
+        self.music.subscribe(self.handle_mpd_change)
+
+    def get_phrases(self, library=True):
+        """
+        Returns the phrases of the music mode vocabulary
+
+        Arguments:
+        library -- if True, song titles and artists are included
+        """
+        phrases = list(self.COMMANDS)
+        phrases.extend(self.music.get_soup_playlist())
+        if library:
+            phrases.extend(self.music.get_soup_separated())
+        return phrases
+
+    def update_library_vocabulary(self):
+        """
+        Compiles the vocabulary that includes song titles and artists in the
+        background and switches to it when it's done.
+        """
+        with self._library_lock:
+            self._library_revision += 1
+            revision = self._library_revision
+
+        def switch_engine(future):
+            try:
+                engine = future.result()
+            except Exception:
+                self._logger.error("Couldn't compile music library " +
+                                   "vocabulary", exc_info=True)
+                return
+            with self._library_lock:
+                if revision != self._library_revision:
+                    # A newer compilation is already under way
+                    return
+                self.mic.active_stt_engine = engine
+                self.library_ready = True
+            self._logger.info("Music library vocabulary is ready")
+
+        self._logger.debug("Compiling music library vocabulary...")
+        future = self._stt_engine.get_instance_async(
+            'music-library', self.get_phrases(library=True), self._executor)
+        future.add_done_callback(switch_engine)
+
+    def handle_mpd_change(self, subsystems):
+        if 'database' in subsystems:
+            self.music.load_library()
+        elif 'stored_playlist' in subsystems:
+            self.music.load_playlists()
+        else:
+            return
+        self._logger.debug("MPD subsystems changed: %r", subsystems)
+        self.update_library_vocabulary()
+
+    def close(self):
+        self.music.unsubscribe(self.handle_mpd_change)
+        self._executor.shutdown(wait=False)
+
     def delegateInput(self, input):
 
         command = input.upper()
@@ -125,22 +208,14 @@ class MusicMode(object):
             self.mic.say("Playing %s" % self.music.current_song())
             return
 
-        # SONG SELECTION... requires long-loading dictionary and language model
-        # songs = self.music.fuzzy_songs(query = command.replace("PLAY", ""))
-        # if songs:
-        #     self.mic.say("Found songs")
-        #     self.music.play(songs = songs)
-
-        #     print("SONG RESULTS")
-        #     print("============")
-        #     for song in songs:
-        #         print("Song: %s Artist: %s" % (song.title, song.artist))
-
-        #     self.mic.say("Playing %s" % self.music.current_song())
-
-        # else:
-        #     self.mic.say("No songs found. Resuming current song.")
-        #     self.music.play()
+        # SONG SELECTION... requires the library vocabulary
+        if self.library_ready:
+            songs = self.music.fuzzy_songs(query=command.replace("PLAY", ""))
+            if songs:
+                self.mic.say("Found songs")
+                self.music.play(songs=songs)
+                self.mic.say("Playing %s" % self.music.current_song())
+                return
 
         # PLAYLIST SELECTION
         playlists = self.music.fuzzy_playlists(query=command)
@@ -155,6 +230,12 @@ class MusicMode(object):
         return
 
     def handleForever(self):
+        try:
+            self._handleForever()
+        finally:
+            self.close()
+
+    def _handleForever(self):
 
         self.music.play()
         self.mic.say("Playing %s" % self.music.current_song())
@@ -181,79 +262,260 @@ class MusicMode(object):
                 self.music.play()
 
 
-def reconnect(func, *default_args, **default_kwargs):
+def reconnect(func):
     """
-        Reconnects before running
+        Runs a command on the persistent connection and reconnects (once) if
+        the connection has been lost
     """
 
-    def wrap(self, *default_args, **default_kwargs):
-        try:
-            self.client.connect(self.server, self.port)
-        except:
-            pass
+    @functools.wraps(func)
+    def wrap(self, *args, **kwargs):
+        # The connection is shared with MPDWatcher callbacks
+        with self.lock:
+            try:
+                return func(self, *args, **kwargs)
+            except (mpd.ConnectionError, socket.error):
+                self._logger.info("Lost connection to MPD server, " +
+                                  "reconnecting", exc_info=True)
+                self.connect()
+                return func(self, *args, **kwargs)
 
-        # sometimes not enough to just connect
-        try:
-            return func(self, *default_args, **default_kwargs)
-        except:
-            self.client = mpd.MPDClient()
-            self.client.timeout = None
-            self.client.idletimeout = None
-            self.client.connect(self.server, self.port)
+    return wrap
 
-            return func(self, *default_args, **default_kwargs)
 
-    return wrap
+class MPDWatcher(threading.Thread):
+    """
+    Waits for changes of MPD subsystems on a connection of its own (using
+    MPD's idle command) and calls a callback with that connection and the
+    list of changed subsystems.
+    """
 
+    # Seconds to wait before reconnecting after an error
+    RECONNECT_DELAY = 5
 
-class Song(object):
-    def __init__(self, id, title, artist, album):
+    # Seconds stop() waits for the thread to end
+    STOP_TIMEOUT = 5
 
-        self.id = id
-        self.title = title
-        self.artist = artist
-        self.album = album
+    def __init__(self, server, port, subsystems, callback, on_connect=None):
+        """
+        Arguments:
+        server, port -- the MPD server to connect to
+        subsystems -- the names of the subsystems to watch
+        callback -- called with the connection and the changed subsystems
+        on_connect -- if given, called with the connection whenever it has
+                      been (re)established, since changes may have been
+                      missed in the meantime
+        """
+        super(MPDWatcher, self).__init__()
+        self.daemon = True
+        self._logger = logging.getLogger(__name__)
+        self.server = server
+        self.port = port
+        self.subsystems = subsystems
+        self.callback = callback
+        self.on_connect = on_connect
+        self._stopped = threading.Event()
+        self._client = None
+        self._client_lock = threading.Lock()
+
+    def stop(self):
+        """
+        Stops watching and waits for the thread to end. The thread is
+        usually blocked in the idle command, so the connection is shut
+        down to wake it up.
+        """
+        self._stopped.set()
+        with self._client_lock:
+            client = self._client
+        # noidle would race the watcher thread for the response
+        sock = getattr(client, '_sock', None)
+        if sock is not None:
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except socket.error:
+                pass
+        if self.is_alive() and threading.current_thread() is not self:
+            self.join(self.STOP_TIMEOUT)
+
+    def run(self):
+        while not self._stopped.is_set():
+            client = mpd.MPDClient()
+            client.timeout = None
+            client.idletimeout = None
+            with self._client_lock:
+                self._client = client
+            try:
+                client.connect(self.server, self.port)
+                if self.on_connect is not None:
+                    self.on_connect(client)
+                while not self._stopped.is_set():
+                    changed = client.idle(*self.subsystems)
+                    if not self._stopped.is_set():
+                        self.callback(client, changed)
+            except (mpd.MPDError, socket.error):
+                if self._stopped.is_set():
+                    # stop() shut down the connection
+                    break
+                self._logger.warning("Lost connection to MPD server, " +
+                                     "reconnecting in %d seconds",
+                                     self.RECONNECT_DELAY, exc_info=True)
+                self._stopped.wait(self.RECONNECT_DELAY)
+            except Exception:
+                self._logger.error("Error while handling MPD change",
+                                   exc_info=True)
+            finally:
+                with self._client_lock:
+                    self._client = None
+                try:
+                    client.disconnect()
+                except (mpd.MPDError, socket.error):
+                    pass
 
 
 class MPDWrapper(object):
+
+    # Subsystems whose changes are tracked by the idle thread
+    SUBSYSTEMS = ['database', 'stored_playlist', 'playlist', 'player',
+                  'mixer', 'options']
+
+    # Subsystems whose changes affect the cached status and current song
+    STATE_SUBSYSTEMS = frozenset(['playlist', 'player', 'mixer', 'options'])
+
     def __init__(self, server="localhost", port=6600):
         """
             Prepare the client and music variables
         """
+        self._logger = logging.getLogger(__name__)
         self.server = server
         self.port = port
+        self.lock = threading.RLock()
+
+        # Status and current song as last reported by the server, kept up
+        # to date by the watcher so that reading them doesn't need a
+        # round-trip
+        self._state_lock = threading.Lock()
+        self._status = {}
+        self._current_song = {}
+        self._listeners = []
+
+        # Indexes for looking up songs and playlists by (mis)transcribed
+        # names, updated whenever the library is reloaded
+        self._playlist_index = FuzzyIndex()
+        self._title_index = FuzzyIndex()
+        self._artist_index = FuzzyIndex()
+
+        self._library_loader = LibraryLoader(
+            jasperpath.config('mpd-library.json'))
 
         # prepare client
+        self.connect()
+
+        self.load_library()
+
+        self._watcher = MPDWatcher(self.server, self.port, self.SUBSYSTEMS,
+                                   self._handle_change,
+                                   on_connect=self._fetch_state)
+        self._watcher.start()
+
+    def connect(self):
+        """
+            (Re)establishes the connection used for commands
+        """
         self.client = mpd.MPDClient()
         self.client.timeout = None
         self.client.idletimeout = None
         self.client.connect(self.server, self.port)
 
-        # gather playlists
-        self.playlists = [x["playlist"] for x in self.client.listplaylists()]
+    def close(self):
+        """
+            Stops watching the server and closes the connection
+        """
+        self._watcher.stop()
+        with self.lock:
+            try:
+                self.client.disconnect()
+            except (mpd.MPDError, socket.error):
+                pass
+
+    def subscribe(self, listener):
+        """
+            Registers a callable that gets called with the list of changed
+            subsystems whenever the server reports a change. It's called
+            from the watcher thread.
+        """
+        self._listeners.append(listener)
+
+    def unsubscribe(self, listener):
+        self._listeners.remove(listener)
+
+    def _set_state(self, status, current_song):
+        with self._state_lock:
+            self._status = status
+            self._current_song = current_song
+
+    def _fetch_state(self, client):
+        client.command_list_ok_begin()
+        client.status()
+        client.currentsong()
+        status, current_song = client.command_list_end()
+        self._set_state(status, current_song)
+
+    def _handle_change(self, client, changed):
+        if self.STATE_SUBSYSTEMS.intersection(changed):
+            self._fetch_state(client)
+        for listener in list(self._listeners):
+            listener(changed)
+
+    def _execute(self, *commands):
+        """
+            Runs commands in a single command list, followed by the commands
+            that refresh the cached state, so that the cache already
+            reflects the commands when this returns. Has to be called by a
+            method decorated with reconnect.
 
-        # gather songs
-        self.client.clear()
-        for playlist in self.playlists:
-            self.client.load(playlist)
+            Arguments:
+            commands -- (command name, arguments) tuples
 
-        self.songs = []  # may have duplicates
-        # capitalized strings
-        self.song_titles = []
-        self.song_artists = []
+            Returns:
+            The results of the commands
+        """
+        self.client.command_list_ok_begin()
+        for name, args in commands:
+            getattr(self.client, name)(*args)
+        self.client.status()
+        self.client.currentsong()
+        results = list(self.client.command_list_end())
+        self._set_state(results[-2], results[-1])
+        return results[:-2]
+
+    @property
+    def status(self):
+        """
+            The cached status of the server
+        """
+        with self._state_lock:
+            return dict(self._status)
 
-        soup = self.client.playlist()
-        for i in range(0, len(soup) / 10):
-            index = i * 10
-            id = soup[index].strip()
-            title = soup[index + 3].strip().upper()
-            artist = soup[index + 2].strip().upper()
-            album = soup[index + 4].strip().upper()
+    @reconnect
+    def load_playlists(self):
+        """
+            Gathers the names of all stored playlists
+        """
+        self.playlists = [x["playlist"] for x in self.client.listplaylists()]
+        self._playlist_index.update(name.upper() for name in self.playlists)
+
+    @reconnect
+    def load_library(self):
+        """
+            Gathers playlists and songs
+        """
+        self.load_playlists()
 
-            self.songs.append(Song(id, title, artist, album))
+        # a SongCatalogue with capitalized titles, artists and albums
+        self.songs = self._library_loader.load(self.client)
 
-            self.song_titles.append(title)
-            self.song_artists.append(artist)
+        self._title_index.update(self.songs.distinct('title'))
+        self._artist_index.update(self.songs.distinct('artist'))
 
     @reconnect
     def play(self, songs=False, playlist_name=False):
@@ -261,58 +523,73 @@ class MPDWrapper(object):
             Plays the current song or accepts a song to play.
 
             Arguments:
-            songs -- a list of song objects
+            songs -- a list of rows of songs in self.songs
             playlist_name -- user-defined, something like "Love Song Playlist"
         """
+        commands = []
         if songs:
-            self.client.clear()
-            for song in songs:
-                try:  # for some reason, certain ids don't work
-                    self.client.add(song.id)
-                except:
-                    pass
+            commands.append(('clear', ()))
+            commands.extend(('add', (self.songs.get(row, 'file'),))
+                            for row in songs)
 
         if playlist_name:
-            self.client.clear()
-            self.client.load(playlist_name)
+            commands.append(('clear', ()))
+            commands.append(('load', (playlist_name,)))
 
-        self.client.play()
+        commands.append(('play', ()))
+
+        try:
+            self._execute(*commands)
+        except mpd.CommandError:
+            if not songs:
+                raise
+            # MPD aborts a command list at the first failing command, and
+            # for some reason, certain ids don't work, so add them one by one
+            self.client.clear()
+            for row in songs:
+                uri = self.songs.get(row, 'file')
+                try:
+                    self.client.add(uri)
+                except mpd.CommandError:
+                    self._logger.warning("Couldn't add song '%s'", uri)
+            self._execute(('play', ()))
 
-    @reconnect
     def current_song(self):
-        item = self.client.playlistinfo(int(self.client.status()["song"]))[0]
-        result = "%s by %s" % (item["title"], item["artist"])
-        return result
+        with self._state_lock:
+            item = self._current_song
+        if not item:
+            return "nothing"
+        return "%s by %s" % (item.get("title", "unknown title"),
+                             item.get("artist", "unknown artist"))
 
     @reconnect
     def volume(self, level=None, interval=None):
 
-        if level:
-            self.client.setvol(int(level))
-            return
+        if level is None and interval:
+            try:
+                level = int(self.status['volume']) + int(interval)
+            except (KeyError, ValueError):
+                # volume is unknown, e.g. if there is no mixer
+                return
 
-        if interval:
-            level = int(self.client.status()['volume']) + int(interval)
-            self.client.setvol(int(level))
-            return
+        if level is not None:
+            self._execute(('setvol', (max(0, min(100, int(level))),)))
 
     @reconnect
     def pause(self):
-        self.client.pause()
+        self._execute(('pause', ()))
 
     @reconnect
     def stop(self):
-        self.client.stop()
+        self._execute(('stop', ()))
 
     @reconnect
     def next(self):
-        self.client.next()
-        return
+        self._execute(('next', ()))
 
     @reconnect
     def previous(self):
-        self.client.previous()
-        return
+        self._execute(('previous', ()))
 
     def get_soup(self):
         """
@@ -321,11 +598,9 @@ class MPDWrapper(object):
 
         soup = []
 
-        for song in self.songs:
-            song_words = song.title.split(" ")
-            artist_words = song.artist.split(" ")
-            soup.extend(song_words)
-            soup.extend(artist_words)
+        for name in (self.songs.distinct('title') +
+                     self.songs.distinct('artist')):
+            soup.extend(name.split(" "))
 
         title_trans = ''.join(chr(c) if chr(c).isupper() or chr(c).islower()
                               else '_' for c in range(256))
@@ -358,10 +633,8 @@ class MPDWrapper(object):
         Returns the list of PHRASES that comprise song and artist titles
         """
 
-        title_soup = [song.title for song in self.songs]
-        artist_soup = [song.artist for song in self.songs]
-
-        soup = list(set(title_soup + artist_soup))
+        soup = list(set(self.songs.distinct('title') +
+                        self.songs.distinct('artist')))
 
         title_trans = ''.join(chr(c) if chr(c).isupper() or chr(c).islower()
                               else '_' for c in range(256))
@@ -373,16 +646,14 @@ class MPDWrapper(object):
 
     def fuzzy_songs(self, query):
         """
-        Returns songs matching a query best as possible on either artist
-        field, etc
+        Returns the rows of songs matching a query best as possible on
+        either artist field, etc
         """
 
         query = query.upper()
 
-        matched_song_titles = difflib.get_close_matches(query,
-                                                        self.song_titles)
-        matched_song_artists = difflib.get_close_matches(query,
-                                                         self.song_artists)
+        matched_song_titles = self._title_index.search(query)
+        matched_song_artists = self._artist_index.search(query)
 
         # if query is beautifully matched, then forget about everything else
         strict_priority_title = [x for x in matched_song_titles if x == query]
@@ -394,12 +665,12 @@ class MPDWrapper(object):
         if strict_priority_artists:
             matched_song_artists = strict_priority_artists
 
-        matched_songs_bytitle = [
-            song for song in self.songs if song.title in matched_song_titles]
-        matched_songs_byartist = [
-            song for song in self.songs if song.artist in matched_song_artists]
+        matched_songs_bytitle = [row for title in matched_song_titles
+                                 for row in self.songs.find('title', title)]
+        matched_songs_byartist = [row for artist in matched_song_artists
+                                  for row in self.songs.find('artist', artist)]
 
-        matches = list(set(matched_songs_bytitle + matched_songs_byartist))
+        matches = sorted(set(matched_songs_bytitle + matched_songs_byartist))
 
         return matches
 
@@ -409,5 +680,5 @@ class MPDWrapper(object):
         """
         query = query.upper()
         lookup = {n.upper(): n for n in self.playlists}
-        results = [lookup[r] for r in difflib.get_close_matches(query, lookup)]
+        results = [lookup[r] for r in self._playlist_index.search(query)]
         return results
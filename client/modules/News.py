@@ -10,6 +10,12 @@ PRIORITY = 3
 
 URL = 'http://news.ycombinator.com'
 
+# Seconds before the headlines are fetched again
+CACHE_TTL = 10 * 60
+
+# Seconds between refreshes of the headlines in the background
+PREFETCH_INTERVAL = 8 * 60
+
 
 class Article:
 
@@ -18,13 +24,31 @@ class Article:
         self.URL = URL
 
 
-def getTopArticles(maxResults=None):
-    d = feedparser.parse("http://news.google.com/?output=rss")
+def parseTopArticles(content):
+    """
+        Returns a list of (title, URL) tuples of the articles in the feed.
+    """
+    d = feedparser.parse(content)
+    return [(item['title'], item['link'].split("&url=")[1])
+            for item in d['items']]
+
+
+def fetchTopArticles():
+    """
+        Returns a list of (title, URL) tuples of the top news articles.
+    """
+    return app_utils.fetchURL("http://news.google.com/?output=rss",
+                              parseTopArticles)
+
+
+def getTopArticles(maxResults=None, refresh=False):
+    items = app_utils.getCached('news-top-articles', fetchTopArticles,
+                                CACHE_TTL, refresh=refresh)
 
     count = 0
     articles = []
-    for item in d['items']:
-        articles.append(Article(item['title'], item['link'].split("&url=")[1]))
+    for title, url in items:
+        articles.append(Article(title, url))
         count += 1
         if maxResults and count > maxResults:
             break
@@ -32,6 +56,29 @@ def getTopArticles(maxResults=None):
     return articles
 
 
+def getAnnouncement(articles, profile):
+    """
+        Returns what Jasper says about the articles.
+    """
+    titles = [" ".join(x.title.split(" - ")[:-1]) for x in articles]
+    all_titles = "... ".join(str(idx + 1) + ")" +
+                             title for idx, title in enumerate(titles))
+    if 'phone_number' in profile:
+        return ("Here are the current top headlines. " + all_titles +
+                ". Would you like me to send you these articles? " +
+                "If so, which?")
+    return "Here are the current top headlines. " + all_titles
+
+
+def prefetch(profile):
+    """
+        Refreshes the headlines and returns what handle() would say about
+        them.
+    """
+    articles = getTopArticles(maxResults=3, refresh=True)
+    return ["Pulling up the news", getAnnouncement(articles, profile)]
+
+
 def handle(text, mic, profile):
     """
         Responds to user-input, typically speech text, with a summary of
@@ -46,9 +93,6 @@ def handle(text, mic, profile):
     """
     mic.say("Pulling up the news")
     articles = getTopArticles(maxResults=3)
-    titles = [" ".join(x.title.split(" - ")[:-1]) for x in articles]
-    all_titles = "... ".join(str(idx + 1) + ")" +
-                             title for idx, title in enumerate(titles))
 
     def handleResponse(text):
 
@@ -69,29 +113,32 @@ def handle(text, mic, profile):
             if profile['prefers_email']:
                 body = "<ul>"
 
-            def formatArticle(article):
-                tiny_url = app_utils.generateTinyURL(article.URL)
-
+            def formatArticle(article, tiny_url):
                 if profile['prefers_email']:
                     return "<li><a href=\'%s\'>%s</a></li>" % (tiny_url,
                                                                article.title)
                 else:
                     return article.title + " -- " + tiny_url
 
-            for idx, article in enumerate(articles):
-                if send_all or (idx + 1) in chosen_articles:
-                    article_link = formatArticle(article)
-
-                    if profile['prefers_email']:
-                        body += article_link
-                    else:
-                        if not app_utils.emailUser(profile, SUBJECT="",
-                                                   BODY=article_link):
-                            mic.say("I'm having trouble sending you these " +
-                                    "articles. Please make sure that your " +
-                                    "phone number and carrier are correct " +
-                                    "on the dashboard.")
-                            return
+            chosen = [article for idx, article in enumerate(articles)
+                      if send_all or (idx + 1) in chosen_articles]
+            # Compress all URLs at the same time rather than one by one
+            tiny_urls = app_utils.generateTinyURLs([article.URL
+                                                    for article in chosen])
+
+            for article, tiny_url in zip(chosen, tiny_urls):
+                article_link = formatArticle(article, tiny_url)
+
+                if profile['prefers_email']:
+                    body += article_link
+                else:
+                    if not app_utils.emailUser(profile, SUBJECT="",
+                                               BODY=article_link):
+                        mic.say("I'm having trouble sending you these " +
+                                "articles. Please make sure that your " +
+                                "phone number and carrier are correct " +
+                                "on the dashboard.")
+                        return
 
             # if prefers email, we send once, at the end
             if profile['prefers_email']:
@@ -110,16 +157,10 @@ def handle(text, mic, profile):
 
             mic.say("OK I will not send any articles")
 
+    mic.say(getAnnouncement(articles, profile))
     if 'phone_number' in profile:
-        mic.say("Here are the current top headlines. " + all_titles +
-                ". Would you like me to send you these articles? " +
-                "If so, which?")
         handleResponse(mic.activeListen())
 
-    else:
-        mic.say(
-            "Here are the current top headlines. " + all_titles)
-
 
 def isValid(text):
     """
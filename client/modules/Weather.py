@@ -1,16 +1,22 @@
 # -*- coding: utf-8-*-
 import re
+import logging
 import datetime
-import struct
 import urllib
 import feedparser
 import requests
-import bs4
-from client.app_utils import getTimezone
+from client import stations
+from client.app_utils import getTimezone, getCached, fetchURL
 from semantic.dates import DateService
 
 WORDS = ["WEATHER", "TODAY", "TOMORROW"]
 
+# Seconds before a forecast is fetched again
+CACHE_TTL = 30 * 60
+
+# Seconds between refreshes of the forecast in the background
+PREFETCH_INTERVAL = 25 * 60
+
 
 def replaceAcronyms(text):
     """
@@ -38,88 +44,90 @@ def replaceAcronyms(text):
     return text
 
 
-def get_locations():
-    r = requests.get('http://www.wunderground.com/about/faq/' +
-                     'international_cities.asp')
-    soup = bs4.BeautifulSoup(r.text)
-    data = soup.find(id="inner-content").find('pre').string
-    # Data Stucture:
-    #  00 25 location
-    #  01  1
-    #  02  2 region
-    #  03  1
-    #  04  2 country
-    #  05  2
-    #  06  4 ID
-    #  07  5
-    #  08  7 latitude
-    #  09  1
-    #  10  7 logitude
-    #  11  1
-    #  12  5 elevation
-    #  13  5 wmo_id
-    s = struct.Struct("25s1s2s1s2s2s4s5s7s1s7s1s5s5s")
-    for line in data.splitlines()[3:]:
-        row = s.unpack_from(line)
-        info = {'name': row[0].strip(),
-                'region': row[2].strip(),
-                'country': row[4].strip(),
-                'latitude': float(row[8].strip()),
-                'logitude': float(row[10].strip()),
-                'elevation': int(row[12].strip()),
-                'id': row[6].strip(),
-                'wmo_id': row[13].strip()}
-        yield info
-
-
-def get_forecast_by_name(location_name):
-    entries = feedparser.parse("http://rss.wunderground.com/auto/rss_full/%s"
-                               % urllib.quote(location_name))['entries']
+def get_entries(feed):
+    """
+    Returns the entries of a forecast feed as plain dicts, which are all
+    that's needed of them and can be cached.
+    """
+    return [{'title': entry.get('title', ''),
+             'summary': entry.get('summary', '')}
+            for entry in feed['entries']]
+
+
+def parse_entries(content):
+    """
+    Returns the entries of a forecast feed, given its XML.
+    """
+    return get_entries(feedparser.parse(content))
+
+
+def fetch_feed(url):
+    """
+    Returns the entries of a forecast feed, or None if it couldn't be
+    fetched.
+    """
+    try:
+        return fetchURL(url, parse_entries)
+    except requests.RequestException:
+        logging.getLogger(__name__).warning("Couldn't fetch '%s'", url,
+                                            exc_info=True)
+        return None
+
+
+def fetch_forecast_by_name(location_name):
+    entries = fetch_feed("http://rss.wunderground.com/auto/rss_full/%s" %
+                         urllib.quote(location_name))
     if entries:
         # We found weather data the easy way
         return entries
     else:
         # We try to get weather data via the list of stations
-        for location in get_locations():
-            if location['name'] == location_name:
-                return get_forecast_by_wmo_id(location['wmo_id'])
+        try:
+            matches = stations.get_index().find(location_name)
+        except requests.RequestException:
+            logging.getLogger(__name__).warning(
+                "Couldn't load the list of stations", exc_info=True)
+            return None
+        if matches:
+            return fetch_forecast_by_wmo_id(matches[0].wmo_id)
 
 
-def get_forecast_by_wmo_id(wmo_id):
-    return feedparser.parse("http://rss.wunderground.com/auto/" +
-                            "rss_full/global/stations/%s.xml"
-                            % wmo_id)['entries']
+def fetch_forecast_by_wmo_id(wmo_id):
+    return fetch_feed(
+        "http://rss.wunderground.com/auto/rss_full/global/stations/%s.xml"
+        % wmo_id)
 
 
-def handle(text, mic, profile):
-    """
-    Responds to user-input, typically speech text, with a summary of
-    the relevant weather for the requested date (typically, weather
-    information will not be available for days beyond tomorrow).
+def get_forecast_by_name(location_name, refresh=False):
+    return getCached('weather-name-%s' % location_name,
+                     lambda: fetch_forecast_by_name(location_name),
+                     CACHE_TTL, refresh=refresh)
 
-    Arguments:
-        text -- user-input, typically transcribed speech
-        mic -- used to interact with the user (for both input and output)
-        profile -- contains information related to the user (e.g., phone
-                   number)
+
+def get_forecast_by_wmo_id(wmo_id, refresh=False):
+    return getCached('weather-wmo-%s' % wmo_id,
+                     lambda: fetch_forecast_by_wmo_id(wmo_id), CACHE_TTL,
+                     refresh=refresh)
+
+
+def get_forecast(profile, refresh=False):
+    """
+    Returns the forecast for the user's location, or None if the profile
+    doesn't say where that is.
     """
-    forecast = None
     if 'wmo_id' in profile:
-        forecast = get_forecast_by_wmo_id(str(profile['wmo_id']))
+        return get_forecast_by_wmo_id(str(profile['wmo_id']), refresh)
     elif 'location' in profile:
-        forecast = get_forecast_by_name(str(profile['location']))
+        return get_forecast_by_name(str(profile['location']), refresh)
+    return None
 
-    if not forecast:
-        mic.say("I'm sorry, I can't seem to access that information. Please " +
-                "make sure that you've set your location on the dashboard.")
-        return
-
-    tz = getTimezone(profile)
 
+def get_report(forecast, date, tz):
+    """
+    Returns what Jasper says about the weather on date, or None if the
+    forecast doesn't reach that far.
+    """
     service = DateService(tz=tz)
-    date = service.extractDay(text)
-    if not date:
-        date = datetime.datetime.now(tz=tz)
     weekday = service.__daysOfWeek__[date.weekday()]
 
     if date.weekday() == datetime.datetime.now(tz=tz).weekday():
@@ -130,8 +138,6 @@ def handle(text, mic, profile):
     else:
         date_keyword = "On " + weekday
 
-    output = None
-
     for entry in forecast:
         try:
             date_desc = entry['title'].split()[0].strip().lower()
@@ -147,14 +153,59 @@ def handle(text, mic, profile):
                 weather_desc = entry['summary'].split('-')[1]
 
             if weekday == date_desc:
-                output = date_keyword + \
-                    ", the weather will be " + weather_desc + "."
-                break
+                return replaceAcronyms(date_keyword +
+                                       ", the weather will be " +
+                                       weather_desc + ".")
         except:
             continue
 
+    return None
+
+
+def prefetch(profile):
+    """
+    Refreshes the forecast and returns what handle() would say about today
+    and tomorrow.
+    """
+    forecast = get_forecast(profile, refresh=True)
+    if not forecast:
+        return []
+
+    tz = getTimezone(profile)
+    today = datetime.datetime.now(tz=tz)
+    reports = [get_report(forecast, date, tz)
+               for date in (today, today + datetime.timedelta(days=1))]
+    return [report for report in reports if report]
+
+
+def handle(text, mic, profile):
+    """
+    Responds to user-input, typically speech text, with a summary of
+    the relevant weather for the requested date (typically, weather
+    information will not be available for days beyond tomorrow).
+
+    Arguments:
+        text -- user-input, typically transcribed speech
+        mic -- used to interact with the user (for both input and output)
+        profile -- contains information related to the user (e.g., phone
+                   number)
+    """
+    forecast = get_forecast(profile)
+
+    if not forecast:
+        mic.say("I'm sorry, I can't seem to access that information. Please " +
+                "make sure that you've set your location on the dashboard.")
+        return
+
+    tz = getTimezone(profile)
+
+    service = DateService(tz=tz)
+    date = service.extractDay(text)
+    if not date:
+        date = datetime.datetime.now(tz=tz)
+
+    output = get_report(forecast, date, tz)
     if output:
-        output = replaceAcronyms(output)
         mic.say(output)
     else:
         mic.say(
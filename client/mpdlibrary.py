@@ -0,0 +1,218 @@
+# -*- coding: utf-8-*-
+"""
+Loads the songs of the stored playlists of an MPD server and caches them
+locally, so that an unchanged library doesn't have to be fetched again.
+"""
+import os
+import json
+import logging
+from array import array
+from app_utils import writeJSON
+
+
+class Song(object):
+    __slots__ = ('id', 'title', 'artist', 'album')
+
+    def __init__(self, id, title, artist, album):
+
+        self.id = id
+        self.title = title
+        self.artist = artist
+        self.album = album
+
+
+class SongCatalogue(object):
+    """
+    Stores songs column by column: every column is an array of indices into
+    a table of unique strings, so that e.g. an artist's name is kept only
+    once no matter how many songs there are by them. Songs are identified
+    by their row number. Song objects are only created on request.
+    """
+
+    COLUMNS = ('file', 'title', 'artist', 'album')
+
+    def __init__(self):
+        self._strings = []
+        self._string_ids = {}
+        self._columns = dict((column, array('i')) for column in self.COLUMNS)
+        # For every column, the rows by string id, so that find() doesn't
+        # have to scan the column
+        self._rows = dict((column, {}) for column in self.COLUMNS)
+
+    def __len__(self):
+        return len(self._columns['file'])
+
+    def __getitem__(self, row):
+        return Song(*[self.get(row, column) for column in self.COLUMNS])
+
+    def _intern(self, string):
+        try:
+            return self._string_ids[string]
+        except KeyError:
+            self._string_ids[string] = len(self._strings)
+            self._strings.append(string)
+            return self._string_ids[string]
+
+    def append(self, file, title, artist, album):
+        """
+        Adds a song.
+
+        Returns:
+            The row of the song
+        """
+        row = len(self)
+        for column, value in zip(self.COLUMNS, (file, title, artist, album)):
+            self._add(column, row, self._intern(value))
+        return row
+
+    def _add(self, column, row, i):
+        self._columns[column].append(i)
+        rows = self._rows[column].get(i)
+        if rows is None:
+            rows = self._rows[column][i] = array('i')
+        rows.append(row)
+
+    def get(self, row, column):
+        """
+        Returns:
+            The value of a column of a song
+        """
+        return self._strings[self._columns[column][row]]
+
+    def values(self, column):
+        """
+        Returns:
+            An iterator over the values of a column, in row order
+        """
+        return (self._strings[i] for i in self._columns[column])
+
+    def distinct(self, column):
+        """
+        Returns:
+            A list of the unique non-empty values of a column
+        """
+        return [self._strings[i] for i in set(self._columns[column])
+                if self._strings[i]]
+
+    def find(self, column, value):
+        """
+        Returns:
+            A list of the rows of the songs whose column has the given value
+        """
+        if value not in self._string_ids:
+            return []
+        return self._rows[column].get(self._string_ids[value],
+                                      array('i')).tolist()
+
+    def to_dict(self):
+        """
+        Returns:
+            The catalogue as a dict, e.g. to be serialized as JSON
+        """
+        return {'strings': self._strings,
+                'columns': dict((column, self._columns[column].tolist())
+                                for column in self.COLUMNS)}
+
+    @classmethod
+    def from_dict(cls, data):
+        """
+        Creates a catalogue from a dict returned by to_dict().
+        """
+        inst = cls()
+        for string in data['strings']:
+            if isinstance(string, unicode):
+                string = string.encode('utf-8')
+            inst._intern(string)
+        for column in cls.COLUMNS:
+            for row, i in enumerate(data['columns'][column]):
+                inst._add(column, row, i)
+        return inst
+
+
+def _get_tag(info, name):
+    value = info.get(name, '')
+    # Tags that occur more than once (e.g. multiple artists) are lists
+    if isinstance(value, list):
+        value = value[0] if value else ''
+    return value.strip().upper()
+
+
+class LibraryLoader(object):
+    """
+    Fetches the songs of all stored playlists, one playlist per command so
+    that the server never has to send the whole library at once. Songs are
+    cached in a file together with MPD's database update time and the
+    modification times of the playlists, and are only fetched again if one
+    of them changes.
+    """
+
+    def __init__(self, cache_file=None):
+        """
+        Arguments:
+        cache_file -- the file songs are cached in, no caching if None
+        """
+        self._logger = logging.getLogger(__name__)
+        self.cache_file = cache_file
+
+    def get_key(self, client, playlists):
+        """
+        Returns:
+            A value that changes whenever the library changes
+        """
+        return [client.stats().get('db_update'),
+                sorted([playlist['playlist'], playlist.get('last-modified')]
+                       for playlist in playlists)]
+
+    def load(self, client):
+        """
+        Arguments:
+        client -- a connected MPDClient
+
+        Returns:
+            A SongCatalogue of the songs of all stored playlists, without
+            duplicates
+        """
+        playlists = client.listplaylists()
+        key = self.get_key(client, playlists)
+        songs = self._read_cache(key)
+        if songs is not None:
+            self._logger.debug("Using %d cached songs", len(songs))
+            return songs
+
+        songs = SongCatalogue()
+        seen = set()
+        for playlist in playlists:
+            for info in client.listplaylistinfo(playlist['playlist']):
+                if 'file' in info and info['file'] not in seen:
+                    seen.add(info['file'])
+                    songs.append(info['file'], _get_tag(info, 'title'),
+                                 _get_tag(info, 'artist'),
+                                 _get_tag(info, 'album'))
+        self._logger.debug("Fetched %d songs from %d playlists", len(songs),
+                           len(playlists))
+        self._write_cache(key, songs)
+        return songs
+
+    def _read_cache(self, key):
+        if not self.cache_file or not os.path.isfile(self.cache_file):
+            return None
+        try:
+            with open(self.cache_file, 'r') as f:
+                data = json.load(f)
+        except ValueError:
+            self._logger.warning("Ignoring broken song cache '%s'",
+                                 self.cache_file)
+            return None
+        if data.get('key') != key:
+            return None
+        return SongCatalogue.from_dict(data['songs'])
+
+    def _write_cache(self, key, songs):
+        if not self.cache_file:
+            return
+        data = {'key': key, 'songs': songs.to_dict()}
+        try:
+            writeJSON(self.cache_file, data)
+        except (IOError, OSError):
+            self._logger.warning("Couldn't write song cache '%s'",
+                                 self.cache_file, exc_info=True)
@@ -1,68 +1,301 @@
 # -*- coding: utf-8-*-
-import Queue
+import heapq
 import atexit
+import itertools
+import threading
 from modules import Gmail
+from imapidle import IMAPIdleWatcher
+import jasperpath
 from apscheduler.schedulers.background import BackgroundScheduler
+from apscheduler.executors.pool import ThreadPoolExecutor
 import logging
 
 
-class Notifier(object):
+class Notification(object):
+
+    LOW = 0
+    NORMAL = 1
+    HIGH = 2
+
+    def __init__(self, text, priority=NORMAL, key=None, group=None,
+                 summary=None):
+        """
+        Arguments:
+        text -- what to tell the user
+        priority -- LOW, NORMAL or HIGH, more important notifications are
+                    delivered first
+        key -- if given, a notification with the same key as a pending one
+               is dropped as a duplicate
+        group -- if given, notifications of the same group are combined
+                 into one while they're pending
+        summary -- the text of combined notifications, formatted with their
+                   number, e.g. "You have %d new emails."
+        """
+        self.text = text
+        self.priority = priority
+        self.key = key
+        self.group = group
+        self.summary = summary
+        self.count = 1
+
+    def coalesce(self, other):
+        """
+        Combines another notification of the same group into this one.
+        """
+        self.count += other.count
+        self.priority = max(self.priority, other.priority)
+        if self.summary:
+            self.text = self.summary % self.count
+        else:
+            self.text = other.text
+
+    def __str__(self):
+        return self.text
+
+
+class NotificationQueue(object):
+    """
+    A thread-safe priority queue of notifications that drops duplicates,
+    combines notifications of the same group and never grows beyond
+    maxsize: if it's full, the least important notification is dropped.
+    """
+
+    def __init__(self, maxsize=20):
+        self.maxsize = maxsize
+        self._heap = []
+        self._groups = {}
+        self._keys = set()
+        self._counter = itertools.count()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._heap)
+
+    def put(self, notification):
+        """
+        Returns:
+            False if the notification has been dropped
+        """
+        with self._lock:
+            if notification.key is not None:
+                if notification.key in self._keys:
+                    return False
+                self._keys.add(notification.key)
 
-    class NotificationClient(object):
+            entry = self._groups.get(notification.group)
+            if entry is not None:
+                entry[2].coalesce(notification)
+                entry[3].append(notification.key)
+                if entry[0] != -entry[2].priority:
+                    entry[0] = -entry[2].priority
+                    heapq.heapify(self._heap)
+                return True
 
-        def __init__(self, gather, timestamp):
-            self.gather = gather
-            self.timestamp = timestamp
+            if len(self._heap) >= self.maxsize:
+                # Entries are ordered by priority and age, so the greatest
+                # one is the newest of the least important
+                lowest = max(self._heap)
+                if -lowest[0] >= notification.priority:
+                    self._keys.discard(notification.key)
+                    return False
+                self._heap.remove(lowest)
+                heapq.heapify(self._heap)
+                self._forget(lowest)
 
-        def run(self):
-            self.timestamp = self.gather(self.timestamp)
+            entry = [-notification.priority, next(self._counter),
+                     notification, [notification.key]]
+            heapq.heappush(self._heap, entry)
+            if notification.group is not None:
+                self._groups[notification.group] = entry
+            return True
+
+    def get(self):
+        """
+        Returns:
+            The most important (and, among those, the oldest) notification
+            or None if there is none
+        """
+        with self._lock:
+            if not self._heap:
+                return None
+            entry = heapq.heappop(self._heap)
+            self._forget(entry)
+            return entry[2]
+
+    def _forget(self, entry):
+        self._keys.difference_update(entry[3])
+        if self._groups.get(entry[2].group) is entry:
+            del self._groups[entry[2].group]
+
+
+class NotificationSource(object):
+    """
+    A source of notifications. Sources that have to be polled set INTERVAL
+    and implement poll(), sources that push notifications implement start()
+    and stop().
+    """
+
+    # Seconds between calls of poll(), None if the source isn't polled
+    INTERVAL = None
 
     def __init__(self, profile):
         self._logger = logging.getLogger(__name__)
-        self.q = Queue.Queue()
         self.profile = profile
-        self.notifiers = []
 
-        if 'gmail_address' in profile and 'gmail_password' in profile:
-            self.notifiers.append(self.NotificationClient(
-                self.handleEmailNotifications, None))
-        else:
-            self._logger.warning('gmail_address or gmail_password not set ' +
-                                 'in profile, Gmail notifier will not be used')
+    @classmethod
+    def is_available(cls, profile):
+        """
+        Returns:
+            True if the profile contains everything the source needs
+        """
+        return True
+
+    def poll(self):
+        """
+        Returns:
+            A list of new notifications
+        """
+        return []
+
+    def start(self, notify):
+        """
+        Arguments:
+        notify -- a callable that takes a notification, may be called from
+                  any thread
+        """
+        pass
 
-        sched = BackgroundScheduler(timezone="UTC", daemon=True)
-        sched.start()
-        sched.add_job(self.gather, 'interval', seconds=30)
-        atexit.register(lambda: sched.shutdown(wait=False))
+    def stop(self):
+        pass
 
-    def gather(self):
-        [client.run() for client in self.notifiers]
 
-    def handleEmailNotifications(self, lastDate):
-        """Places new Gmail notifications in the Notifier's queue."""
-        emails = Gmail.fetchUnreadEmails(self.profile, since=lastDate)
-        if emails:
-            lastDate = Gmail.getMostRecentDate(emails)
+class GmailSource(NotificationSource):
+    """
+    Announces new emails as soon as the IMAP server tells us about them.
+    """
 
-        def styleEmail(e):
-            return "New email from %s." % Gmail.getSender(e)
+    @classmethod
+    def is_available(cls, profile):
+        return 'gmail_address' in profile and 'gmail_password' in profile
 
-        for e in emails:
-            self.q.put(styleEmail(e))
+    def __init__(self, profile):
+        super(GmailSource, self).__init__(profile)
+        self._mark = Gmail.HighWaterMark(jasperpath.config('gmail-uid.json'))
+        self._notify = None
+        self._watcher = None
+
+    def start(self, notify):
+        self._notify = notify
+        self._watcher = IMAPIdleWatcher(
+            'imap.gmail.com', self.profile['gmail_address'],
+            self.profile['gmail_password'], self.check)
+        self._watcher.start()
+
+    def stop(self):
+        if self._watcher is not None:
+            self._watcher.stop()
+
+    def check(self, conn):
+        """
+        Announces the emails that are newer than the high-water mark.
+
+        Arguments:
+        conn -- the watcher's IMAP connection, with the inbox selected
+        """
+        for e in Gmail.fetchUnreadEmailsFrom(conn, mark=self._mark):
+            self._notify(Notification(
+                "New email from %s." % Gmail.getSender(e), group='gmail',
+                summary="You have %d new emails."))
+
+
+# Sources that are used if the profile allows it
+SOURCES = [GmailSource]
 
-        return lastDate
+
+class Notifier(object):
+
+    # Maximum number of notifications that wait to be delivered
+    MAX_PENDING = 20
+
+    # Maximum number of sources that are polled at the same time
+    MAX_WORKERS = 4
+
+    def __init__(self, profile, sources=None):
+        """
+        Arguments:
+        profile -- contains information related to the user
+        sources -- the NotificationSource classes to use, SOURCES if None
+        """
+        self._logger = logging.getLogger(__name__)
+        self.q = NotificationQueue(self.MAX_PENDING)
+        self.profile = profile
+        self.sources = []
+
+        # Every source gets a job of its own, so a slow source only delays
+        # its own notifications
+        self._sched = BackgroundScheduler(
+            timezone="UTC", daemon=True,
+            executors={'default': ThreadPoolExecutor(self.MAX_WORKERS)})
+        self._sched.start()
+        atexit.register(self.stop)
+
+        for source_class in (sources if sources is not None else SOURCES):
+            if source_class.is_available(profile):
+                self.register(source_class(profile))
+            else:
+                self._logger.warning('%s is not configured in profile, ' +
+                                     'it will not be used',
+                                     source_class.__name__)
+
+    @property
+    def scheduler(self):
+        """
+        The scheduler that polls the sources, which can run other
+        background jobs, too.
+        """
+        return self._sched
+
+    def register(self, source):
+        """
+        Starts getting notifications from a NotificationSource.
+        """
+        self.sources.append(source)
+        if source.INTERVAL:
+            self._sched.add_job(self._poll, 'interval',
+                                seconds=source.INTERVAL, args=[source],
+                                max_instances=1, coalesce=True)
+        source.start(self.notify)
+
+    def stop(self):
+        for source in self.sources:
+            source.stop()
+        if self._sched.running:
+            self._sched.shutdown(wait=False)
+
+    def _poll(self, source):
+        try:
+            notifications = source.poll()
+        except Exception:
+            self._logger.error("Couldn't poll %s", type(source).__name__,
+                               exc_info=True)
+            return
+        for notification in notifications:
+            self.notify(notification)
+
+    def notify(self, notification):
+        """
+        Queues a notification to be delivered to the user.
+        """
+        if not self.q.put(notification):
+            self._logger.info("Dropped notification '%s'", notification)
 
     def getNotification(self):
         """Returns a notification. Note that this function is consuming."""
-        try:
-            notif = self.q.get(block=False)
-            return notif
-        except Queue.Empty:
-            return None
+        return self.q.get()
 
     def getAllNotifications(self):
         """
-            Return a list of notifications in chronological order.
+            Return a list of notifications, most important first.
             Note that this function is consuming, so consecutive calls
             will yield different results.
         """
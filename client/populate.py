@@ -5,6 +5,56 @@ from getpass import getpass
 import yaml
 from pytz import timezone
 import jasperpath
+import stations
+
+
+def choose_station(location):
+    """
+    Asks the user which weather station to use for a location.
+
+    Returns:
+        The chosen Station, or None
+    """
+    try:
+        index = stations.get_index()
+    except Exception as e:
+        print("Couldn't load the list of weather stations: %s" % e)
+        return None
+
+    matches = index.find(location)
+    if not matches:
+        coordinates = raw_input(
+            "No weather station is called '%s'. To use the one nearest " %
+            location + "to you instead, enter your latitude and longitude " +
+            "(e.g. 51.5, -0.1): ")
+        try:
+            latitude, longitude = [float(x) for x in coordinates.split(',')]
+        except ValueError:
+            return None
+        station = index.nearest(latitude, longitude)
+        if station:
+            print("Using the weather station in %s, %s." % (station.name,
+                                                           station.country))
+        return station
+
+    if len(matches) == 1:
+        return matches[0]
+
+    print("There are several weather stations called '%s':" % location)
+    for i, station in enumerate(matches):
+        print("%d) %s, %s %s" % (i + 1, station.name, station.region,
+                                 station.country))
+    while True:
+        choice = raw_input("Which one is yours? (1-%d, or press Enter to " %
+                           len(matches) + "skip) ")
+        if not choice:
+            return None
+        try:
+            number = int(choice)
+        except ValueError:
+            continue
+        if 1 <= number <= len(matches):
+            return matches[number - 1]
 
 
 def run():
@@ -67,6 +117,17 @@ def run():
         profile["baidu_api"] = {"app_key": app_key, "app_secret": app_secret}
 
 
+    # weather
+    location = raw_input("\nFor weather requests, please enter the name " +
+                         "of your nearest big town or city: ")
+    if location:
+        profile['location'] = location
+        station = choose_station(location)
+        if station:
+            # Looking up the station every time Jasper is asked about the
+            # weather isn't necessary
+            profile['wmo_id'] = str(station.wmo_id)
+
     # write to profile
     print("\nWriting to profile to %s..." % (jasperpath.config("profile.yml")))
     if not os.path.exists(jasperpath.CONFIG_PATH):
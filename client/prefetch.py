@@ -0,0 +1,81 @@
+# -*- coding: utf-8-*-
+import datetime
+import logging
+import pytz
+
+
+class Prefetcher(object):
+    """
+    Refreshes the data that modules need in the background and synthesizes
+    what they are going to say about it ahead of time, so that answering
+    doesn't have to wait for the network or the synthesizer.
+
+    Modules take part by implementing prefetch(profile), which refreshes
+    their data and returns the phrases handle() would say, and setting
+    PREFETCH_INTERVAL.
+    """
+
+    def __init__(self, modules, mic, profile, scheduler):
+        """
+        Arguments:
+        modules -- the modules to prefetch for
+        mic -- used to synthesize the phrases
+        profile -- contains information related to the user
+        scheduler -- the APScheduler scheduler that runs the prefetch jobs
+        """
+        self._logger = logging.getLogger(__name__)
+        self.modules = modules
+        self.mic = mic
+        self.profile = profile
+        self.scheduler = scheduler
+
+    def get_interval(self, module):
+        """
+        Returns the number of seconds between prefetches for a module, or
+        None if it isn't prefetched. The interval can be set by the
+        module's PREFETCH_INTERVAL constant and be overridden in the
+        profile, where 0 turns prefetching off, e.g.:
+
+            prefetch_intervals:
+              HN: 900
+              News: 0
+        """
+        if not hasattr(module, 'prefetch'):
+            return None
+        intervals = self.profile.get('prefetch_intervals') or {}
+        if module.__name__ in intervals:
+            return intervals[module.__name__] or None
+        return getattr(module, 'PREFETCH_INTERVAL', None)
+
+    def start(self):
+        """
+        Schedules a prefetch job for every module that wants one. The first
+        prefetch happens right away.
+        """
+        now = datetime.datetime.now(pytz.utc)
+        for module in self.modules:
+            interval = self.get_interval(module)
+            if interval is None:
+                continue
+            self._logger.debug("Prefetching for %s every %d seconds",
+                               module.__name__, interval)
+            self.scheduler.add_job(self.prefetch, 'interval',
+                                   seconds=interval, args=[module],
+                                   max_instances=1, coalesce=True,
+                                   next_run_time=now)
+
+    def prefetch(self, module):
+        try:
+            phrases = module.prefetch(self.profile)
+        except Exception:
+            self._logger.warning("Couldn't prefetch for %s", module.__name__,
+                                 exc_info=True)
+            return
+
+        for phrase in phrases:
+            try:
+                self.mic.presynthesize(phrase)
+            except Exception:
+                self._logger.warning("Couldn't synthesize '%s'", phrase,
+                                     exc_info=True)
+                return
@@ -0,0 +1,198 @@
+# -*- coding: utf-8-*-
+"""
+Finds the Weather Underground stations that forecasts can be fetched for.
+The list of international stations is downloaded only once and kept in a
+local file, indexed by normalized station name and by position.
+"""
+import os
+import json
+import math
+import logging
+import threading
+from collections import namedtuple, defaultdict
+import requests
+import bs4
+from fuzzyindex import normalize
+from app_utils import writeJSON
+import jasperpath
+
+STATIONS_URL = ('http://www.wunderground.com/about/faq/' +
+                'international_cities.asp')
+
+Station = namedtuple('Station', ['name', 'region', 'country', 'id',
+                                 'wmo_id', 'latitude', 'longitude',
+                                 'elevation'])
+
+# Columns of the station list, as (field, start, end). The list is a table
+# of fixed width, so names may contain spaces.
+_COLUMNS = (('name', 0, 25), ('region', 26, 28), ('country', 29, 31),
+            ('id', 33, 37), ('latitude', 42, 49), ('longitude', 50, 57),
+            ('elevation', 58, 63), ('wmo_id', 63, 68))
+
+
+def parse_stations(table):
+    """
+    Returns:
+        A list of the stations in the text of the station list. Stations
+        without a WMO ID are left out, as there are no forecasts for them.
+    """
+    stations = []
+    for line in table.splitlines()[3:]:
+        row = dict((field, line[start:end].strip())
+                   for field, start, end in _COLUMNS)
+        if not row['wmo_id']:
+            continue
+        try:
+            row['latitude'] = float(row['latitude'])
+            row['longitude'] = float(row['longitude'])
+            row['elevation'] = int(row['elevation'])
+        except ValueError:
+            continue
+        stations.append(Station(**row))
+    return stations
+
+
+def fetch_stations():
+    """
+    Downloads the list of international stations.
+    """
+    r = requests.get(STATIONS_URL)
+    r.raise_for_status()
+    soup = bs4.BeautifulSoup(r.text)
+    return parse_stations(soup.find(id="inner-content").find('pre').string)
+
+
+class StationIndex(object):
+    """
+    Looks up stations by name and finds the station nearest to a position.
+    Positions are indexed in a grid of CELL_SIZE by CELL_SIZE degrees, so
+    only the cells around a position have to be searched.
+    """
+
+    # Size of the cells of the grid, in degrees
+    CELL_SIZE = 1.0
+
+    def __init__(self, stations, names=None):
+        """
+        Arguments:
+        stations -- a list of Stations
+        names -- the name index as returned by to_dict(), built from the
+                 stations if None
+        """
+        self.stations = stations
+        if names is None:
+            names = defaultdict(list)
+            for i, station in enumerate(stations):
+                names[normalize(station.name)].append(i)
+        self._names = dict(names)
+        self._columns = int(round(360 / self.CELL_SIZE))
+        self._grid = defaultdict(list)
+        for i, station in enumerate(stations):
+            self._grid[self._get_cell(station.latitude,
+                                      station.longitude)].append(i)
+
+    def __len__(self):
+        return len(self.stations)
+
+    def _get_cell(self, latitude, longitude):
+        return (int(math.floor(latitude / self.CELL_SIZE)),
+                int(math.floor(longitude / self.CELL_SIZE)) % self._columns)
+
+    def find(self, name):
+        """
+        Returns:
+            A list of the stations whose name matches, ignoring case and
+            punctuation
+        """
+        return [self.stations[i] for i in self._names.get(normalize(name),
+                                                          [])]
+
+    def nearest(self, latitude, longitude):
+        """
+        Returns:
+            The station nearest to a position, or None if there are no
+            stations
+        """
+        # Distances are measured in degrees of latitude, so a degree of
+        # longitude is worth less the further we are from the equator
+        scale = max(math.cos(math.radians(latitude)), 0.01)
+
+        def distance(station):
+            dlon = (station.longitude - longitude + 180) % 360 - 180
+            return math.hypot(station.latitude - latitude, dlon * scale)
+
+        row, column = self._get_cell(latitude, longitude)
+        best, best_distance = None, None
+        max_radius = self._columns // 2 + 1
+        for radius in range(max_radius + 1):
+            # Every station in this ring of cells is at least that far away
+            if (best is not None and
+                    (radius - 1) * self.CELL_SIZE * scale > best_distance):
+                break
+            for r in range(row - radius, row + radius + 1):
+                step = 1 if abs(r - row) == radius else 2 * radius
+                for c in range(column - radius, column + radius + 1,
+                               max(step, 1)):
+                    for i in self._grid.get((r, c % self._columns), []):
+                        d = distance(self.stations[i])
+                        if best is None or d < best_distance:
+                            best, best_distance = self.stations[i], d
+        return best
+
+    def to_dict(self):
+        """
+        Returns:
+            The index as a dict, e.g. to be serialized as JSON
+        """
+        return {'stations': [list(station) for station in self.stations],
+                'names': self._names}
+
+    @classmethod
+    def from_dict(cls, data):
+        """
+        Creates an index from a dict returned by to_dict().
+        """
+        return cls([Station(*row) for row in data['stations']],
+                   data['names'])
+
+
+def load_index(cache_file=None):
+    """
+    Returns a StationIndex of the stations in cache_file. If there is no
+    such file, the stations are downloaded and written to it.
+    """
+    logger = logging.getLogger(__name__)
+    if cache_file and os.path.isfile(cache_file):
+        try:
+            with open(cache_file, 'r') as f:
+                return StationIndex.from_dict(json.load(f))
+        except (ValueError, KeyError, TypeError):
+            logger.warning("Ignoring broken station list '%s'", cache_file)
+
+    index = StationIndex(fetch_stations())
+    logger.debug("Fetched %d stations", len(index))
+    if not cache_file:
+        return index
+    try:
+        writeJSON(cache_file, index.to_dict())
+    except (IOError, OSError):
+        logger.warning("Couldn't write station list '%s'", cache_file,
+                       exc_info=True)
+    return index
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def get_index():
+    """
+    Returns the shared StationIndex, which is loaded on first use and kept
+    in jasperpath.config('wunderground-stations.json').
+    """
+    global _index
+    with _index_lock:
+        if _index is None:
+            _index = load_index(
+                jasperpath.config('wunderground-stations.json'))
+        return _index
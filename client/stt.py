@@ -10,7 +10,9 @@ import urllib
 import urlparse
 import re
 import subprocess
+import threading
 from abc import ABCMeta, abstractmethod
+from concurrent import futures
 import requests
 import yaml
 import jasperpath
@@ -19,6 +21,38 @@ import vocabcompiler
 import hashlib, base64
 
 
+def compile_vocabulary(vocabulary_type, vocabulary_name, phrases):
+    """
+    Compiles a vocabulary if it doesn't match the phrases already. This is a
+    module-level function so that it can be run in a process pool.
+
+    Returns:
+        The revision of the compiled vocabulary
+    """
+    vocabulary = vocabulary_type(vocabulary_name,
+                                 path=jasperpath.config('vocabularies'))
+    if not vocabulary.matches_phrases(phrases):
+        return vocabulary.compile(phrases)
+    return vocabulary.compiled_revision
+
+
+class DeferredSTTEngine(object):
+    """
+    Stands in for an STT engine instance that is still being created in the
+    background. Any attribute access blocks until the instance is ready.
+    """
+
+    def __init__(self, future):
+        self._future = future
+
+    @property
+    def ready(self):
+        return self._future.done()
+
+    def __getattr__(self, name):
+        return getattr(self._future.result(), name)
+
+
 class AbstractSTTEngine(object):
     """
     Generic parent class for all STT engines
@@ -44,16 +78,71 @@ class AbstractSTTEngine(object):
         instance = cls(**config)
         return instance
 
+    @classmethod
+    def get_instance_async(cls, vocabulary_name, phrases, executor):
+        """
+        Like get_instance(), but compiles the vocabulary in 'executor' (e.g.
+        a process pool) and returns immediately.
+
+        Returns:
+            A future for the instance
+        """
+        logger = logging.getLogger(__name__)
+        future = futures.Future()
+
+        if not cls.VOCABULARY_TYPE:
+            future.set_result(cls(**cls.get_config()))
+            return future
+
+        def create_instance(compilation):
+            try:
+                compilation.result()
+                config = cls.get_config()
+                config['vocabulary'] = cls.VOCABULARY_TYPE(
+                    vocabulary_name, path=jasperpath.config('vocabularies'))
+                instance = cls(**config)
+            except Exception as e:
+                logger.error("Unable to create STT engine with vocabulary " +
+                             "'%s'", vocabulary_name, exc_info=True)
+                future.set_exception(e)
+            else:
+                logger.debug("STT engine with vocabulary '%s' is ready",
+                             vocabulary_name)
+                future.set_result(instance)
+
+        def on_compiled(compilation):
+            # Don't block the executor's thread with the engine's
+            # initialization
+            thread = threading.Thread(target=create_instance,
+                                      args=(compilation,))
+            thread.daemon = True
+            thread.start()
+
+        executor.submit(compile_vocabulary, cls.VOCABULARY_TYPE,
+                        vocabulary_name, phrases).add_done_callback(
+                            on_compiled)
+        return future
+
     @classmethod
     def get_passive_instance(cls):
         phrases = vocabcompiler.get_keyword_phrases()
         return cls.get_instance('keyword', phrases)
 
+    @classmethod
+    def get_passive_instance_async(cls, executor):
+        phrases = vocabcompiler.get_keyword_phrases()
+        return cls.get_instance_async('keyword', phrases, executor)
+
     @classmethod
     def get_active_instance(cls):
         phrases = vocabcompiler.get_all_phrases()
         return cls.get_instance('default', phrases)
 
+    @classmethod
+    def get_active_instance_async(cls, executor):
+        phrases = vocabcompiler.get_all_phrases()
+        return cls.get_instance_async('default', phrases, executor)
+
     @classmethod
     @abstractmethod
     def is_available(cls):
@@ -8,12 +8,14 @@ outputs for inspection. Requires a populated profile (profile.yml).
 
 class Mic:
 
+    interrupted = False
+
     def __init__(self, inputs):
         self.inputs = inputs
         self.idx = 0
         self.outputs = []
 
-    def passiveListen(self, PERSONA):
+    def passiveListen(self, PERSONA, stop=None):
         return True, "JASPER"
 
     def activeListenToAllOptions(self, THRESHOLD=None, LISTEN=True,
@@ -31,3 +33,9 @@ class Mic:
 
     def say(self, phrase, OPTIONS=None):
         self.outputs.append(phrase)
+
+    def presynthesize(self, phrase):
+        return
+
+    def wait(self):
+        return
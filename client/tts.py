@@ -24,6 +24,9 @@ from abc import ABCMeta, abstractmethod
 import argparse
 import yaml
 import hashlib
+import threading
+from collections import OrderedDict
+from StringIO import StringIO
 
 try:
     import mad
@@ -50,6 +53,9 @@ class AbstractTTSEngine(object):
     """
     __metaclass__ = ABCMeta
 
+    # Maximum number of presynthesized phrases that are kept in memory
+    MAX_PRESYNTHESIZED = 16
+
     @classmethod
     def get_config(cls):
         return {}
@@ -67,17 +73,168 @@ class AbstractTTSEngine(object):
 
     def __init__(self, **kwargs):
         self._logger = logging.getLogger(__name__)
+        self._player = None
+        # Set by stop(), so that no player is started until reset()
+        self._stopped = False
+        self._player_lock = threading.Lock()
+        self._presynthesized = OrderedDict()
+        self._presynthesized_lock = threading.Lock()
 
     @abstractmethod
     def say(self, phrase, *args):
         pass
 
+    def synthesize(self, phrase):
+        """
+        Returns the WAV data of 'phrase' spoken, or None if the engine can't
+        synthesize speech without playing it.
+        """
+        return None
+
+    def presynthesize(self, phrase):
+        """
+        Synthesizes 'phrase' ahead of time and keeps it in memory, so that
+        say_presynthesized() can play it without waiting for the
+        synthesizer. Only the most recent MAX_PRESYNTHESIZED phrases are
+        kept.
+
+        Returns True if the phrase has been synthesized.
+        """
+        data = self.synthesize(phrase)
+        if data is None:
+            return False
+        with self._presynthesized_lock:
+            self._presynthesized.pop(phrase, None)
+            self._presynthesized[phrase] = data
+            while len(self._presynthesized) > self.MAX_PRESYNTHESIZED:
+                self._presynthesized.popitem(last=False)
+        return True
+
+    def say_presynthesized(self, phrase):
+        """
+        Plays 'phrase' if it has been presynthesized.
+
+        Returns False if it hasn't, so it still needs to be said.
+        """
+        with self._presynthesized_lock:
+            data = self._presynthesized.get(phrase)
+        if data is None:
+            return False
+        self._logger.debug("Saying presynthesized '%s'", phrase)
+        self.play_data(data)
+        return True
+
+    def stop(self):
+        """
+        Interrupts the playback that is currently running (if any) and keeps
+        any further playback from starting until reset() is called. This is
+        meant to be called from another thread than the one that is blocked
+        in say() or play(), which may still be synthesizing speech.
+        """
+        with self._player_lock:
+            self._stopped = True
+            player = self._player
+        if player is not None and player.poll() is None:
+            self._logger.debug('Interrupting playback')
+            try:
+                player.terminate()
+            except OSError:
+                pass
+
+    def reset(self):
+        """
+        Allows playback again after stop().
+        """
+        with self._player_lock:
+            self._stopped = False
+
+    def is_playing(self):
+        """
+        Returns True while a player is running, i.e. speech is audible
+        rather than still being synthesized.
+        """
+        player = self._player
+        return player is not None and player.poll() is None
+
+    def _start_player(self, cmd, **kwargs):
+        """
+        Starts the player, unless playback has been stopped.
+
+        Returns:
+            The player process, or None if it hasn't been started
+        """
+        with self._player_lock:
+            if self._stopped:
+                self._logger.debug('Playback has been stopped, not ' +
+                                   'starting the player')
+                return None
+            self._player = subprocess.Popen(cmd, **kwargs)
+            return self._player
+
+    def _wait_for_player(self, player):
+        try:
+            player.wait()
+        finally:
+            self._player = None
+
     def play(self, filename):
         cmd = ['aplay', str(filename)]
         self._logger.debug('Executing %s', ' '.join([pipes.quote(arg)
                                                      for arg in cmd]))
         with tempfile.TemporaryFile() as f:
-            subprocess.call(cmd, stdout=f, stderr=f)
+            player = self._start_player(cmd, stdout=f, stderr=f)
+            if player is None:
+                return
+            self._wait_for_player(player)
+            f.seek(0)
+            output = f.read()
+            if output:
+                self._logger.debug("Output was: '%s'", output)
+
+    def play_data(self, data):
+        """
+        Plays WAV data from memory.
+        """
+        cmd = ['aplay', '-']
+        self._logger.debug('Executing %s', ' '.join(cmd))
+        with tempfile.TemporaryFile() as f:
+            player = self._start_player(cmd, stdin=subprocess.PIPE,
+                                        stdout=f, stderr=f)
+            if player is None:
+                return
+            try:
+                player.communicate(data)
+            finally:
+                self._player = None
+            f.seek(0)
+            output = f.read()
+            if output:
+                self._logger.debug("Output was: '%s'", output)
+
+    def play_stream(self, cmd):
+        """
+        Executes 'cmd' and pipes the WAV data it writes to stdout straight
+        into the player, so that playback starts while 'cmd' is still
+        generating audio.
+        """
+        player_cmd = ['aplay', '-']
+        self._logger.debug('Executing %s | %s',
+                           ' '.join([pipes.quote(arg) for arg in cmd]),
+                           ' '.join([pipes.quote(arg) for arg in player_cmd]))
+        with tempfile.TemporaryFile() as f:
+            source = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=f)
+            player = self._start_player(player_cmd, stdin=source.stdout,
+                                        stdout=f, stderr=f)
+            if player is None:
+                source.stdout.close()
+                source.terminate()
+                source.wait()
+                return
+            # Close our copy of the pipe, so that the source receives a
+            # SIGPIPE if the player exits early
+            source.stdout.close()
+            self._wait_for_player(player)
+            source.wait()
             f.seek(0)
             output = f.read()
             if output:
@@ -93,21 +250,40 @@ class AbstractMp3TTSEngine(AbstractTTSEngine):
         return (super(AbstractMp3TTSEngine, cls).is_available() and
                 diagnose.check_python_import('mad'))
 
-    def play_mp3(self, filename):
+    def decode_mp3(self, filename, f):
+        """
+        Writes the audio of the mp3 file 'filename' to the file object 'f'
+        as WAV data.
+        """
         mf = mad.MadFile(filename)
-        with tempfile.NamedTemporaryFile(suffix='.wav') as f:
-            wav = wave.open(f, mode='wb')
-            wav.setframerate(mf.samplerate())
-            wav.setnchannels(1 if mf.mode() == mad.MODE_SINGLE_CHANNEL else 2)
-            # 4L is the sample width of 32 bit audio
-            wav.setsampwidth(4L)
+        wav = wave.open(f, mode='wb')
+        wav.setframerate(mf.samplerate())
+        wav.setnchannels(1 if mf.mode() == mad.MODE_SINGLE_CHANNEL else 2)
+        # 4L is the sample width of 32 bit audio
+        wav.setsampwidth(4L)
+        frame = mf.read()
+        while frame is not None:
+            wav.writeframes(frame)
             frame = mf.read()
-            while frame is not None:
-                wav.writeframes(frame)
-                frame = mf.read()
-            wav.close()
+        wav.close()
+
+    def play_mp3(self, filename):
+        with tempfile.NamedTemporaryFile(suffix='.wav') as f:
+            self.decode_mp3(filename, f)
+            f.flush()
             self.play(f.name)
 
+    def synthesize_mp3(self, filename):
+        """
+        Returns the WAV data of the mp3 file 'filename' and removes it.
+        """
+        try:
+            f = StringIO()
+            self.decode_mp3(filename, f)
+            return f.getvalue()
+        finally:
+            os.remove(filename)
+
 
 class DummyTTS(AbstractTTSEngine):
     """
@@ -138,11 +314,12 @@ class EspeakTTS(AbstractTTSEngine):
     SLUG = "espeak-tts"
 
     def __init__(self, voice='default+m3', pitch_adjustment=40,
-                 words_per_minute=160):
+                 words_per_minute=160, stream=True):
         super(self.__class__, self).__init__()
         self.voice = voice
         self.pitch_adjustment = pitch_adjustment
         self.words_per_minute = words_per_minute
+        self.stream = stream
 
     @classmethod
     def get_config(cls):
@@ -163,6 +340,9 @@ class EspeakTTS(AbstractTTSEngine):
                     if 'words_per_minute' in profile['espeak-tts']:
                         config['words_per_minute'] = \
                             profile['espeak-tts']['words_per_minute']
+                    if 'stream' in profile['espeak-tts']:
+                        config['stream'] = \
+                            bool(profile['espeak-tts']['stream'])
         return config
 
     @classmethod
@@ -170,15 +350,37 @@ class EspeakTTS(AbstractTTSEngine):
         return (super(cls, cls).is_available() and
                 diagnose.check_executable('espeak'))
 
+    def _get_command(self):
+        return ['espeak', '-v', self.voice,
+                '-p', self.pitch_adjustment,
+                '-s', self.words_per_minute]
+
+    def synthesize(self, phrase):
+        cmd = [str(x) for x in self._get_command() + ['--stdout', phrase]]
+        self._logger.debug('Executing %s', ' '.join([pipes.quote(arg)
+                                                     for arg in cmd]))
+        with tempfile.TemporaryFile() as f:
+            proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=f)
+            data = proc.communicate()[0]
+            f.seek(0)
+            output = f.read()
+            if output:
+                self._logger.debug("Output was: '%s'", output)
+        return data if proc.returncode == 0 else None
+
     def say(self, phrase):
         self._logger.debug("Saying '%s' with '%s'", phrase, self.SLUG)
+        cmd = self._get_command()
+        if self.stream:
+            # Let espeak write the WAV data to stdout and feed it to the
+            # player directly instead of taking a detour via a temp file
+            cmd.extend(['--stdout', phrase])
+            self.play_stream([str(x) for x in cmd])
+            return
+
         with tempfile.NamedTemporaryFile(suffix='.wav', delete=False) as f:
             fname = f.name
-        cmd = ['espeak', '-v', self.voice,
-                         '-p', self.pitch_adjustment,
-                         '-s', self.words_per_minute,
-                         '-w', fname,
-                         phrase]
+        cmd.extend(['-w', fname, phrase])
         cmd = [str(x) for x in cmd]
         self._logger.debug('Executing %s', ' '.join([pipes.quote(arg)
                                                      for arg in cmd]))
@@ -235,8 +437,7 @@ class GoogleTTS(AbstractMp3TTSEngine):
                  'th', 'tr', 'vi', 'cy']
         return langs
 
-    def say(self, phrase):
-        self._logger.debug("Saying '%s' with '%s'", phrase, self.SLUG)
+    def get_speech(self, phrase):
         if self.language not in self.languages:
             raise ValueError("Language '%s' not supported by '%s'",
                              self.language, self.SLUG)
@@ -244,6 +445,14 @@ class GoogleTTS(AbstractMp3TTSEngine):
         with tempfile.NamedTemporaryFile(suffix='.mp3', delete=False) as f:
             tmpfile = f.name
         tts.save(tmpfile)
+        return tmpfile
+
+    def synthesize(self, phrase):
+        return self.synthesize_mp3(self.get_speech(phrase))
+
+    def say(self, phrase):
+        self._logger.debug("Saying '%s' with '%s'", phrase, self.SLUG)
+        tmpfile = self.get_speech(phrase)
         self.play_mp3(tmpfile)
         os.remove(tmpfile)
 
@@ -266,7 +475,7 @@ class BaiduTTS(AbstractMp3TTSEngine):
     SLUG = 'baidu-tts'
 
     def __init__(self, app_key='', app_secret='', persona=0):
-        self._logger = logging.getLogger(__name__)
+        super(self.__class__, self).__init__()
         self.access_token = ''
         self.expires_in = 0
         self.current_time = 0
@@ -349,6 +558,12 @@ class BaiduTTS(AbstractMp3TTSEngine):
             tmpfile = f.name
             return tmpfile
 
+    def synthesize(self, phrase):
+        tmpfile = self.get_speech(phrase)
+        if tmpfile is None:
+            return None
+        return self.synthesize_mp3(tmpfile)
+
     def say(self, phrase, cache=False):
         self._logger.debug(u"Saying '%s' with '%s'", phrase, self.SLUG)
 
@@ -5,6 +5,7 @@ vocabulary for the respective stt_engine if needed.
 """
 
 import os
+import time
 import tempfile
 import logging
 import hashlib
@@ -12,20 +13,17 @@ import subprocess
 import tarfile
 import re
 import contextlib
+import collections
 import shutil
+import sqlite3
 from abc import ABCMeta, abstractmethod, abstractproperty
 import yaml
 
 import brain
 import jasperpath
 
-from g2p import PhonetisaurusG2P
-try:
-    import cmuclmtk
-except ImportError:
-    logging.getLogger(__name__).error("Error importing CMUCLMTK module. " +
-                                      "PocketsphinxVocabulary will not work " +
-                                      "correctly.", exc_info=True)
+from g2p import PhonetisaurusG2P, PronunciationCache
+from languagemodel import NGramCounts, ARPAWriter
 
 
 class AbstractVocabulary(object):
@@ -34,9 +32,23 @@ class AbstractVocabulary(object):
 
     Please note that subclasses have to implement the compile_vocabulary()
     method and set a string as the PATH_PREFIX class attribute.
+
+    Compiled vocabularies are kept in a store inside the PATH_PREFIX
+    directory, in which every compiled revision has a directory of its own.
+    The vocabulary's path is a symlink to the revision it currently uses,
+    which makes switching to a revision that has been compiled before
+    instant.
     """
     __metaclass__ = ABCMeta
 
+    # Number of compiled revisions to keep in the store (revisions that are
+    # in use by any vocabulary are always kept)
+    MAX_REVISIONS = 10
+
+    # Build directories of interrupted compilations are removed after this
+    # number of seconds
+    STALE_BUILD_TIME = 24 * 60 * 60
+
     @classmethod
     def phrases_to_revision(cls, phrases):
         """
@@ -64,9 +76,32 @@ class AbstractVocabulary(object):
                     be created (Default: '.')
         """
         self.name = name
-        self.path = os.path.abspath(os.path.join(path, self.PATH_PREFIX, name))
+        self.base_path = os.path.abspath(path)
+        self.path = os.path.join(self.base_path, self.PATH_PREFIX, name)
         self._logger = logging.getLogger(__name__)
 
+    @property
+    def revisions_path(self):
+        """
+        Returns:
+            The path of the directory that contains all compiled revisions
+            as string
+        """
+        return os.path.join(self.base_path, self.PATH_PREFIX, 'revisions')
+
+    @contextlib.contextmanager
+    def _use_path(self, path):
+        """
+        Temporarily points this vocabulary (and thus all of its file
+        properties) to another directory.
+        """
+        old_path = self.path
+        self.path = path
+        try:
+            yield
+        finally:
+            self.path = old_path
+
     @property
     def revision_file(self):
         """
@@ -136,43 +171,145 @@ class AbstractVocabulary(object):
             The revision of the compiled vocabulary
         """
         revision = self.phrases_to_revision(phrases)
+        revision_path = os.path.join(self.revisions_path, revision)
         if not force and self.compiled_revision == revision:
             self._logger.debug('Compilation not neccessary, compiled ' +
                                'version matches phrases.')
+            self._touch(revision_path)
             return revision
 
-        if not os.path.exists(self.path):
+        if not force:
+            with self._use_path(revision_path):
+                stored_revision = self.compiled_revision
+            if stored_revision == revision:
+                self._logger.debug('Compilation not neccessary, revision ' +
+                                   'found in store.')
+                self._publish(revision_path)
+                return revision
+
+        if not os.path.exists(self.revisions_path):
             self._logger.debug("Vocabulary dir '%s' does not exist, " +
-                               "creating...", self.path)
+                               "creating...", self.revisions_path)
             try:
-                os.makedirs(self.path)
+                os.makedirs(self.revisions_path)
             except OSError:
                 self._logger.error("Couldn't create vocabulary dir '%s'",
-                                   self.path, exc_info=True)
+                                   self.revisions_path, exc_info=True)
                 raise
+
+        # Compile into a temporary directory, so that nobody ever sees a
+        # half-compiled vocabulary. The files of the revision in use are
+        # copied over to allow for incremental compilation.
+        build_path = tempfile.mkdtemp(prefix='.build-',
+                                      dir=self.revisions_path)
         try:
-            with open(self.revision_file, 'w') as f:
-                f.write(revision)
-        except (OSError, IOError):
-            self._logger.error("Couldn't write revision file in '%s'",
-                               self.revision_file, exc_info=True)
-            raise
-        else:
-            self._logger.info('Starting compilation...')
-            try:
-                self._compile_vocabulary(phrases)
-            except Exception as e:
-                self._logger.error("Fatal compilation Error occured, " +
-                                   "cleaning up...", exc_info=True)
+            if os.path.isdir(self.path):
+                for fname in os.listdir(self.path):
+                    src = os.path.join(self.path, fname)
+                    if os.path.isfile(src):
+                        shutil.copy2(src, build_path)
+            with self._use_path(build_path):
                 try:
-                    os.remove(self.revision_file)
-                except OSError:
-                    pass
-                raise e
-            else:
-                self._logger.info('Compilation done.')
+                    with open(self.revision_file, 'w') as f:
+                        f.write(revision)
+                except (OSError, IOError):
+                    self._logger.error("Couldn't write revision file in " +
+                                       "'%s'", self.revision_file,
+                                       exc_info=True)
+                    raise
+                self._logger.info('Starting compilation...')
+                try:
+                    self._compile_vocabulary(phrases)
+                except Exception:
+                    self._logger.error("Fatal compilation Error occured, " +
+                                       "cleaning up...", exc_info=True)
+                    raise
+            self._store(build_path, revision_path, force)
+        finally:
+            shutil.rmtree(build_path, ignore_errors=True)
+        self._logger.info('Compilation done.')
+
+        self._publish(revision_path)
+        self.collect_garbage()
         return revision
 
+    def _store(self, build_path, revision_path, replace=False):
+        """
+        Moves a build directory to its place in the store.
+        """
+        if os.path.exists(revision_path):
+            if not replace:
+                # Someone else compiled the same revision in the meantime
+                self._logger.debug("Revision '%s' already in store",
+                                   revision_path)
+                return
+            trash_path = tempfile.mkdtemp(prefix='.trash-',
+                                          dir=self.revisions_path)
+            os.rename(revision_path, os.path.join(trash_path, 'revision'))
+            os.rename(build_path, revision_path)
+            shutil.rmtree(trash_path, ignore_errors=True)
+        else:
+            os.rename(build_path, revision_path)
+
+    def _publish(self, revision_path):
+        """
+        Atomically points this vocabulary's path to a compiled revision.
+        """
+        self._touch(revision_path)
+        if os.path.isdir(self.path) and not os.path.islink(self.path):
+            # Vocabulary directory from before the store existed
+            shutil.rmtree(self.path)
+        tmp_link = os.path.join(os.path.dirname(self.path),
+                                '.%s.%d' % (self.name, os.getpid()))
+        if os.path.lexists(tmp_link):
+            os.remove(tmp_link)
+        os.symlink(os.path.relpath(revision_path,
+                                   os.path.dirname(self.path)), tmp_link)
+        os.rename(tmp_link, self.path)
+        self._logger.debug("Vocabulary '%s' now uses '%s'", self.name,
+                           revision_path)
+
+    def _touch(self, revision_path):
+        # Revisions are evicted from the store in least recently used order
+        try:
+            os.utime(revision_path, None)
+        except OSError:
+            pass
+
+    def collect_garbage(self):
+        """
+        Removes least recently used revisions from the store, so that at
+        most MAX_REVISIONS revisions are kept. Revisions that are in use by
+        any vocabulary of this type are never removed.
+        """
+        prefix_path = os.path.join(self.base_path, self.PATH_PREFIX)
+        in_use = set()
+        for fname in os.listdir(prefix_path):
+            link = os.path.join(prefix_path, fname)
+            if os.path.islink(link):
+                in_use.add(os.path.realpath(link))
+
+        revisions = []
+        now = time.time()
+        for fname in os.listdir(self.revisions_path):
+            path = os.path.join(self.revisions_path, fname)
+            try:
+                mtime = os.path.getmtime(path)
+            except OSError:
+                continue
+            if fname.startswith('.'):
+                if now - mtime > self.STALE_BUILD_TIME:
+                    self._logger.debug("Removing stale directory '%s'", path)
+                    shutil.rmtree(path, ignore_errors=True)
+            elif os.path.realpath(path) not in in_use:
+                revisions.append((mtime, path))
+
+        revisions.sort(reverse=True)
+        max_unused = max(0, self.MAX_REVISIONS - len(in_use))
+        for mtime, path in revisions[max_unused:]:
+            self._logger.debug("Evicting revision '%s' from store", path)
+            shutil.rmtree(path, ignore_errors=True)
+
     @abstractmethod
     def _compile_vocabulary(self, phrases):
         """
@@ -256,57 +393,138 @@ class PocketsphinxVocabulary(AbstractVocabulary):
         """
         return {'lm': self.languagemodel_file, 'dict': self.dictionary_file}
 
+    @property
+    def phrases_file(self):
+        """
+        Returns:
+            The path of the file that contains the phrases of the last
+            compilation as string
+        """
+        return os.path.join(self.path, 'phrases')
+
+    @property
+    def counts_file(self):
+        """
+        Returns:
+            The path of the file that contains the n-gram counts of the last
+            compilation as string
+        """
+        return os.path.join(self.path, 'ngramcounts')
+
+    def _get_compiled_state(self):
+        """
+        Reads the phrases and n-gram counts of the last compilation.
+
+        Returns:
+            A tuple of the phrases list and the NGramCounts instance, or
+            (None, None) if the last compilation didn't leave any usable
+            state behind.
+        """
+        if not all(os.access(fname, os.R_OK)
+                   for fname in (self.phrases_file, self.counts_file,
+                                 self.languagemodel_file,
+                                 self.dictionary_file)):
+            return (None, None)
+        try:
+            with open(self.phrases_file, 'r') as f:
+                phrases = [line.rstrip('\n') for line in f]
+            counts = NGramCounts.load(self.counts_file)
+        except (IOError, OSError, ValueError):
+            self._logger.warning("Unable to read state of last compilation",
+                                 exc_info=True)
+            return (None, None)
+        return (phrases, counts)
+
     def _compile_vocabulary(self, phrases):
         """
         Compiles the vocabulary to the Pocketsphinx format by creating a
-        languagemodel and a dictionary.
+        languagemodel and a dictionary. If a previous compilation left its
+        phrases and n-gram counts behind, only the difference to the new
+        phrases is processed.
 
         Arguments:
             phrases -- a list of phrases that this vocabulary will contain
         """
-        text = " ".join([("<s> %s </s>" % phrase) for phrase in phrases])
-        self._logger.debug('Compiling languagemodel...')
-        vocabulary = self._compile_languagemodel(text, self.languagemodel_file)
-        self._logger.debug('Starting dictionary...')
-        self._compile_dictionary(vocabulary, self.dictionary_file)
+        old_phrases, counts = self._get_compiled_state()
 
-    def _compile_languagemodel(self, text, output_file):
-        """
-        Compiles the languagemodel from a text.
+        # Remove the state files while compiling, so that a failed
+        # compilation results in a full compilation next time
+        for fname in (self.phrases_file, self.counts_file):
+            if os.path.exists(fname):
+                os.remove(fname)
+
+        if counts is None:
+            self._logger.debug('Compiling languagemodel...')
+            counts = self._compile_languagemodel(phrases,
+                                                 self.languagemodel_file)
+            self._logger.debug('Starting dictionary...')
+            self._compile_dictionary(counts.words, self.dictionary_file)
+        else:
+            old_counter = collections.Counter(old_phrases)
+            new_counter = collections.Counter(phrases)
+            removed_phrases = list((old_counter - new_counter).elements())
+            added_phrases = list((new_counter - old_counter).elements())
+            self._logger.debug('Updating vocabulary incrementally (%d ' +
+                               'phrases removed, %d phrases added)...',
+                               len(removed_phrases), len(added_phrases))
+            counts.remove_phrases(removed_phrases)
+            counts.add_phrases(added_phrases)
+            self._logger.debug('Compiling languagemodel from cached ' +
+                               'n-gram counts...')
+            ARPAWriter(counts).write(self.languagemodel_file)
+            self._logger.debug('Updating dictionary...')
+            self._compile_dictionary(
+                counts.words, self.dictionary_file,
+                known_phonemes=self._read_dictionary(self.dictionary_file))
+
+        counts.save(self.counts_file)
+        with open(self.phrases_file, 'w') as f:
+            for phrase in phrases:
+                f.write("%s\n" % phrase)
+
+    def _compile_languagemodel(self, phrases, output_file):
+        """
+        Compiles the languagemodel from a list of phrases.
 
         Arguments:
-            text -- the text the languagemodel will be generated from
+            phrases -- a list of phrases the languagemodel will be generated
+                       from
             output_file -- the path of the file this languagemodel will
                            be written to
 
         Returns:
-            A list of all unique words this vocabulary contains.
+            The NGramCounts instance of the phrases. Its words property
+            contains all unique words this vocabulary contains.
         """
-        with tempfile.NamedTemporaryFile(suffix='.vocab', delete=False) as f:
-            vocab_file = f.name
+        counts = NGramCounts()
+        counts.add_phrases(phrases)
 
-        # Create vocab file from text
-        self._logger.debug("Creating vocab file: '%s'", vocab_file)
-        cmuclmtk.text2vocab(text, vocab_file)
-
-        # Create language model from text
         self._logger.debug("Creating languagemodel file: '%s'", output_file)
-        cmuclmtk.text2lm(text, output_file, vocab_file=vocab_file)
+        ARPAWriter(counts).write(output_file)
 
-        # Get words from vocab file
-        self._logger.debug("Getting words from vocab file and removing it " +
-                           "afterwards...")
-        words = []
-        with open(vocab_file, 'r') as f:
-            for line in f:
-                line = line.strip()
-                if not line.startswith('#') and line not in ('<s>', '</s>'):
-                    words.append(line)
-        os.remove(vocab_file)
+        return counts
+
+    def _read_dictionary(self, fname):
+        """
+        Reads a dictionary file.
+
+        Arguments:
+            fname -- the path of the dictionary file
 
-        return words
+        Returns:
+            A dict of words and their phonemes
+        """
+        phonemes = {}
+        with open(fname, 'r') as f:
+            for line in f:
+                word, sep, pronounciation = line.rstrip('\n').partition('\t')
+                if sep:
+                    # Alternative pronounciations look like 'WORD(2)'
+                    word = re.sub(r'\(\d+\)$', '', word)
+                    phonemes.setdefault(word, []).append(pronounciation)
+        return phonemes
 
-    def _compile_dictionary(self, words, output_file):
+    def _compile_dictionary(self, words, output_file, known_phonemes=None):
         """
         Compiles the dictionary from a list of words.
 
@@ -314,15 +532,27 @@ class PocketsphinxVocabulary(AbstractVocabulary):
             words -- a list of all unique words this vocabulary contains
             output_file -- the path of the file this dictionary will
                            be written to
+            known_phonemes -- (optional) a dict of words and their phonemes
+                              that don't need to be converted again
         """
+        phonemes = {}
+        if known_phonemes:
+            phonemes.update((word, known_phonemes[word]) for word in words
+                            if word in known_phonemes)
+        missing_words = [word for word in words if word not in phonemes]
+
         # create the dictionary
-        self._logger.debug("Getting phonemes for %d words...", len(words))
-        g2pconverter = PhonetisaurusG2P(**PhonetisaurusG2P.get_config())
-        phonemes = g2pconverter.translate(words)
+        if missing_words:
+            self._logger.debug("Getting phonemes for %d words...",
+                               len(missing_words))
+            g2pconverter = PhonetisaurusG2P(**PhonetisaurusG2P.get_config())
+            cache = PronunciationCache.get_instance(
+                g2pconverter, os.path.join(self.base_path, 'g2p-cache'))
+            phonemes.update(cache.translate(g2pconverter, missing_words))
 
         self._logger.debug("Creating dict file: '%s'", output_file)
         with open(output_file, "w") as f:
-            for word, pronounciations in phonemes.items():
+            for word, pronounciations in sorted(phonemes.items()):
                 for i, pronounciation in enumerate(pronounciations, start=1):
                     if i == 1:
                         line = "%s\t%s\n" % (word, pronounciation)
@@ -333,9 +563,34 @@ class PocketsphinxVocabulary(AbstractVocabulary):
 
 class JuliusVocabulary(AbstractVocabulary):
     class VoxForgeLexicon(object):
-        def __init__(self, fname, membername=None):
-            self._dict = {}
-            self.parse(fname, membername)
+        """
+        Provides lookups in the VoxForge lexicon. Parsing the whole lexicon
+        is slow, so it is only done once per lexicon file: the result is
+        stored in an SQLite database (keyed by the SHA1 hash of the lexicon
+        file) which is reused by subsequent instances.
+        """
+
+        def __init__(self, fname, membername=None, index_path='.'):
+            self._logger = logging.getLogger(__name__)
+            self.index_file = os.path.join(
+                os.path.abspath(index_path),
+                '%s.sqlite' % self.get_hash(fname, membername))
+            if not os.path.exists(self.index_file):
+                self.build_index(fname, membername)
+            self._conn = sqlite3.connect(self.index_file)
+
+        def close(self):
+            self._conn.close()
+
+        @classmethod
+        def get_hash(cls, fname, membername=None):
+            sha1 = hashlib.sha1()
+            with open(fname, 'rb') as f:
+                for chunk in iter(lambda: f.read(65536), b''):
+                    sha1.update(chunk)
+            if membername:
+                sha1.update(membername)
+            return sha1.hexdigest()
 
         @contextlib.contextmanager
         def open_dict(self, fname, membername=None):
@@ -352,22 +607,59 @@ class JuliusVocabulary(AbstractVocabulary):
                     yield f
 
         def parse(self, fname, membername=None):
+            """
+            Parses the lexicon file.
+
+            Returns:
+                An iterator that yields (word, phoneme) tuples
+            """
             pattern = re.compile(r'\[(.+)\]\W(.+)')
             with self.open_dict(fname, membername=membername) as f:
                 for line in f:
                     matchobj = pattern.search(line)
                     if matchobj:
                         word, phoneme = [x.strip() for x in matchobj.groups()]
-                        if word in self._dict:
-                            self._dict[word].append(phoneme)
-                        else:
-                            self._dict[word] = [phoneme]
+                        yield (word, phoneme)
+
+        def build_index(self, fname, membername=None):
+            """
+            Parses the lexicon file and writes its entries to the index
+            database. The database is created under a temporary name and
+            renamed afterwards, so that no incomplete index is ever used.
+            """
+            dirname = os.path.dirname(self.index_file)
+            if not os.path.exists(dirname):
+                os.makedirs(dirname)
+            self._logger.debug("Building lexicon index '%s'...",
+                               self.index_file)
+            with tempfile.NamedTemporaryFile(suffix='.sqlite', dir=dirname,
+                                             delete=False) as f:
+                tmp_fname = f.name
+            try:
+                conn = sqlite3.connect(tmp_fname)
+                try:
+                    conn.execute('CREATE TABLE lexicon (word TEXT NOT NULL, ' +
+                                 'phoneme TEXT NOT NULL)')
+                    conn.executemany('INSERT INTO lexicon VALUES (?, ?)',
+                                     ((_to_unicode(word),
+                                       _to_unicode(phoneme))
+                                      for word, phoneme
+                                      in self.parse(fname, membername)))
+                    conn.execute('CREATE INDEX lexicon_word ON lexicon ' +
+                                 '(word)')
+                    conn.commit()
+                finally:
+                    conn.close()
+                os.rename(tmp_fname, self.index_file)
+            except Exception:
+                os.remove(tmp_fname)
+                raise
 
         def translate_word(self, word):
-            if word in self._dict:
-                return self._dict[word]
-            else:
-                return []
+            cursor = self._conn.execute('SELECT phoneme FROM lexicon ' +
+                                        'WHERE word = ? ORDER BY rowid',
+                                        (_to_unicode(word),))
+            return [row[0].encode('utf-8') for row in cursor]
 
     PATH_PREFIX = 'julius-vocabulary'
 
@@ -432,28 +724,35 @@ class JuliusVocabulary(AbstractVocabulary):
                         lexicon_archive_member = \
                             profile['julius']['lexicon_archive_member']
 
-        lexicon = JuliusVocabulary.VoxForgeLexicon(lexicon_file,
-                                                   lexicon_archive_member)
-
-        # Create grammar file
-        tmp_grammar_file = os.path.join(tmpdir,
-                                        os.extsep.join([prefix, 'grammar']))
-        with open(tmp_grammar_file, 'w') as f:
-            grammar = self._get_grammar(phrases)
-            for definition in grammar.pop('S'):
-                f.write("%s: %s\n" % ('S', ' '.join(definition)))
-            for name, definitions in grammar.items():
-                for definition in definitions:
-                    f.write("%s: %s\n" % (name, ' '.join(definition)))
-
-        # Create voca file
-        tmp_voca_file = os.path.join(tmpdir, os.extsep.join([prefix, 'voca']))
-        with open(tmp_voca_file, 'w') as f:
-            for category, words in self._get_word_defs(lexicon,
-                                                       phrases).items():
-                f.write("%% %s\n" % category)
-                for word, phoneme in words:
-                    f.write("%s\t\t\t%s\n" % (word, phoneme))
+        lexicon = JuliusVocabulary.VoxForgeLexicon(
+            lexicon_file, lexicon_archive_member,
+            index_path=os.path.join(self.base_path, 'julius-lexicon'))
+
+        try:
+            # Create grammar file
+            tmp_grammar_file = os.path.join(
+                tmpdir, os.extsep.join([prefix, 'grammar']))
+            with open(tmp_grammar_file, 'w') as f:
+                grammar = self._get_grammar(phrases)
+                for definition in grammar.pop('S'):
+                    f.write("%s: %s\n" % ('S', ' '.join(definition)))
+                for name, definitions in grammar.items():
+                    for definition in definitions:
+                        f.write("%s: %s\n" % (name, ' '.join(definition)))
+
+            # Create voca file
+            tmp_voca_file = os.path.join(tmpdir,
+                                         os.extsep.join([prefix, 'voca']))
+            with open(tmp_voca_file, 'w') as f:
+                for category, words in self._get_word_defs(lexicon,
+                                                           phrases).items():
+                    f.write("%% %s\n" % category)
+                    for word, phoneme in words:
+                        if isinstance(word, unicode):
+                            word = word.encode('utf-8')
+                        f.write("%s\t\t\t%s\n" % (word, phoneme))
+        finally:
+            lexicon.close()
 
         # mkdfa.pl
         olddir = os.getcwd()
@@ -476,6 +775,15 @@ class JuliusVocabulary(AbstractVocabulary):
         shutil.rmtree(tmpdir)
 
 
+def _to_unicode(text):
+    """
+    Returns text as unicode, decoding it from UTF-8 unless it already is.
+    """
+    if isinstance(text, unicode):
+        return text
+    return text.decode('utf-8', 'replace')
+
+
 def get_phrases_from_module(module):
     """
     Gets phrases from a module.
@@ -0,0 +1,235 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8-*-
+import os
+import shutil
+import smtplib
+import tempfile
+import time
+import unittest
+import mock
+import requests
+from client import app_utils
+
+
+class TestResponseCache(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.cache = app_utils.ResponseCache(self.tempdir)
+        self.fetch = mock.Mock(side_effect=[['first'], ['second']])
+        self.time = 1000.0
+        patcher = mock.patch('time.time', side_effect=lambda: self.time)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def get(self, cache=None):
+        return (cache or self.cache).get('key', self.fetch, ttl=60,
+                                         max_stale=600)
+
+    def testFresh(self):
+        self.assertEqual(self.get(), ['first'])
+        self.time += 30
+        self.assertEqual(self.get(), ['first'])
+        self.assertEqual(self.fetch.call_count, 1)
+
+    def testStaleWhileRevalidate(self):
+        self.get()
+        self.time += 120
+        with mock.patch('threading.Thread') as thread:
+            self.assertEqual(self.get(), ['first'])
+            # Only one refresh at a time
+            self.assertEqual(self.get(), ['first'])
+            self.assertEqual(thread.call_count, 1)
+            self.assertEqual(self.fetch.call_count, 1)
+            kwargs = thread.call_args[1]
+        kwargs['target'](*kwargs['args'])
+        self.assertEqual(self.get(), ['second'])
+
+    def testExpired(self):
+        self.get()
+        self.time += 1000
+        self.assertEqual(self.get(), ['second'])
+
+    def testDisk(self):
+        self.get()
+        self.assertEqual(self.get(app_utils.ResponseCache(self.tempdir)),
+                         ['first'])
+        self.assertEqual(self.fetch.call_count, 1)
+
+    def testNonASCIIKey(self):
+        key = u'http://example.com/caf\xe9'
+        self.cache.get(key, self.fetch, ttl=60)
+        cache = app_utils.ResponseCache(self.tempdir)
+        self.assertEqual(cache.get(key, self.fetch, ttl=60), ['first'])
+        self.assertEqual(self.fetch.call_count, 1)
+
+    def testRefresh(self):
+        self.get()
+        self.assertEqual(self.cache.get('key', self.fetch, ttl=60,
+                                        refresh=True), ['second'])
+        self.assertEqual(self.get(), ['second'])
+
+    def testNone(self):
+        self.fetch.side_effect = [None, ['first']]
+        self.assertIsNone(self.get())
+        self.assertEqual(self.get(), ['first'])
+
+    def testFetchError(self):
+        self.fetch.side_effect = IOError()
+        with self.assertRaises(IOError):
+            self.get()
+
+
+def get_response(status_code=200, content='', headers={}):
+    response = mock.Mock(status_code=status_code, content=content,
+                         headers=headers)
+    if status_code >= 400:
+        response.raise_for_status.side_effect = requests.HTTPError()
+    return response
+
+
+class TestConditionalFetcher(unittest.TestCase):
+
+    URL = 'http://example.com/feed'
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.parse = mock.Mock(side_effect=lambda content: [content])
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def get_fetcher(self, responses):
+        fetcher = app_utils.ConditionalFetcher(self.tempdir)
+        fetcher._session = mock.Mock()
+        fetcher._session.get.side_effect = responses
+        return fetcher
+
+    def testNotModified(self):
+        fetcher = self.get_fetcher([
+            get_response(content='feed', headers={'ETag': '"v1"'}),
+            get_response(304)])
+        self.assertEqual(fetcher.fetch(self.URL, self.parse), ['feed'])
+        self.assertEqual(fetcher.fetch(self.URL, self.parse), ['feed'])
+        self.assertEqual(self.parse.call_count, 1)
+        headers = fetcher._session.get.call_args[1]['headers']
+        self.assertEqual(headers['If-None-Match'], '"v1"')
+        self.assertNotIn('If-Modified-Since', headers)
+
+    def testModified(self):
+        lm = 'Mon, 01 Jun 2015 10:00:00 GMT'
+        fetcher = self.get_fetcher([
+            get_response(content='old', headers={'Last-Modified': lm}),
+            get_response(content='new')])
+        fetcher.fetch(self.URL, self.parse)
+        self.assertEqual(fetcher.fetch(self.URL, self.parse), ['new'])
+        headers = fetcher._session.get.call_args[1]['headers']
+        self.assertEqual(headers['If-Modified-Since'], lm)
+
+    def testDisk(self):
+        self.get_fetcher([get_response(content='feed',
+                                       headers={'ETag': '"v1"'})]).fetch(
+            self.URL, self.parse)
+        fetcher = self.get_fetcher([get_response(304)])
+        self.assertEqual(fetcher.fetch(self.URL, self.parse), ['feed'])
+
+    def testError(self):
+        fetcher = self.get_fetcher([get_response(500)])
+        with self.assertRaises(requests.HTTPError):
+            fetcher.fetch(self.URL, self.parse)
+        self.assertFalse(self.parse.called)
+
+
+class TestMailer(unittest.TestCase):
+
+    def setUp(self):
+        self.mailer = app_utils.Mailer('smtp.example.com', 'user', 'secret')
+        patcher = mock.patch('smtplib.SMTP')
+        self.smtp = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def send(self, n):
+        for future in [self.mailer.send('Jasper', 'user@example.com',
+                                        'Message %d' % i) for i in range(n)]:
+            future.result(timeout=5)
+
+    def testReuse(self):
+        self.send(3)
+        self.assertEqual(self.smtp.call_count, 1)
+        session = self.smtp.return_value
+        session.login.assert_called_once_with('user', 'secret')
+        self.assertEqual(session.sendmail.call_count, 3)
+
+    def testReconnect(self):
+        self.send(1)
+        session = self.smtp.return_value
+        session.sendmail.side_effect = [smtplib.SMTPServerDisconnected(),
+                                        None]
+        self.send(1)
+        self.assertEqual(self.smtp.call_count, 2)
+
+    def testError(self):
+        self.smtp.return_value.login.side_effect = \
+            smtplib.SMTPAuthenticationError(535, 'Bad credentials')
+        with self.assertRaises(smtplib.SMTPAuthenticationError):
+            self.send(1)
+
+    def testIdle(self):
+        self.mailer.IDLE_TIMEOUT = 0
+        self.send(1)
+        deadline = time.time() + 5
+        while self.mailer._thread is not None and time.time() < deadline:
+            time.sleep(0.01)
+        self.smtp.return_value.quit.assert_called_once_with()
+
+
+class TestTinyURL(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.fname = os.path.join(self.tempdir, 'tinyurls.json')
+        patcher = mock.patch.object(app_utils, '_tinyURLCache',
+                                    app_utils.TinyURLCache(self.fname))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def testGenerateTinyURLs(self):
+        urls = ['http://example.com/%d' % i for i in range(8)]
+        with mock.patch.object(app_utils, 'fetchTinyURL',
+                               side_effect=lambda url: url + '/tiny') as f:
+            self.assertEqual(app_utils.generateTinyURLs(urls),
+                             [url + '/tiny' for url in urls])
+            # Cached URLs aren't compressed again
+            self.assertEqual(app_utils.generateTinyURLs(urls[:2]),
+                             [url + '/tiny' for url in urls[:2]])
+            self.assertEqual(f.call_count, 8)
+        self.assertEqual(app_utils.generateTinyURLs([]), [])
+        self.assertEqual(os.listdir(self.tempdir), ['tinyurls.json'])
+
+    def testNonASCII(self):
+        url = u'http://example.com/caf\xe9'
+        with mock.patch('urllib2.urlopen') as urlopen:
+            urlopen.return_value.read.return_value = 'http://tinyurl.com/x'
+            self.assertEqual(app_utils.generateTinyURL(url),
+                             'http://tinyurl.com/x')
+            self.assertIn('caf%C3%A9', urlopen.call_args[0][0])
+        cache = app_utils.TinyURLCache(self.fname)
+        self.assertEqual(cache.get(url), 'http://tinyurl.com/x')
+
+    def testEviction(self):
+        cache = app_utils.TinyURLCache(self.fname)
+        cache.MAX_SIZE = 2
+        cache.update({'a': 'tiny-a'})
+        cache.update({'b': 'tiny-b'})
+        self.assertEqual(cache.get('a'), 'tiny-a')
+        cache.update({'c': 'tiny-c'})
+        cache = app_utils.TinyURLCache(self.fname)
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.get('a'), 'tiny-a')
+        self.assertEqual(cache.get('c'), 'tiny-c')
@@ -0,0 +1,43 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8-*-
+import unittest
+from client.bargein import BargeInDetector
+
+
+class TestBargeInDetector(unittest.TestCase):
+
+    def setUp(self):
+        self.detector = BargeInDetector()
+
+    def feed(self, scores, playing=True):
+        return [self.detector.feed(score, playing) for score in scores]
+
+    def testSynthesisNoise(self):
+        # The room is quiet while speech is synthesized, then Jasper's voice
+        # starts, which must not count as barge-in
+        self.assertFalse(any(self.feed([10] * 20, playing=False)))
+        self.assertFalse(any(self.feed([100] * 30)))
+        self.assertEqual(self.detector.echo_level, 100)
+
+    def testVoiceOnsetAfterQuietChunks(self):
+        # The player is running, but the speech starts with silence
+        self.assertFalse(any(self.feed([10] * 5, playing=False)))
+        self.assertFalse(any(self.feed([10] * 8 + [100] * 30)))
+        self.assertEqual(self.detector.echo_level, 100)
+
+    def testBargeIn(self):
+        self.feed([10] * 5, playing=False)
+        self.feed([100] * 10)
+        self.assertEqual(self.feed([400] * 4), [False, False, False, True])
+
+    def testLearnsLouderVoice(self):
+        self.feed([100] * 10)
+        # A few loud chunks of Jasper's own voice
+        self.assertFalse(any(self.feed([300] * 3 + [100])))
+        self.assertGreater(self.detector.echo_level, 250)
+        self.assertFalse(any(self.feed([300] * 10)))
+
+    def testPause(self):
+        self.feed([100] * 10)
+        # A pause between sentences doesn't make the next one barge-in
+        self.assertFalse(any(self.feed([10] * 20 + [100] * 10)))
@@ -1,6 +1,8 @@
 #!/usr/bin/env python2
 # -*- coding: utf-8-*-
+import time
 import unittest
+import threading
 import mock
 from client import brain, test_mic
 
@@ -47,3 +49,86 @@ class TestBrain(unittest.TestCase):
         with mock.patch.object(hn, 'handle') as mocked_handle:
             my_brain.query(["hacker news"])
             self.assertTrue(mocked_handle.called)
+
+    def testTimeout(self):
+        """Does Brain give up on modules that take too long?"""
+        my_brain = TestBrain._emptyBrain()
+        my_brain.profile = dict(DEFAULT_PROFILE, module_timeouts={'HN': 0.1})
+        hn = filter(lambda m: m.__name__ == 'HN', my_brain.modules)[0]
+        done = mock.Mock()
+
+        def handle(text, mic, profile):
+            time.sleep(0.3)
+            mic.say("Too late")
+            done()
+
+        with mock.patch.object(hn, 'handle', side_effect=handle):
+            my_brain.query(["hacker news"])
+            self.assertEqual(my_brain.mic.outputs,
+                             ["I'm sorry. That took too long. Please try " +
+                              "again later."])
+            time.sleep(0.4)
+        self.assertTrue(done.called)
+        self.assertEqual(len(my_brain.mic.outputs), 1)
+
+    def testListeningDoesntCount(self):
+        """Does Brain let modules wait for the user as long as it takes?"""
+        my_brain = TestBrain._emptyBrain()
+        my_brain.profile = dict(DEFAULT_PROFILE, module_timeouts={'HN': 0.2})
+        hn = filter(lambda m: m.__name__ == 'HN', my_brain.modules)[0]
+
+        def activeListen(*args, **kwargs):
+            time.sleep(0.4)
+            return "YES"
+
+        def handle(text, mic, profile):
+            mic.say("Do you want more?")
+            mic.say("Here you go" if mic.activeListen() == "YES" else "Ok")
+
+        with mock.patch.object(hn, 'handle', side_effect=handle):
+            with mock.patch.object(my_brain.mic, 'activeListen',
+                                   side_effect=activeListen):
+                my_brain.query(["hacker news"])
+        self.assertEqual(my_brain.mic.outputs,
+                         ["Do you want more?", "Here you go"])
+
+
+class TestHandlerMic(unittest.TestCase):
+
+    def testSayAfterCancel(self):
+        """Can modules wait for what they say after being abandoned?"""
+        mic = brain.HandlerMic(test_mic.Mic([]))
+        mic.cancel()
+        self.assertIsNone(mic.say("Too late").result(timeout=0))
+        self.assertEqual(mic._mic.outputs, [])
+
+
+class TestMicHandoff(unittest.TestCase):
+
+    def testBorrow(self):
+        """Does the listener give the microphone to modules that want it?"""
+        handoff = brain.MicHandoff()
+        mic = brain.HandlerMic(test_mic.Mic(["Yes"]), handoff)
+        holding = threading.Event()
+        given_up = []
+
+        def listen():
+            with handoff.hold():
+                holding.set()
+                given_up.append(handoff.wanted.wait(5))
+
+        listener = threading.Thread(target=listen)
+        listener.start()
+        holding.wait(5)
+        self.assertEqual(mic.activeListen(), "Yes")
+        listener.join()
+        self.assertEqual(given_up, [True])
+        self.assertFalse(handoff.wanted.is_set())
+
+    def testOnlyRecordingBorrows(self):
+        """Can modules wait for speech output while the listener listens?"""
+        handoff = brain.MicHandoff()
+        mic = brain.HandlerMic(test_mic.Mic([]), handoff)
+        with handoff.hold():
+            mic.wait()
+        self.assertFalse(handoff.wanted.is_set())
@@ -0,0 +1,81 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8-*-
+import unittest
+import threading
+import mock
+from client import conversation, test_mic
+from client.notifier import Notification
+
+DEFAULT_PROFILE = {
+    'prefers_email': False,
+    'location': 'Cape Town',
+    'timezone': 'US/Eastern',
+    'phone_number': '012344321'
+}
+
+
+class TestConversation(unittest.TestCase):
+
+    def setUp(self):
+        self.mic = test_mic.Mic(["What is the meaning of life?"])
+        self.conversation = conversation.Conversation(
+            "JASPER", self.mic, DEFAULT_PROFILE)
+        self.addCleanup(self.conversation.notifier.stop)
+        # Don't fetch anything in the background
+        patcher = mock.patch.object(self.conversation.prefetcher, 'start')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def testHandleForever(self):
+        # The test mic raises IndexError when it runs out of inputs, which
+        # has to end the conversation
+        with self.assertRaises(IndexError):
+            self.conversation.handleForever()
+        self.assertEqual(len(self.mic.outputs), 1)
+
+    def testNotifications(self):
+        self.conversation.notifier.notify(Notification("New email."))
+        self.conversation.announceNotifications()
+        self.assertEqual(self.mic.outputs, ["New email."])
+
+    def testNotificationsBetweenListenCycles(self):
+        self.conversation.notifier.notify(Notification("New email."))
+        said_before_listening = []
+
+        def passiveListen(persona, stop=None):
+            said_before_listening.append(list(self.mic.outputs))
+            return True, "JASPER"
+
+        with mock.patch.object(self.mic, 'passiveListen',
+                               side_effect=passiveListen):
+            with self.assertRaises(IndexError):
+                self.conversation.handleForever()
+        self.assertEqual(said_before_listening[0], ["New email."])
+
+    def testListenWhileModuleRuns(self):
+        listening_again = threading.Event()
+        in_time = []
+
+        def query(texts):
+            # Only returns early if the keyword is listened for again
+            in_time.append(listening_again.wait(5))
+
+        def passiveListen(persona, stop=None):
+            if self.mic.idx:
+                listening_again.set()
+            return True, "JASPER"
+
+        with mock.patch.object(self.conversation.brain, 'query',
+                               side_effect=query):
+            with mock.patch.object(self.mic, 'passiveListen',
+                                   side_effect=passiveListen):
+                with self.assertRaises(IndexError):
+                    self.conversation.handleForever()
+        self.assertEqual(in_time, [True])
+
+    def testModuleError(self):
+        with mock.patch.object(self.conversation.brain, 'query',
+                               side_effect=KeyError('foo')):
+            with self.assertRaises(IndexError):
+                self.conversation.handleForever()
+        self.assertEqual(self.mic.outputs, [])
@@ -0,0 +1,51 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8-*-
+import unittest
+from client import fuzzyindex
+
+TITLES = ['HELLO', 'YELLOW SUBMARINE', 'LET IT BE', 'HEY JUDE',
+          "DON'T STOP ME NOW", 'BOHEMIAN RHAPSODY']
+
+
+class TestFuzzyIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.index = fuzzyindex.FuzzyIndex(TITLES)
+
+    def testSoundex(self):
+        self.assertEqual(fuzzyindex.soundex('ROBERT'), 'R163')
+        self.assertEqual(fuzzyindex.soundex('RUPERT'), 'R163')
+        self.assertEqual(fuzzyindex.soundex('ASHCRAFT'), 'A261')
+        self.assertEqual(fuzzyindex.soundex('LEE'), 'L000')
+
+    def testNormalize(self):
+        self.assertEqual(fuzzyindex.normalize("Don't  stop-me now!"),
+                         'DON T STOP ME NOW')
+
+    def testExactMatch(self):
+        self.assertEqual(self.index.search('HEY JUDE')[0], 'HEY JUDE')
+
+    def testMisspelledMatch(self):
+        self.assertEqual(self.index.search('YELLOW SUBMARIN'),
+                         ['YELLOW SUBMARINE'])
+        self.assertEqual(self.index.search('DONT STOP ME NOW'),
+                         ["DON'T STOP ME NOW"])
+
+    def testPhoneticMatch(self):
+        self.assertIn('BOHEMIAN RHAPSODY',
+                      self.index.search('BOHEMEAN RAPSUDY'))
+
+    def testNoMatch(self):
+        self.assertEqual(self.index.search('WHAT TIME IS IT'), [])
+        self.assertEqual(self.index.search(''), [])
+
+    def testIncrementalUpdate(self):
+        self.index.add('HEY JUDE')
+        self.index.remove('HEY JUDE')
+        self.assertIn('HEY JUDE', self.index)
+
+        self.index.update(TITLES[1:] + ['HELP'])
+        self.assertNotIn('HELLO', self.index)
+        self.assertEqual(len(self.index), len(TITLES))
+        self.assertEqual(self.index.search('HELP')[0], 'HELP')
+        self.assertEqual(self.index.search('HELLO', cutoff=0.9), [])
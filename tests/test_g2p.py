@@ -1,5 +1,7 @@
 #!/usr/bin/env python2
 # -*- coding: utf-8-*-
+import os
+import shutil
 import unittest
 import tempfile
 import mock
@@ -75,3 +77,92 @@ class TestPatchedG2P(unittest.TestCase):
                 results = self.g2pconv.translate(WORDS).keys()
                 for word in WORDS:
                     self.assertIn(word, results)
+
+    def testTranslateShardedWords(self):
+        class EchoProc(object):
+            def __init__(self, cmd, *args, **kwargs):
+                self.returncode = 0
+                fname = [arg for arg in cmd
+                         if arg.startswith('--input=')][0][len('--input='):]
+                with open(fname, 'r') as f:
+                    self.words = [line.strip() for line in f]
+
+            def communicate(self):
+                return (''.join("%s\t1.0\t<s> %s </s>\n" % (word, word)
+                                for word in self.words), "")
+
+        words = ['WORD%d' % i for i in range(10)]
+        self.g2pconv.workers = 3
+        with mock.patch.object(self.g2pconv, 'MIN_SHARD_SIZE', 2):
+            with mock.patch('subprocess.Popen',
+                            side_effect=EchoProc) as mocked_popen:
+                results = self.g2pconv.translate(words)
+        self.assertEqual(mocked_popen.call_count, 3)
+        self.assertEqual(sorted(results.keys()), sorted(words))
+        for word in words:
+            self.assertEqual(results[word], [word])
+
+
+class TestPronunciationCache(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.g2pconv = mock.Mock()
+        self.g2pconv.fst_model = os.devnull
+        self.g2pconv.nbest = 3
+        self.g2pconv.translate.side_effect = lambda words: dict(
+            (word, ['%s 1' % word, '%s 2' % word]) for word in words)
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def testTranslate(self):
+        cache = g2p.PronunciationCache.get_instance(self.g2pconv,
+                                                    self.tempdir)
+        results = cache.translate(self.g2pconv, WORDS)
+        self.assertEqual(sorted(results.keys()), sorted(WORDS))
+        self.assertEqual(results['GOOD'], ['GOOD 1', 'GOOD 2'])
+
+        # A new cache instance has to read the words from disk and must
+        # only pass unseen words to the converter
+        cache = g2p.PronunciationCache.get_instance(self.g2pconv,
+                                                    self.tempdir)
+        self.assertEqual(len(cache), len(WORDS))
+        results = cache.translate(self.g2pconv, WORDS + ['NEW'])
+        self.g2pconv.translate.assert_called_with(['NEW'])
+        self.assertEqual(results['UGLY'], ['UGLY 1', 'UGLY 2'])
+        self.assertEqual(results['NEW'], ['NEW 1', 'NEW 2'])
+
+    def testConcurrentUpdate(self):
+        # Two compilations that started with the same (empty) cache
+        passive = g2p.PronunciationCache.get_instance(self.g2pconv,
+                                                      self.tempdir)
+        active = g2p.PronunciationCache.get_instance(self.g2pconv,
+                                                     self.tempdir)
+        passive.translate(self.g2pconv, ['FIRST', 'JASPER'])
+        active.translate(self.g2pconv, ['FIRST', 'OF'])
+        self.assertEqual(active.get('JASPER'), ['JASPER 1', 'JASPER 2'])
+
+        with open(active.fname, 'r') as f:
+            words = [line.split('\t')[0] for line in f]
+        self.assertEqual(sorted(words), ['FIRST', 'FIRST', 'JASPER',
+                                         'JASPER', 'OF', 'OF'])
+
+    def testDuplicatesOnLoad(self):
+        cache = g2p.PronunciationCache.get_instance(self.g2pconv,
+                                                    self.tempdir)
+        with open(cache.fname, 'w') as f:
+            f.write('FIRST\tF ER S T\nFIRST\tF ER S\nOF\tAH V\n' +
+                    'FIRST\tF ER S T\nFIRST\tF ER S\n')
+        cache = g2p.PronunciationCache.get_instance(self.g2pconv,
+                                                    self.tempdir)
+        self.assertEqual(cache.get('FIRST'), ['F ER S T', 'F ER S'])
+        self.assertEqual(cache.get('OF'), ['AH V'])
+
+    def testCacheKey(self):
+        cache = g2p.PronunciationCache.get_instance(self.g2pconv,
+                                                    self.tempdir)
+        self.g2pconv.nbest = None
+        other_cache = g2p.PronunciationCache.get_instance(self.g2pconv,
+                                                          self.tempdir)
+        self.assertNotEqual(cache.fname, other_cache.fname)
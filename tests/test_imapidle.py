@@ -0,0 +1,80 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8-*-
+import ssl
+import socket
+import imaplib
+import unittest
+import mock
+from client import imapidle
+
+
+def get_connection(lines):
+    conn = mock.Mock()
+    conn._new_tag.return_value = 'A001'
+    conn.readline.side_effect = lines
+    return conn
+
+
+class TestIMAPIdleWatcher(unittest.TestCase):
+
+    def setUp(self):
+        self.callback = mock.Mock()
+        self.watcher = imapidle.IMAPIdleWatcher('imap.example.com', 'user',
+                                                'password', self.callback)
+
+    def testNewMessages(self):
+        conn = get_connection(['+ idling\r\n', '* 3 EXPUNGE\r\n',
+                               '* 23 EXISTS\r\n',
+                               'A001 OK IDLE terminated\r\n'])
+        self.assertTrue(self.watcher.idle(conn))
+        conn.send.assert_has_calls([mock.call('A001 IDLE\r\n'),
+                                    mock.call('DONE\r\n')])
+
+    def testTimeout(self):
+        # what an IMAP4_SSL socket raises when the read times out
+        conn = get_connection(['+ idling\r\n',
+                               ssl.SSLError('The read operation timed out'),
+                               'A001 OK IDLE terminated\r\n'])
+        self.assertFalse(self.watcher.idle(conn))
+        conn.send.assert_called_with('DONE\r\n')
+        conn.socket().settimeout.assert_called_with(None)
+
+    def testPlainSocketTimeout(self):
+        conn = get_connection(['+ idling\r\n', socket.timeout(),
+                               'A001 OK IDLE terminated\r\n'])
+        self.assertFalse(self.watcher.idle(conn))
+
+    def testSSLError(self):
+        conn = get_connection(['+ idling\r\n',
+                               ssl.SSLError('decryption failed')])
+        with self.assertRaises(ssl.SSLError):
+            self.watcher.idle(conn)
+
+    def testIdleNotSupported(self):
+        conn = get_connection(['A001 BAD unknown command\r\n'])
+        with self.assertRaises(imaplib.IMAP4.error):
+            self.watcher.idle(conn)
+
+    def testConnectionClosed(self):
+        conn = get_connection(['+ idling\r\n', ''])
+        with self.assertRaises(imaplib.IMAP4.abort):
+            self.watcher.idle(conn)
+
+    def testReconnect(self):
+        conn = get_connection([])
+        self.watcher.connect = mock.Mock(
+            side_effect=[socket.error(), conn])
+        self.watcher.MIN_RECONNECT_DELAY = 0
+
+        def idle(conn):
+            if self.callback.call_count > 1:
+                self.watcher.stop()
+            return True
+
+        self.watcher.idle = mock.Mock(side_effect=idle)
+        self.watcher.run()
+        # once after connecting, once for the new messages
+        self.assertEqual(self.callback.call_args_list,
+                         [mock.call(conn), mock.call(conn)])
+        self.assertEqual(self.watcher.connect.call_count, 2)
+        conn.logout.assert_called_once_with()
@@ -0,0 +1,85 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8-*-
+import os
+import unittest
+import tempfile
+import mock
+from client import languagemodel
+
+PHRASES = ['WHAT TIME IS IT', 'WHAT IS THE WEATHER', 'TIME']
+
+
+class TestNGramCounts(unittest.TestCase):
+
+    def testCounts(self):
+        counts = languagemodel.NGramCounts()
+        counts.add_phrases(PHRASES)
+        self.assertEqual(counts.get_counts(1)[('WHAT',)], 2)
+        self.assertEqual(counts.get_counts(1)[('</s>',)], 3)
+        self.assertEqual(counts.get_counts(2)[('<s>', 'WHAT')], 2)
+        self.assertEqual(counts.get_counts(3)[('WHAT', 'IS', 'THE')], 1)
+        self.assertEqual(counts.words,
+                         ['IS', 'IT', 'THE', 'TIME', 'WEATHER', 'WHAT'])
+
+    def testIncrementalUpdate(self):
+        counts = languagemodel.NGramCounts()
+        counts.add_phrases(PHRASES)
+        counts.add_phrases(['PLAY MUSIC'])
+        counts.remove_phrases(['PLAY MUSIC'])
+
+        expected = languagemodel.NGramCounts()
+        expected.add_phrases(PHRASES)
+        for n in range(1, 4):
+            self.assertEqual(counts.get_counts(n), expected.get_counts(n))
+
+    def testSaveLoad(self):
+        counts = languagemodel.NGramCounts()
+        counts.add_phrases(PHRASES)
+        with tempfile.NamedTemporaryFile(delete=False) as f:
+            fname = f.name
+        try:
+            counts.save(fname)
+            loaded = languagemodel.NGramCounts.load(fname)
+        finally:
+            os.remove(fname)
+        self.assertEqual(loaded.order, counts.order)
+        for n in range(1, 4):
+            self.assertEqual(loaded.get_counts(n), counts.get_counts(n))
+
+
+class TestARPAWriter(unittest.TestCase):
+
+    def setUp(self):
+        self.counts = languagemodel.NGramCounts()
+        self.counts.add_phrases(PHRASES)
+        self.writer = languagemodel.ARPAWriter(self.counts)
+
+    def testNormalized(self):
+        vocabulary = self.counts.words + ['</s>']
+        for context in [(), ('<s>',), ('WHAT',), ('<s>', 'WHAT'),
+                        ('WHAT', 'IS')]:
+            total = sum(self.writer.prob(context + (word,))
+                        for word in vocabulary)
+            self.assertAlmostEqual(total, 1.0)
+
+    def testPurePython(self):
+        with mock.patch.object(languagemodel, 'numpy', None):
+            writer = languagemodel.ARPAWriter(self.counts)
+        for n in range(1, 4):
+            for ngram in self.counts.get_counts(n):
+                self.assertAlmostEqual(writer.prob(ngram),
+                                       self.writer.prob(ngram))
+
+    def testWrite(self):
+        with tempfile.NamedTemporaryFile(delete=False) as f:
+            fname = f.name
+        try:
+            self.writer.write(fname)
+            with open(fname, 'r') as f:
+                lines = f.read().splitlines()
+        finally:
+            os.remove(fname)
+        self.assertEqual(lines[0], '\\data\\')
+        self.assertEqual(lines[-1], '\\end\\')
+        self.assertIn('ngram 1=%d' % len(self.counts.get_counts(1)), lines)
+        self.assertIn('\\3-grams:', lines)
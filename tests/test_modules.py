@@ -1,6 +1,11 @@
 #!/usr/bin/env python2
 # -*- coding: utf-8-*-
+import os
+import shutil
+import tempfile
 import unittest
+import mock
+import requests
 from client import test_mic, diagnose, jasperpath
 from client.modules import Life, Joke, Time, Gmail, HN, News, Weather
 
@@ -94,3 +99,110 @@ class TestModules(unittest.TestCase):
         outputs = self.runConversation(query, inputs, Weather)
         self.assertTrue("can't see that far ahead"
                         in outputs[0] or "Tomorrow" in outputs[0])
+
+
+class TestWeatherOffline(unittest.TestCase):
+
+    def testNetworkError(self):
+        with mock.patch.object(Weather, 'fetchURL',
+                               side_effect=requests.ConnectionError()), \
+                mock.patch.object(Weather.stations, 'get_index',
+                                  side_effect=requests.ConnectionError()):
+            self.assertIsNone(Weather.fetch_forecast_by_name('Cape Town'))
+            self.assertIsNone(Weather.fetch_forecast_by_wmo_id('68816'))
+
+
+class TestGmailFetching(unittest.TestCase):
+
+    HEADERS = {
+        21: 'From: Alice <alice@example.com>\r\nDate: Mon, 1 Jun 2015 ' +
+            '10:00:00 +0000\r\n\r\n',
+        23: 'From: Bob <bob@example.com>\r\nDate: Mon, 1 Jun 2015 ' +
+            '11:00:00 +0000\r\n\r\n'
+    }
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.profile = {'gmail_address': 'jasper@example.com',
+                        'gmail_password': 'secret'}
+        self.conn = mock.Mock()
+        self.conn.response.return_value = ('UIDVALIDITY', ['7'])
+        self.conn.uid.side_effect = self.uid
+        patcher = mock.patch('imaplib.IMAP4_SSL', return_value=self.conn)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def uid(self, command, *args):
+        if command == 'SEARCH':
+            if args[1] == '(UNSEEN UID 24:*)':
+                # n:* always matches the newest email
+                return ('OK', ['23'])
+            return ('OK', [' '.join(str(uid) for uid in self.HEADERS)])
+        elif command == 'FETCH':
+            data = []
+            for i, uid in enumerate(args[0].split(',')):
+                headers = self.HEADERS[int(uid)]
+                description = '%d (UID %s BODY[HEADER.FIELDS (FROM DATE)] {%d}'
+                data.append((description % (i + 1, uid, len(headers)),
+                             headers))
+                data.append(')')
+            return ('OK', data)
+        return ('OK', [None])
+
+    def testFetchHeaders(self):
+        msgs = Gmail.fetchUnreadEmails(self.profile)
+        self.assertEqual([Gmail.getSender(msg) for msg in msgs],
+                         ['Alice', 'Bob'])
+        self.assertEqual(self.conn.uid.call_args_list[-1][0][:2],
+                         ('FETCH', '21,23'))
+        self.assertFalse(self.conn.fetch.called)
+        self.conn.logout.assert_called_once_with()
+
+    def testLimit(self):
+        self.assertEqual(Gmail.fetchUnreadEmails(self.profile, limit=1), 2)
+        self.conn.logout.assert_called_once_with()
+
+    def testHighWaterMark(self):
+        fname = os.path.join(self.tempdir, 'uid.json')
+        mark = Gmail.HighWaterMark(fname)
+        self.assertEqual(len(Gmail.fetchUnreadEmails(self.profile,
+                                                     mark=mark)), 2)
+        self.assertEqual(Gmail.HighWaterMark(fname).get(7), 23)
+
+        mark = Gmail.HighWaterMark(fname)
+        self.assertEqual(Gmail.fetchUnreadEmails(self.profile, mark=mark),
+                         [])
+
+        # UIDs of another UIDVALIDITY are meaningless
+        self.conn.response.return_value = ('UIDVALIDITY', ['8'])
+        self.assertEqual(len(Gmail.fetchUnreadEmails(self.profile,
+                                                     mark=mark)), 2)
+        self.assertEqual(mark.get(8), 23)
+
+    def testHighWaterMarkWriteFailed(self):
+        fname = os.path.join(self.tempdir, 'uid.json')
+        Gmail.HighWaterMark(fname).update(7, 21)
+        with mock.patch('json.dump', side_effect=IOError("Disk full")):
+            with self.assertRaises(IOError):
+                Gmail.HighWaterMark(fname).update(7, 23)
+        self.assertEqual(Gmail.HighWaterMark(fname).get(7), 21)
+        self.assertEqual(os.listdir(self.tempdir), ['uid.json'])
+
+    def testExistingConnection(self):
+        mark = Gmail.HighWaterMark()
+        with mock.patch('imaplib.IMAP4_SSL') as IMAP4_SSL:
+            self.assertEqual(len(Gmail.fetchUnreadEmailsFrom(self.conn,
+                                                             mark=mark)), 2)
+            # The response to SELECT has been read, so the next time the
+            # UIDVALIDITY comes from STATUS
+            self.conn.response.return_value = ('UIDVALIDITY', [None])
+            self.conn.status.return_value = ('OK',
+                                             ['"INBOX" (UIDVALIDITY 7)'])
+            self.assertEqual(Gmail.fetchUnreadEmailsFrom(self.conn,
+                                                         mark=mark), [])
+            self.assertFalse(IMAP4_SSL.called)
+        self.conn.status.assert_called_once_with('INBOX', '(UIDVALIDITY)')
+        self.assertFalse(self.conn.logout.called)
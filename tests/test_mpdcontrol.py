@@ -0,0 +1,245 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8-*-
+import imp
+import socket
+import unittest
+import threading
+import mock
+from concurrent import futures
+
+
+def mpd_installed():
+    try:
+        imp.find_module('mpd')
+        # MPDControl imports the Mic, which needs PyAudio
+        imp.find_module('pyaudio')
+    except ImportError:
+        return False
+    else:
+        return True
+
+
+if mpd_installed():
+    import mpd
+    from client.modules import MPDControl
+
+
+class SynchronousExecutor(futures.Executor):
+    """
+    Runs everything right away, on the calling thread.
+    """
+
+    def submit(self, fn, *args, **kwargs):
+        future = futures.Future()
+        try:
+            future.set_result(fn(*args, **kwargs))
+        except Exception as e:
+            future.set_exception(e)
+        return future
+
+
+class StubSTT(object):
+    """
+    Returns engines that only know their phrases instead of compiling
+    vocabularies.
+    """
+
+    def __init__(self):
+        self.compiled = []
+        # If set, called whenever a vocabulary is compiled
+        self.on_compile = None
+
+    def get_instance(self, vocabulary_name, phrases):
+        self.compiled.append(vocabulary_name)
+        if self.on_compile is not None:
+            self.on_compile(vocabulary_name)
+        return mock.Mock(vocabulary_name=vocabulary_name, phrases=phrases)
+
+    def get_instance_async(self, vocabulary_name, phrases, executor):
+        return executor.submit(self.get_instance, vocabulary_name, phrases)
+
+
+@unittest.skipUnless(mpd_installed(), "python-mpd or PyAudio not present")
+class TestMusicMode(unittest.TestCase):
+
+    def setUp(self):
+        self.stt = StubSTT()
+        self.music = mock.Mock()
+        self.music.get_soup_playlist.return_value = ['FAVOURITES']
+        self.music.get_soup_separated.return_value = ['HELP', 'BEATLES']
+        mic = mock.Mock(active_stt_engine=self.stt)
+        with mock.patch.object(MPDControl, 'Mic',
+                               side_effect=lambda speaker, passive, active:
+                               mock.Mock(active_stt_engine=active)):
+            with mock.patch.object(MPDControl.futures, 'ThreadPoolExecutor',
+                                   return_value=SynchronousExecutor()):
+                self.mode = MPDControl.MusicMode('JASPER', mic, self.music)
+
+    def get_phrases(self):
+        return self.mode.mic.active_stt_engine.phrases
+
+    def testLibraryVocabulary(self):
+        self.assertEqual(self.stt.compiled, ['music', 'music-library'])
+        self.assertTrue(self.mode.library_ready)
+        self.assertIn('HELP', self.get_phrases())
+        self.assertIn('FAVOURITES', self.get_phrases())
+        self.music.subscribe.assert_called_once_with(
+            self.mode.handle_mpd_change)
+
+    def testCompilationFailed(self):
+        self.mode.library_ready = False
+
+        def on_compile(vocabulary_name):
+            raise OSError("Phonetisaurus crashed")
+
+        self.stt.on_compile = on_compile
+        with mock.patch.object(self.mode._logger, 'error') as error:
+            self.mode.update_library_vocabulary()
+        self.assertTrue(error.called)
+        self.assertFalse(self.mode.library_ready)
+
+    def testStaleRevision(self):
+        def on_compile(vocabulary_name):
+            # The database changes while the vocabulary is being compiled
+            self.stt.on_compile = None
+            self.music.get_soup_separated.return_value = ['ABBA']
+            self.mode.update_library_vocabulary()
+
+        self.stt.on_compile = on_compile
+        self.mode.update_library_vocabulary()
+        # The first compilation finished last, but is outdated
+        self.assertEqual(self.stt.compiled, ['music', 'music-library',
+                                             'music-library',
+                                             'music-library'])
+        self.assertIn('ABBA', self.get_phrases())
+        self.assertNotIn('HELP', self.get_phrases())
+
+    def testDatabaseChange(self):
+        self.music.get_soup_separated.return_value = ['ABBA']
+        self.mode.handle_mpd_change(['database'])
+        self.music.load_library.assert_called_once_with()
+        self.assertIn('ABBA', self.get_phrases())
+
+    def testPlaylistChange(self):
+        self.music.get_soup_playlist.return_value = ['RUNNING']
+        self.mode.handle_mpd_change(['stored_playlist'])
+        self.music.load_playlists.assert_called_once_with()
+        self.assertIn('RUNNING', self.get_phrases())
+
+    def testPlayerChange(self):
+        self.mode.handle_mpd_change(['player', 'mixer'])
+        self.assertEqual(self.stt.compiled, ['music', 'music-library'])
+        self.assertFalse(self.music.load_library.called)
+
+    def testClose(self):
+        self.mode.close()
+        self.music.unsubscribe.assert_called_once_with(
+            self.mode.handle_mpd_change)
+
+
+@unittest.skipUnless(mpd_installed(), "python-mpd or PyAudio not present")
+class TestMPDWrapper(unittest.TestCase):
+
+    def setUp(self):
+        self.client = mock.Mock()
+        self.client.command_list_end.return_value = [
+            None, {'state': 'play', 'volume': '50'},
+            {'title': 'Help', 'artist': 'The Beatles'}]
+        patcher = mock.patch('mpd.MPDClient', return_value=self.client)
+        self.MPDClient = patcher.start()
+        self.addCleanup(patcher.stop)
+        for patcher in [mock.patch.object(MPDControl, 'MPDWatcher'),
+                        mock.patch.object(MPDControl.MPDWrapper,
+                                          'load_library')]:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.music = MPDControl.MPDWrapper()
+
+    def testExecute(self):
+        self.music.volume(level=60)
+        self.assertEqual([call[0] for call in self.client.method_calls],
+                         ['connect', 'command_list_ok_begin', 'setvol',
+                          'status', 'currentsong', 'command_list_end'])
+        self.client.setvol.assert_called_once_with(60)
+        self.assertEqual(self.music.status['state'], 'play')
+        self.assertEqual(self.music.current_song(), 'Help by The Beatles')
+
+    def testReconnect(self):
+        self.client.command_list_end.side_effect = [
+            mpd.ConnectionError(), [None, {'state': 'pause'}, {}]]
+        self.music.pause()
+        self.assertEqual(self.MPDClient.call_count, 2)
+        self.assertEqual(self.client.connect.call_count, 2)
+        self.assertEqual(self.client.pause.call_count, 2)
+        self.assertEqual(self.music.status, {'state': 'pause'})
+
+    def testReconnectOnce(self):
+        self.client.command_list_end.side_effect = mpd.ConnectionError()
+        with self.assertRaises(mpd.ConnectionError):
+            self.music.next()
+        self.assertEqual(self.MPDClient.call_count, 2)
+
+    def testPlayFallback(self):
+        self.music.songs = mock.Mock()
+        self.music.songs.get.side_effect = lambda row, column: '%d.mp3' % row
+        results = [mpd.CommandError('No such song'),
+                   [None, {'state': 'play'}, {}]]
+
+        def command_list_end():
+            result = results.pop(0)
+            if isinstance(result, Exception):
+                # The songs are added one by one now, and the second one
+                # can't be added
+                self.client.add.reset_mock()
+                error = mpd.CommandError('No such song')
+                self.client.add.side_effect = [None, error, None]
+                raise result
+            return result
+
+        self.client.command_list_end.side_effect = command_list_end
+        self.music.play(songs=[0, 1, 2])
+        self.assertEqual(self.client.add.call_args_list,
+                         [mock.call('0.mp3'), mock.call('1.mp3'),
+                          mock.call('2.mp3')])
+        self.assertEqual(self.client.play.call_count, 2)
+        self.assertEqual(self.music.status, {'state': 'play'})
+
+    def testPlaylistError(self):
+        self.client.command_list_end.side_effect = mpd.CommandError()
+        with self.assertRaises(mpd.CommandError):
+            self.music.play(playlist_name='Favourites')
+        self.assertFalse(self.client.add.called)
+
+
+@unittest.skipUnless(mpd_installed(), "python-mpd or PyAudio not present")
+class TestMPDWatcher(unittest.TestCase):
+
+    def testStop(self):
+        client = mock.Mock()
+        client._sock = mock.Mock()
+        idling = threading.Event()
+        shut_down = threading.Event()
+
+        def idle(*subsystems):
+            idling.set()
+            # Blocks like a real idle command until the connection is shut
+            # down
+            shut_down.wait(5)
+            raise mpd.ConnectionError("Connection lost while reading line")
+
+        client.idle.side_effect = idle
+        client._sock.shutdown.side_effect = lambda how: shut_down.set()
+        callback = mock.Mock()
+
+        with mock.patch('mpd.MPDClient', return_value=client):
+            watcher = MPDControl.MPDWatcher('localhost', 6600, ['database'],
+                                            callback)
+            with mock.patch.object(watcher._logger, 'warning') as warning:
+                watcher.start()
+                self.assertTrue(idling.wait(5))
+                watcher.stop()
+                self.assertFalse(watcher.is_alive())
+                self.assertFalse(warning.called)
+        client._sock.shutdown.assert_called_once_with(socket.SHUT_RDWR)
+        self.assertFalse(callback.called)
+        client.disconnect.assert_called_once_with()
@@ -0,0 +1,89 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8-*-
+import os
+import shutil
+import tempfile
+import unittest
+import mock
+from client import mpdlibrary
+
+PLAYLISTS = {
+    'Favourites': [{'file': 'a.mp3', 'title': 'Hey Jude',
+                    'artist': 'The Beatles', 'album': 'Hey Jude'},
+                   {'file': 'b.mp3', 'title': 'Bohemian Rhapsody',
+                    'artist': ['Queen', 'Freddie Mercury']}],
+    'Running': [{'file': 'b.mp3', 'title': 'Bohemian Rhapsody',
+                 'artist': ['Queen', 'Freddie Mercury']},
+                {'file': 'c.mp3'}]
+}
+
+
+class TestSongCatalogue(unittest.TestCase):
+
+    def setUp(self):
+        self.songs = mpdlibrary.SongCatalogue()
+        self.songs.append('a.mp3', 'HEY JUDE', 'THE BEATLES', 'HEY JUDE')
+        self.songs.append('b.mp3', 'HELP', 'THE BEATLES', '')
+        self.songs.append('c.mp3', '', 'QUEEN', '')
+
+    def testColumns(self):
+        self.assertEqual(len(self.songs), 3)
+        self.assertEqual(self.songs.get(1, 'title'), 'HELP')
+        self.assertEqual(list(self.songs.values('artist')),
+                         ['THE BEATLES', 'THE BEATLES', 'QUEEN'])
+        self.assertEqual(sorted(self.songs.distinct('title')),
+                         ['HELP', 'HEY JUDE'])
+        self.assertEqual(self.songs.find('artist', 'THE BEATLES'), [0, 1])
+        self.assertEqual(self.songs.find('artist', 'HEY JUDE'), [])
+        self.assertEqual(self.songs.find('title', 'ABBA'), [])
+
+        song = self.songs[0]
+        self.assertEqual((song.id, song.title, song.artist, song.album),
+                         ('a.mp3', 'HEY JUDE', 'THE BEATLES', 'HEY JUDE'))
+
+    def testStringsAreStoredOnce(self):
+        self.assertEqual(len(self.songs.to_dict()['strings']), 8)
+
+    def testDict(self):
+        songs = mpdlibrary.SongCatalogue.from_dict(self.songs.to_dict())
+        self.assertEqual(songs.to_dict(), self.songs.to_dict())
+        self.assertEqual(songs.find('title', 'HELP'), [1])
+
+
+class TestLibraryLoader(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.cache_file = os.path.join(self.tempdir, 'library.json')
+        self.client = mock.Mock()
+        self.client.stats.return_value = {'db_update': '1400000000'}
+        self.client.listplaylists.return_value = [
+            {'playlist': name, 'last-modified': '2014-05-01T12:00:00Z'}
+            for name in sorted(PLAYLISTS)]
+        self.client.listplaylistinfo.side_effect = PLAYLISTS.get
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def testLoad(self):
+        songs = mpdlibrary.LibraryLoader().load(self.client)
+        self.assertEqual(list(songs.values('file')),
+                         ['a.mp3', 'b.mp3', 'c.mp3'])
+        self.assertEqual(songs.get(0, 'title'), 'HEY JUDE')
+        self.assertEqual(songs.get(1, 'artist'), 'QUEEN')
+        self.assertEqual(songs.get(1, 'album'), '')
+        self.assertEqual(songs.get(2, 'title'), '')
+        self.assertFalse(self.client.clear.called)
+
+    def testCache(self):
+        loader = mpdlibrary.LibraryLoader(self.cache_file)
+        songs = loader.load(self.client)
+        self.assertEqual(self.client.listplaylistinfo.call_count, 2)
+
+        cached_songs = loader.load(self.client)
+        self.assertEqual(self.client.listplaylistinfo.call_count, 2)
+        self.assertEqual(cached_songs.to_dict(), songs.to_dict())
+
+        self.client.stats.return_value = {'db_update': '1400000001'}
+        loader.load(self.client)
+        self.assertEqual(self.client.listplaylistinfo.call_count, 4)
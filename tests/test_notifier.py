@@ -0,0 +1,85 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8-*-
+import unittest
+from client import notifier
+from client.notifier import Notification
+
+
+class TestNotificationQueue(unittest.TestCase):
+
+    def setUp(self):
+        self.q = notifier.NotificationQueue(maxsize=3)
+
+    def testPriority(self):
+        self.q.put(Notification('first'))
+        self.q.put(Notification('second'))
+        self.q.put(Notification('urgent', priority=Notification.HIGH))
+        self.assertEqual([str(self.q.get()) for i in range(3)],
+                         ['urgent', 'first', 'second'])
+        self.assertIsNone(self.q.get())
+
+    def testDuplicates(self):
+        self.assertTrue(self.q.put(Notification('Alarm', key='alarm')))
+        self.assertFalse(self.q.put(Notification('Alarm', key='alarm')))
+        self.assertEqual(len(self.q), 1)
+        self.q.get()
+        self.assertTrue(self.q.put(Notification('Alarm', key='alarm')))
+
+    def testCoalescing(self):
+        for sender in ('Alice', 'Bob', 'Carol'):
+            self.q.put(Notification('New email from %s.' % sender,
+                                    group='email',
+                                    summary='You have %d new emails.'))
+        self.assertEqual(len(self.q), 1)
+        self.assertEqual(str(self.q.get()), 'You have 3 new emails.')
+
+        self.q.put(Notification('New email from Dave.', group='email',
+                                summary='You have %d new emails.'))
+        self.assertEqual(str(self.q.get()), 'New email from Dave.')
+
+    def testBackpressure(self):
+        for i in range(3):
+            self.assertTrue(self.q.put(Notification(str(i))))
+        self.assertFalse(self.q.put(Notification('dropped')))
+        self.assertTrue(self.q.put(Notification('urgent',
+                                                priority=Notification.HIGH)))
+        self.assertEqual(len(self.q), 3)
+        self.assertEqual([str(self.q.get()) for i in range(3)],
+                         ['urgent', '0', '1'])
+
+
+class DummySource(notifier.NotificationSource):
+
+    INTERVAL = 3600
+
+    def start(self, notify):
+        notify(Notification('pushed'))
+
+    def poll(self):
+        return [Notification('polled')]
+
+
+class UnavailableSource(notifier.NotificationSource):
+
+    @classmethod
+    def is_available(cls, profile):
+        return False
+
+
+class TestNotifier(unittest.TestCase):
+
+    def setUp(self):
+        self.notifier = notifier.Notifier(
+            {}, sources=[DummySource, UnavailableSource])
+
+    def tearDown(self):
+        self.notifier.stop()
+
+    def testSources(self):
+        self.assertEqual([type(source) for source in self.notifier.sources],
+                         [DummySource])
+        self.notifier._poll(self.notifier.sources[0])
+        self.assertEqual([str(notif) for notif in
+                          self.notifier.getAllNotifications()],
+                         ['pushed', 'polled'])
+        self.assertEqual(self.notifier.getAllNotifications(), [])
@@ -0,0 +1,55 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8-*-
+import types
+import unittest
+import mock
+from client import prefetch
+
+
+def get_module(name, phrases=None, interval=None):
+    module = types.ModuleType(name)
+    if phrases is not None:
+        module.prefetch = mock.Mock(return_value=phrases)
+    if interval is not None:
+        module.PREFETCH_INTERVAL = interval
+    return module
+
+
+class TestPrefetcher(unittest.TestCase):
+
+    def setUp(self):
+        self.mic = mock.Mock()
+        self.scheduler = mock.Mock()
+        self.weather = get_module('Weather', ['Sunny.'], 600)
+
+    def get_prefetcher(self, modules, profile={}):
+        return prefetch.Prefetcher(modules, self.mic, profile,
+                                   self.scheduler)
+
+    def testIntervals(self):
+        prefetcher = self.get_prefetcher(
+            [self.weather, get_module('HN', [], 60),
+             get_module('News', [], 60), get_module('Time', interval=60),
+             get_module('Joke', [])],
+            {'prefetch_intervals': {'HN': 120, 'News': 0}})
+        self.assertEqual([prefetcher.get_interval(module)
+                          for module in prefetcher.modules],
+                         [600, 120, None, None, None])
+
+        prefetcher.start()
+        self.assertEqual(self.scheduler.add_job.call_count, 2)
+        args, kwargs = self.scheduler.add_job.call_args_list[0]
+        self.assertEqual(kwargs['seconds'], 600)
+        self.assertEqual(kwargs['args'], [self.weather])
+
+    def testPrefetch(self):
+        prefetcher = self.get_prefetcher([self.weather])
+        prefetcher.prefetch(self.weather)
+        self.weather.prefetch.assert_called_once_with({})
+        self.mic.presynthesize.assert_called_once_with('Sunny.')
+
+    def testPrefetchError(self):
+        self.weather.prefetch.side_effect = IOError()
+        prefetcher = self.get_prefetcher([self.weather])
+        prefetcher.prefetch(self.weather)
+        self.assertFalse(self.mic.presynthesize.called)
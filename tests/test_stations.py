@@ -0,0 +1,74 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8-*-
+import os
+import shutil
+import tempfile
+import unittest
+import mock
+from client import stations
+
+
+def get_row(name, country, latitude, longitude, wmo_id):
+    return '%-25s    %-2s  XXXX     %7.2f %7.2f    10%5s' % (
+        name, country, latitude, longitude, wmo_id)
+
+
+TABLE = '\n'.join(['', 'International cities', '', 'header',
+                   get_row('St. John', 'AG', 17.12, -61.78, '78862'),
+                   get_row('St. John', 'CA', 47.62, -52.75, '71801'),
+                   get_row('London', 'UK', 51.48, -0.45, '03772'),
+                   get_row('Nowhere', 'XX', 10.0, 10.0, ''),
+                   get_row('Suva', 'FJ', -18.05, 178.57, '91680'),
+                   'broken'])
+
+
+class TestStationIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.index = stations.StationIndex(stations.parse_stations(TABLE))
+
+    def testParse(self):
+        self.assertEqual(len(self.index), 4)
+        station = self.index.stations[2]
+        self.assertEqual(station.name, 'London')
+        self.assertEqual(station.country, 'UK')
+        self.assertEqual(station.wmo_id, '03772')
+        self.assertAlmostEqual(station.longitude, -0.45)
+
+    def testFind(self):
+        self.assertEqual([s.wmo_id for s in self.index.find('st john')],
+                         ['78862', '71801'])
+        self.assertEqual(self.index.find('Nowhere'), [])
+
+    def testNearest(self):
+        self.assertEqual(self.index.nearest(48.85, 2.35).name, 'London')
+        self.assertEqual(self.index.nearest(45.0, -60.0).country, 'CA')
+        # Across the date line
+        self.assertEqual(self.index.nearest(-17.0, -179.5).name, 'Suva')
+        self.assertIsNone(stations.StationIndex([]).nearest(0, 0))
+
+    def testDict(self):
+        index = stations.StationIndex.from_dict(self.index.to_dict())
+        self.assertEqual(index.stations, self.index.stations)
+        self.assertEqual(len(index.find('London')), 1)
+        self.assertEqual(index.nearest(51, 0).name, 'London')
+
+
+class TestLoadIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.cache_file = os.path.join(self.tempdir, 'stations.json')
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def testCache(self):
+        with mock.patch.object(stations, 'fetch_stations',
+                               return_value=stations.parse_stations(TABLE)):
+            stations.load_index(self.cache_file)
+        with mock.patch.object(stations, 'fetch_stations') as fetch:
+            index = stations.load_index(self.cache_file)
+            self.assertFalse(fetch.called)
+        self.assertEqual([s.wmo_id for s in index.find('London')],
+                         ['03772'])
@@ -2,16 +2,11 @@
 # -*- coding: utf-8-*-
 import unittest
 import imp
-from client import stt, jasperpath
-
-
-def cmuclmtk_installed():
-    try:
-        imp.find_module('cmuclmtk')
-    except ImportError:
-        return False
-    else:
-        return True
+import tempfile
+import shutil
+import mock
+from concurrent import futures
+from client import stt, jasperpath, vocabcompiler
 
 
 def pocketsphinx_installed():
@@ -23,7 +18,6 @@ def pocketsphinx_installed():
         return True
 
 
-@unittest.skipUnless(cmuclmtk_installed(), "CMUCLMTK not present")
 @unittest.skipUnless(pocketsphinx_installed(), "Pocketsphinx not present")
 class TestSTT(unittest.TestCase):
 
@@ -49,3 +43,35 @@ class TestSTT(unittest.TestCase):
         with open(self.time_clip, mode="rb") as f:
             transcription = self.active_stt_engine.transcribe(f)
         self.assertIn("TIME", transcription)
+
+
+class TestAsyncInstance(unittest.TestCase):
+
+    class DummySTT(stt.AbstractSTTEngine):
+        VOCABULARY_TYPE = vocabcompiler.DummyVocabulary
+
+        def __init__(self, vocabulary):
+            self.vocabulary = vocabulary
+
+        @classmethod
+        def is_available(cls):
+            return True
+
+        def transcribe(self, fp):
+            return ['TEST']
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def testGetInstanceAsync(self):
+        with mock.patch.object(jasperpath, 'CONFIG_PATH', self.tempdir):
+            with futures.ThreadPoolExecutor(max_workers=1) as executor:
+                future = self.DummySTT.get_instance_async('test', ['TEST'],
+                                                          executor)
+                engine = stt.DeferredSTTEngine(future)
+                self.assertEqual(engine.transcribe(None), ['TEST'])
+                self.assertTrue(engine.ready)
+                self.assertTrue(engine.vocabulary.matches_phrases(['TEST']))
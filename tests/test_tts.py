@@ -1,6 +1,7 @@
 #!/usr/bin/env python2
 # -*- coding: utf-8-*-
 import unittest
+import mock
 from client import tts
 
 
@@ -9,3 +10,39 @@ class TestTTS(unittest.TestCase):
         tts_engine = tts.get_engine_by_slug('dummy-tts')
         tts_instance = tts_engine()
         tts_instance.say('This is a test.')
+
+    def testEspeakStream(self):
+        tts_instance = tts.EspeakTTS(stream=True)
+        with mock.patch.object(tts_instance, 'play_stream') as mocked_play:
+            tts_instance.say('This is a test.')
+            cmd = mocked_play.call_args[0][0]
+        self.assertIn('--stdout', cmd)
+        self.assertNotIn('-w', cmd)
+        self.assertEqual(cmd[-1], 'This is a test.')
+
+    def testPresynthesize(self):
+        tts_instance = tts.EspeakTTS()
+        with mock.patch.object(tts_instance, 'synthesize',
+                               return_value='RIFF'):
+            self.assertTrue(tts_instance.presynthesize('This is a test.'))
+        with mock.patch.object(tts_instance, 'play_data') as mocked_play:
+            self.assertTrue(
+                tts_instance.say_presynthesized('This is a test.'))
+            mocked_play.assert_called_once_with('RIFF')
+            self.assertFalse(tts_instance.say_presynthesized('Not cached.'))
+
+    def testPresynthesizeUnsupported(self):
+        tts_instance = tts.DummyTTS()
+        self.assertFalse(tts_instance.presynthesize('This is a test.'))
+        self.assertFalse(tts_instance.say_presynthesized('This is a test.'))
+
+    def testStop(self):
+        tts_instance = tts.EspeakTTS(stream=False)
+        tts_instance.stop()
+        with mock.patch('subprocess.Popen') as popen:
+            tts_instance.play('test.wav')
+            self.assertFalse(popen.called)
+            tts_instance.reset()
+            popen.return_value.poll.return_value = None
+            tts_instance.play('test.wav')
+            self.assertTrue(popen.called)
@@ -1,12 +1,14 @@
 #!/usr/bin/env python2
 # -*- coding: utf-8-*-
+import os
 import unittest
 import tempfile
 import contextlib
 import logging
 import shutil
+import tarfile
 import mock
-from client import vocabcompiler
+from client import vocabcompiler, g2p
 
 
 class TestVocabCompiler(unittest.TestCase):
@@ -90,12 +92,21 @@ class TestVocabulary(unittest.TestCase):
             self.vocab.compile(phrases, force=True)
 
 
+def phonetisaurus_installed():
+    try:
+        g2p.PhonetisaurusG2P(**g2p.PhonetisaurusG2P.get_config())
+    except OSError:
+        return False
+    else:
+        return True
+
+
 class TestPocketsphinxVocabulary(TestVocabulary):
 
     VOCABULARY = vocabcompiler.PocketsphinxVocabulary
 
-    @unittest.skipUnless(hasattr(vocabcompiler, 'cmuclmtk'),
-                         "CMUCLMTK not present")
+    @unittest.skipUnless(phonetisaurus_installed(),
+                         "Phonetisaurus or fst_model not present")
     def testVocabulary(self):
         super(TestPocketsphinxVocabulary, self).testVocabulary()
         self.assertIsInstance(self.vocab.decoder_kwargs, dict)
@@ -104,16 +115,10 @@ class TestPocketsphinxVocabulary(TestVocabulary):
 
     def testPatchedVocabulary(self):
 
-        def write_test_vocab(text, output_file):
-            with open(output_file, "w") as f:
-                for word in text.split(' '):
-                    f.write("%s\n" % word)
-
-        def write_test_lm(text, output_file, **kwargs):
-            with open(output_file, "w") as f:
-                f.write("TEST")
-
         class DummyG2P(object):
+            fst_model = os.devnull
+            nbest = None
+
             def __init__(self, *args, **kwargs):
                 pass
 
@@ -127,9 +132,137 @@ class TestPocketsphinxVocabulary(TestVocabulary):
                         'BAD': ['B AE D'],
                         'UGLY': ['AH G L IY']}
 
-        with mock.patch('client.vocabcompiler.cmuclmtk',
-                        create=True) as mocked_cmuclmtk:
-            mocked_cmuclmtk.text2vocab = write_test_vocab
-            mocked_cmuclmtk.text2lm = write_test_lm
-            with mock.patch('client.vocabcompiler.PhonetisaurusG2P', DummyG2P):
-                self.testVocabulary()
+        with mock.patch('client.vocabcompiler.PhonetisaurusG2P', DummyG2P):
+            self.testVocabulary()
+
+    def testIncrementalCompilation(self):
+
+        class DummyG2P(object):
+            fst_model = os.devnull
+            nbest = None
+            translated_words = []
+
+            def __init__(self, *args, **kwargs):
+                pass
+
+            @classmethod
+            def get_config(self, *args, **kwargs):
+                return {}
+
+            def translate(self, words):
+                DummyG2P.translated_words.extend(words)
+                return dict((word, [word.lower()]) for word in words)
+
+        with self.do_in_tempdir() as tempdir:
+            vocab = self.VOCABULARY(path=tempdir)
+            with mock.patch('client.vocabcompiler.PhonetisaurusG2P',
+                            DummyG2P):
+                with mock.patch.object(
+                        vocab, '_compile_languagemodel',
+                        wraps=vocab._compile_languagemodel) as mocked_lm:
+                    vocab.compile(['GOOD BAD'])
+                    self.assertEqual(sorted(DummyG2P.translated_words),
+                                     ['BAD', 'GOOD'])
+                    vocab.compile(['GOOD BAD', 'UGLY'])
+                    self.assertEqual(sorted(DummyG2P.translated_words),
+                                     ['BAD', 'GOOD', 'UGLY'])
+                    self.assertEqual(mocked_lm.call_count, 1)
+                    vocab.compile(['GOOD', 'UGLY'])
+
+            self.assertTrue(vocab.matches_phrases(['GOOD', 'UGLY']))
+            with open(vocab.dictionary_file, 'r') as f:
+                self.assertEqual(f.read(), "GOOD\tgood\nUGLY\tugly\n")
+            with open(vocab.languagemodel_file, 'r') as f:
+                self.assertIn('UGLY', f.read())
+
+
+class TestVocabularyStore(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.vocab = vocabcompiler.DummyVocabulary(path=self.tempdir)
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def testSwitchRevisions(self):
+        self.vocab.compile(['GOOD'])
+        self.vocab.compile(['BAD'])
+        self.assertTrue(os.path.islink(self.vocab.path))
+        self.assertTrue(self.vocab.matches_phrases(['BAD']))
+
+        # Switching back to a known revision must not recompile it
+        with mock.patch.object(self.vocab,
+                               '_compile_vocabulary') as mocked_compile:
+            self.vocab.compile(['GOOD'])
+            self.assertFalse(mocked_compile.called)
+        self.assertTrue(self.vocab.matches_phrases(['GOOD']))
+
+    def testFailedCompilation(self):
+        self.vocab.compile(['GOOD'])
+        logging.disable(logging.ERROR)
+        with mock.patch.object(self.vocab, '_compile_vocabulary',
+                               side_effect=RuntimeError('test')):
+            with self.assertRaises(RuntimeError):
+                self.vocab.compile(['BAD'])
+        logging.disable(logging.NOTSET)
+        # The old revision must still be in use and no leftovers of the
+        # failed build may remain in the store
+        self.assertTrue(self.vocab.matches_phrases(['GOOD']))
+        self.assertEqual(os.listdir(self.vocab.revisions_path),
+                         [self.vocab.compiled_revision])
+
+    def testCollectGarbage(self):
+        other_vocab = vocabcompiler.DummyVocabulary(name='other',
+                                                    path=self.tempdir)
+        other_vocab.compile(['OTHER'])
+        with mock.patch.object(self.vocab, 'MAX_REVISIONS', 3):
+            for phrase in ['ONE', 'TWO', 'THREE', 'FOUR']:
+                self.vocab.compile([phrase])
+        revisions = os.listdir(self.vocab.revisions_path)
+        self.assertEqual(len(revisions), 3)
+        self.assertIn(other_vocab.compiled_revision, revisions)
+        self.assertIn(self.vocab.phrases_to_revision(['FOUR']), revisions)
+        self.assertIn(self.vocab.phrases_to_revision(['THREE']), revisions)
+
+
+class TestVoxForgeLexicon(unittest.TestCase):
+
+    LEXICON = ("[GOOD]\tg uh d\n" +
+               "[GOOD]\tg uw d\n" +
+               "[BAD]\tb ae d\n")
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        dict_file = os.path.join(self.tempdir, 'VoxForgeDict')
+        with open(dict_file, 'w') as f:
+            f.write(self.LEXICON)
+        self.lexicon_file = os.path.join(self.tempdir, 'VoxForge.tgz')
+        with contextlib.closing(tarfile.open(self.lexicon_file,
+                                             'w:gz')) as tf:
+            tf.add(dict_file, arcname='VoxForge/VoxForgeDict')
+        self.index_path = os.path.join(self.tempdir, 'index')
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def testTranslateWord(self):
+        Lexicon = vocabcompiler.JuliusVocabulary.VoxForgeLexicon
+        lexicon = Lexicon(self.lexicon_file, 'VoxForge/VoxForgeDict',
+                          index_path=self.index_path)
+        self.assertEqual(lexicon.translate_word('GOOD'),
+                         ['g uh d', 'g uw d'])
+        self.assertEqual(lexicon.translate_word('BAD'), ['b ae d'])
+        self.assertEqual(lexicon.translate_word('UGLY'), [])
+        # Phrases of modules may be unicode already
+        self.assertEqual(lexicon.translate_word(u'BAD'), ['b ae d'])
+        self.assertEqual(lexicon.translate_word(u'CAF\xc9'), [])
+        lexicon.close()
+
+        # The index has to be reused instead of parsing the lexicon again
+        with mock.patch.object(Lexicon, 'parse') as mocked_parse:
+            lexicon = Lexicon(self.lexicon_file, 'VoxForge/VoxForgeDict',
+                              index_path=self.index_path)
+            self.assertEqual(lexicon.translate_word('BAD'), ['b ae d'])
+            self.assertFalse(mocked_parse.called)
+            lexicon.close()